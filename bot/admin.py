@@ -1,26 +1,97 @@
-import os
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
 
-from django.contrib import admin
-from telegram import Bot,error
+from .answers import invalidate_answers
+from .archive import archive_meetup
+from .export import (CONTENT_TYPES, EXPORT_FORMATS, ExportError,
+                     export_questions, iter_question_rows, render_export)
+from .mailing import enqueue_mailing
+from .models import (ArchivedPresentation, ArchivedQuestion, Event,
+                     EventGroup, MailingJob, MailingList, Meetup,
+                     OutboxMessage, Presentation, Profile, Question)
+from .program_import import ProgramImportError, guess_format, import_program
 
+# Changes listed on the dry run page, the rest are only counted
+IMPORT_CHANGES_SHOWN = 500
+# Smaller tables are counted exactly
+ESTIMATED_COUNT_MIN = 10000
+QUESTION_SEARCH_LISTENERS = 1000
 
-from .models import (Event, EventGroup, MailingList, Presentation, Profile,
-                     Question)
+
+def estimate_count(model):
+    """Approximate number of rows of the model's table, None if unknown.
+
+    Only Postgres keeps a row estimate, other databases are counted.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        # Kept up to date by autovacuum, -1 before the first ANALYZE
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that takes the size of an unfiltered list from table stats.
+
+    COUNT(*) reads the whole table, on a large table it costs more than
+    the page itself.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimate_count(self.object_list.model)
+            if estimate and estimate >= ESTIMATED_COUNT_MIN:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # A filtered page shows "N results" without counting the whole table
+    show_full_result_count = False
 
 
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'event_group', 'is_presentation')
     list_filter = ['is_presentation']
+    list_select_related = ['event_group']
+    search_fields = ['title__startswith']
+    autocomplete_fields = ['event_group']
 
 
 @admin.register(Presentation)
-class PresentationAdmin(admin.ModelAdmin):
-    list_filter = ['event__event_group__title', 'event__is_presentation', 'speaker']
+class PresentationAdmin(LargeTableAdmin):
+    list_display = ('title', 'event', 'speaker')
+    list_filter = ['event__event_group__title', 'event__is_presentation']
+    list_select_related = ['event', 'speaker']
+    search_fields = ['title__startswith', 'speaker__name__startswith']
+    autocomplete_fields = ['event', 'speaker']
 
 
 @admin.register(Profile)
-class ProfileAdmin(admin.ModelAdmin):
-    list_display = ('name', 'is_speaker')
+class ProfileAdmin(LargeTableAdmin):
+    list_display = ('name', 'telegram_username', 'company', 'is_speaker',
+                    'ready_meet')
+    list_filter = ['is_speaker', 'ready_meet']
+    search_fields = ['telegram_id__exact', 'telegram_username__startswith',
+                     'name__startswith']
 
 
 @admin.register(MailingList)
@@ -29,17 +100,271 @@ class MailingListAdmin(admin.ModelAdmin):
 
     @admin.action(description='Рассылка уведомлений')
     def send_newsletter(self, request, queryset):
-        tg_token = os.getenv("TG_TOKEN")
-        bot = Bot(tg_token)
-        recipients = [profile.telegram_id for profile in Profile.objects.all()]
         for newsletter in queryset:
-            message = newsletter.message
-            for recipient in recipients:
-                try:
-                    bot.send_message(chat_id=recipient, text=message)
-                except error.BadRequest:
-                    print(f"Пользователь {recipient} не найден")
+            job = enqueue_mailing(newsletter)
+            self.message_user(
+                request,
+                f'{newsletter}: поставлена в очередь, получателей {job.total}',
+            )
+
+
+@admin.register(MailingJob)
+class MailingJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'progress', 'sent', 'failed',
+                    'total', 'created_at', 'heartbeat_at', 'finished_at')
+    list_filter = ['status']
+    list_select_related = ['mailing']
+    readonly_fields = ('mailing', 'status', 'total', 'sent', 'failed',
+                       'created_at', 'heartbeat_at', 'finished_at')
+
+    @admin.display(description='прогресс')
+    def progress(self, job):
+        if not job.total:
+            return '-'
+        return f'{(job.sent + job.failed) / job.total:.0%}'
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'status', 'attempts', 'created_at',
+                    'next_attempt_at', 'sent_at', 'error')
+    list_filter = ['status']
+    readonly_fields = ('chat_id', 'text', 'status', 'attempts', 'error',
+                       'created_at', 'next_attempt_at', 'sent_at')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Question)
+class QuestionAdmin(LargeTableAdmin):
+    list_display = ('id', 'short_text', 'presentation', 'listener',
+                    'is_active')
+    list_filter = ['is_active']
+    list_select_related = ['presentation', 'listener']
+    ordering = ['-id']
+    # Searched by the listener, see get_search_results
+    search_fields = ['listener__telegram_id__exact',
+                     'listener__telegram_username__startswith',
+                     'listener__name__startswith']
+    autocomplete_fields = ['presentation', 'listener', 'extra_listeners']
+
+    def get_urls(self):
+        urls = [
+            path(
+                'export/',
+                self.admin_site.admin_view(self.export_view),
+                name='bot_question_export',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def export_view(self, request):
+        """Stream the questions as CSV or JSON Lines.
+
+        Filtered by the meetup, event_group and presentation ids from the
+        query.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if settings.ASGI:
+            # Django 4.0 reads a streaming response inside the event loop,
+            # where the ORM is not allowed
+            self.message_user(
+                request,
+                'Под ASGI выгрузите вопросы командой export_questions',
+                level=messages.WARNING,
+            )
+            return redirect('admin:bot_question_changelist')
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return HttpResponseBadRequest()
+        try:
+            filters = {
+                name: int(request.GET[name])
+                for name in ('meetup', 'event_group', 'presentation')
+                if request.GET.get(name)
+            }
+            questions = export_questions(
+                meetup_id=filters.get('meetup'),
+                event_group_id=filters.get('event_group'),
+                presentation_id=filters.get('presentation'),
+            )
+        except (ValueError, ExportError):
+            return HttpResponseBadRequest()
+        rows = iter_question_rows(questions)
+        response = StreamingHttpResponse(
+            render_export(rows, export_format),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = \
+            f'attachment; filename="questions.{export_format}"'
+        return response
+
+    def get_search_results(self, request, queryset, search_term):
+        """Find the listeners first, then their questions by the FK index.
+
+        Filtering through the join makes the database walk the questions
+        in page order checking every listener.
+        """
+        if not search_term:
+            return queryset, False
+        profiles, _ = self.admin_site._registry[Profile].get_search_results(
+            request, Profile.objects.all(), search_term)
+        listener_ids = list(
+            profiles.values_list('id', flat=True)[:QUESTION_SEARCH_LISTENERS])
+        return queryset.filter(listener_id__in=listener_ids), False
+
+    @admin.display(description='текст вопроса')
+    def short_text(self, question):
+        return question.text[:80]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        speaker_ids = {obj.presentation.speaker_id}
+        if 'presentation' in form.changed_data and form.initial:
+            speaker_ids.add(Presentation.objects
+                            .values_list('speaker_id', flat=True)
+                            .get(id=form.initial['presentation']))
+        for speaker_id in speaker_ids:
+            invalidate_answers(speaker_id)
+
+    def delete_model(self, request, obj):
+        speaker_id = obj.presentation.speaker_id
+        super().delete_model(request, obj)
+        invalidate_answers(speaker_id)
+
+    def delete_queryset(self, request, queryset):
+        speaker_ids = set(
+            queryset.values_list('presentation__speaker_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for speaker_id in speaker_ids:
+            invalidate_answers(speaker_id)
+
+
+class ProgramImportForm(forms.Form):
+    file = forms.FileField(
+        label='файл',
+        help_text='CSV или JSON Lines с колонками group, event, time_from, '
+                  'time_to, is_presentation, presentation, description, '
+                  'speaker, speaker_username',
+    )
+    meetup = forms.ModelChoiceField(
+        Meetup.objects.filter(archived_at__isnull=True),
+        label='митап',
+        required=False,
+        help_text='По умолчанию текущий',
+    )
+    dry_run = forms.BooleanField(
+        label='только показать изменения', required=False, initial=True)
+
+
+@admin.register(Meetup)
+class MeetupAdmin(admin.ModelAdmin):
+    list_display = ('title', 'starts_on', 'ends_on', 'time_zone',
+                    'archived_at')
+    actions = ['archive']
+
+    @admin.action(description='Перенести в архив')
+    def archive(self, request, queryset):
+        for meetup in queryset.filter(archived_at__isnull=True):
+            presentations, questions = archive_meetup(meetup)
+            self.message_user(
+                request,
+                f'{meetup}: в архиве докладов {presentations}, '
+                f'вопросов {questions}',
+            )
+
+
+@admin.register(EventGroup)
+class EventGroupAdmin(admin.ModelAdmin):
+    list_display = ('title', 'day', 'meetup')
+    list_filter = ['meetup', 'day']
+    list_select_related = ['meetup']
+    search_fields = ['title__startswith']
+
+    def get_urls(self):
+        urls = [
+            path(
+                'import/',
+                self.admin_site.admin_view(self.import_view),
+                name='bot_eventgroup_import',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        if not (self.has_add_permission(request)
+                and self.has_change_permission(request)):
+            raise PermissionDenied
+        form = ProgramImportForm(request.POST or None, request.FILES or None)
+        changes = []
+        report = None
+
+        def show_change(action, kind, label):
+            if len(changes) < IMPORT_CHANGES_SHOWN:
+                changes.append(f'{action} {kind}: {label}')
+
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            dry_run = form.cleaned_data['dry_run']
+            meetup = form.cleaned_data['meetup']
+            try:
+                report = import_program(
+                    upload.file,
+                    guess_format(upload.name),
+                    meetup_id=meetup and meetup.id,
+                    dry_run=dry_run,
+                    on_change=show_change,
+                )
+            except ProgramImportError as error:
+                form.add_error('file', str(error))
+            else:
+                if dry_run:
+                    message = f'Проверка: {report}'
+                else:
+                    message = f'Программа загружена. {report}'
+                self.message_user(request, message)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Импорт программы',
+            'opts': self.model._meta,
+            'form': form,
+            'report': report,
+            'changes': changes,
+        }
+        return TemplateResponse(
+            request, 'admin/bot/eventgroup/import.html', context)
+
+
+class ArchiveAdmin(LargeTableAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedPresentation)
+class ArchivedPresentationAdmin(ArchiveAdmin):
+    list_display = ('title', 'speaker_name', 'group_title', 'day',
+                    'time_from', 'meetup')
+    list_filter = ['meetup']
+    list_select_related = ['meetup']
+    search_fields = ['title__startswith', 'speaker_name__startswith']
+
 
+@admin.register(ArchivedQuestion)
+class ArchivedQuestionAdmin(ArchiveAdmin):
+    list_display = ('original_id', 'short_text', 'presentation', 'listener',
+                    'is_active')
+    list_filter = ['presentation__meetup', 'is_active']
+    list_select_related = ['presentation', 'listener']
+    ordering = ['-id']
 
-admin.site.register(EventGroup)
-admin.site.register(Question)
+    @admin.display(description='текст вопроса')
+    def short_text(self, question):
+        return question.text[:80]
@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Profile, Question
+from .program import get_program
+
+# https://core.telegram.org/bots/api#sendmessage
+MESSAGE_LIMIT = 4096
+# Room left on every page for the page number
+PAGE_FOOTER_RESERVE = 40
+ANSWERS_CACHE_SIZE = 256
+PAGE_HEADER = 'Если вы не нашли ответ на ваш вопрос, то задайте свой'
+NO_ANSWERS_TEXT = 'Еще нет вопросов с ответами'
+
+_pages = OrderedDict()
+_lock = threading.Lock()
+
+
+def format_answer(question_id, text, answer):
+    return f'Вопрос {question_id}:\n{text}\n\nОтвет:\n{answer}'
+
+
+def split_pages(items, header=PAGE_HEADER, limit=MESSAGE_LIMIT):
+    """Pack the items into as few messages as fit the limit.
+
+    Every page starts with the header, an item too long for a page of
+    its own is cut.
+    """
+    page_limit = limit - PAGE_FOOTER_RESERVE
+    item_limit = page_limit - len(header) - 2
+    pages = []
+    page, size = [header], len(header)
+    for item in items:
+        if len(item) > item_limit:
+            item = item[:item_limit - 1] + '…'
+        if size + 2 + len(item) > page_limit:
+            pages.append('\n\n'.join(page))
+            page, size = [header], len(header)
+        page.append(item)
+        size += 2 + len(item)
+    if len(page) > 1:
+        pages.append('\n\n'.join(page))
+    return pages
+
+
+def render_answered_pages(speaker_id, program=None):
+    """Answers of the speaker at the active meetup split into pages"""
+    program = program or get_program()
+    questions = Question.objects \
+        .filter(presentation_id__in=program.speaker_presentation_ids(
+            speaker_id), is_active=False) \
+        .order_by('id') \
+        .values_list('id', 'text', 'answer')
+    return tuple(split_pages(
+        format_answer(*question) for question in questions.iterator()))
+
+
+def get_answered_pages(speaker_id):
+    """Return the rendered answers of the speaker, cached per version"""
+    program = get_program()
+    version = (program.version, Profile.objects
+               .filter(id=speaker_id)
+               .values_list('answers_version', flat=True)
+               .first())
+    with _lock:
+        cached = _pages.get(speaker_id)
+        if cached and cached[0] == version:
+            _pages.move_to_end(speaker_id)
+            return cached[1]
+    pages = render_answered_pages(speaker_id, program)
+    with _lock:
+        _pages[speaker_id] = (version, pages)
+        _pages.move_to_end(speaker_id)
+        while len(_pages) > ANSWERS_CACHE_SIZE:
+            _pages.popitem(last=False)
+    return pages
+
+
+def get_cached_answered_pages(speaker_id):
+    """Pages the user is turning, not checked against the database"""
+    with _lock:
+        cached = _pages.get(speaker_id)
+    if cached:
+        return cached[1]
+    return get_answered_pages(speaker_id)
+
+
+def page_text(pages, number):
+    if len(pages) == 1:
+        return pages[0]
+    return f'{pages[number]}\n\nСтраница {number + 1} из {len(pages)}'
+
+
+def forget_answered_pages(speaker_id):
+    with _lock:
+        _pages.pop(speaker_id, None)
+
+
+def invalidate_answers(speaker_id):
+    """Mark the rendered answers of the speaker as outdated everywhere"""
+    Profile.objects \
+        .filter(id=speaker_id) \
+        .update(answers_version=F('answers_version') + 1)
+    transaction.on_commit(lambda: forget_answered_pages(speaker_id))
+
+
+def clear_answers_cache():
+    with _lock:
+        _pages.clear()
@@ -0,0 +1,133 @@
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from .batching import batches
+from .duplicates import clear_question_indexes
+from .models import (ArchivedPresentation, ArchivedQuestion, EventGroup,
+                     Meetup, Presentation, Question)
+from .profiles import refresh_speaker_flags
+
+ARCHIVE_BATCH_SIZE = 2000
+
+
+def finished_meetups(today=None):
+    """Meetups that are over and still in the working tables"""
+    today = today or timezone.localdate()
+    return Meetup.objects \
+        .filter(archived_at__isnull=True, ends_on__lt=today) \
+        .order_by('starts_on', 'id')
+
+
+def _archive_presentations(meetup, batch_size):
+    """Copy the presentations, return {presentation id: archived id}"""
+    presentations = Presentation.objects \
+        .filter(event__event_group__meetup=meetup) \
+        .order_by('id') \
+        .values_list('id', 'event__event_group__title',
+                     'event__event_group__day', 'event__title',
+                     'event__time_from', 'event__time_to', 'title',
+                     'description', 'speaker_id', 'speaker__name')
+    archived_ids = {}
+    for batch in batches(presentations.iterator(batch_size), batch_size):
+        archived = ArchivedPresentation.objects.bulk_create(
+            ArchivedPresentation(
+                meetup=meetup,
+                original_id=presentation_id,
+                group_title=group_title,
+                day=day,
+                event_title=event_title,
+                time_from=time_from,
+                time_to=time_to,
+                title=title,
+                description=description,
+                speaker_id=speaker_id,
+                speaker_name=speaker_name,
+            )
+            for (presentation_id, group_title, day, event_title, time_from,
+                 time_to, title, description, speaker_id, speaker_name)
+            in batch
+        )
+        archived_ids.update(
+            (presentation.original_id, presentation.id)
+            for presentation in archived
+        )
+    return archived_ids
+
+
+def _archive_questions(questions, archived_ids, batch_size):
+    """Copy the questions batch by batch, deleting the copied ones"""
+    rows = questions \
+        .order_by('id') \
+        .values_list('id', 'presentation_id', 'listener_id', 'text',
+                     'answer', 'is_active')
+    joined = Question.extra_listeners.through.objects
+    count = 0
+    last_id = 0
+    # Read by id ranges, not with an open cursor over the rows deleted
+    batch = list(rows.filter(id__gt=last_id)[:batch_size])
+    while batch:
+        question_ids = [row[0] for row in batch]
+        extra_listeners = Counter(
+            joined
+            .filter(question_id__in=question_ids)
+            .values_list('question_id', flat=True)
+        )
+        ArchivedQuestion.objects.bulk_create(
+            ArchivedQuestion(
+                presentation_id=archived_ids[presentation_id],
+                original_id=question_id,
+                listener_id=listener_id,
+                extra_listeners_count=extra_listeners[question_id],
+                text=text,
+                answer=answer,
+                is_active=is_active,
+            )
+            for question_id, presentation_id, listener_id, text, answer,
+            is_active in batch
+        )
+        # Questions send no signals, so Django only reads their ids and
+        # deletes the batch with a statement per table
+        joined.filter(question_id__in=question_ids).delete()
+        Question.objects.filter(id__in=question_ids).only('id').delete()
+        count += len(batch)
+        last_id = question_ids[-1]
+        batch = list(rows.filter(id__gt=last_id)[:batch_size])
+    return count
+
+
+def archive_meetup(meetup, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move the presentations and questions of the meetup to the archive.
+
+    Its groups, events, presentations and questions are then deleted from
+    the working tables, so the bot's queries and indexes only cover the
+    meetups to come. Return the number of archived presentations and
+    questions.
+    """
+    with transaction.atomic():
+        meetup = Meetup.objects.select_for_update().get(id=meetup.id)
+        if meetup.archived_at:
+            return 0, 0
+        speaker_ids = set(
+            Presentation.objects
+            .filter(event__event_group__meetup=meetup)
+            .values_list('speaker_id', flat=True)
+        )
+        archived_ids = _archive_presentations(meetup, batch_size)
+        questions = Question.objects.filter(
+            presentation__event__event_group__meetup=meetup)
+        question_count = _archive_questions(
+            questions, archived_ids, batch_size)
+
+        # The program is small next to the questions, the cascade and
+        # its signals are affordable
+        EventGroup.objects.filter(meetup=meetup).delete()
+
+        # Saving the meetup bumps the program version, the cached answer
+        # pages are checked against it
+        meetup.archived_at = timezone.now()
+        meetup.save(update_fields=['archived_at'])
+        refresh_speaker_flags(speaker_ids)
+        transaction.on_commit(clear_question_indexes)
+    return len(archived_ids), question_count
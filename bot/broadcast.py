@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from telegram import error
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+MESSAGES_PER_SECOND = 30
+CHAT_MESSAGE_INTERVAL = 1
+BROADCAST_WORKERS = 8
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+
+
+class RateLimiter:
+    """Global token bucket plus a minimal interval between messages to a chat"""
+
+    def __init__(self, rate=MESSAGES_PER_SECOND,
+                 chat_interval=CHAT_MESSAGE_INTERVAL):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self._tokens = float(rate)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0
+        self._chat_next_at = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id):
+        """Block until a message to the chat is allowed"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.rate,
+                    self._tokens + (now - self._updated_at) * self.rate,
+                )
+                self._updated_at = now
+                wait = max(
+                    self._paused_until - now,
+                    self._chat_next_at.get(chat_id, 0) - now,
+                    (1 - self._tokens) / self.rate,
+                )
+                if wait <= 0:
+                    self._tokens -= 1
+                    self._chat_next_at[chat_id] = now + self.chat_interval
+                    return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop all senders, Telegram asked to retry later"""
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + seconds)
+
+
+@dataclass
+class BroadcastReport:
+    total: int = 0
+    sent: int = 0
+    retries: int = 0
+    failures: Counter = field(default_factory=Counter)
+    elapsed: float = 0
+
+    @property
+    def rate(self):
+        if not self.elapsed:
+            return 0
+        return self.sent / self.elapsed
+
+    def __str__(self) -> str:
+        text = (
+            f'Отправлено {self.sent} из {self.total} '
+            f'за {self.elapsed:.1f} с ({self.rate:.1f} сообщ./с)'
+        )
+        if self.failures:
+            failures = ', '.join(
+                f'{name}: {count}' for name, count in self.failures.items())
+            text += f', ошибки: {failures}'
+        return text
+
+
+def send_with_retry(bot, limiter, chat_id, text, max_attempts=MAX_ATTEMPTS):
+    """Send a message honouring flood control, retry network failures.
+
+    Return the number of retries made.
+    """
+    for attempt in range(max_attempts):
+        limiter.acquire(chat_id)
+        try:
+            bot.send_message(chat_id=chat_id, text=text)
+            return attempt
+        except error.RetryAfter as exc:
+            limiter.pause(exc.retry_after)
+            last_error = exc
+        except (error.BadRequest, error.ChatMigrated):
+            raise
+        except (error.TimedOut, error.NetworkError) as exc:
+            time.sleep(BACKOFF_BASE * 2 ** attempt)
+            last_error = exc
+    raise last_error
+
+
+def broadcast(bot, chat_ids, text, workers=BROADCAST_WORKERS,
+              limiter=None, on_result=None):
+    """Send the text to every chat with a bounded pool of workers.
+
+    on_result(chat_id, exc) is called in the calling thread after each
+    delivery, exc is None on success.
+    """
+    limiter = limiter or RateLimiter()
+    report = BroadcastReport()
+    started_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(send_with_retry, bot, limiter, chat_id, text):
+                chat_id
+            for chat_id in chat_ids
+        }
+        report.total = len(futures)
+        for future in as_completed(futures):
+            exc = future.exception()
+            if exc is None:
+                report.sent += 1
+                report.retries += future.result()
+            else:
+                report.failures[type(exc).__name__] += 1
+            if on_result:
+                on_result(futures[future], exc)
+    report.elapsed = time.monotonic() - started_at
+    return report
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from queue import Queue
+
+from django.db import connections
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from .sharding import shard_for
+
+logger = logging.getLogger(__name__)
+
+# A connection idle for longer is pinged before use, the server may have
+# dropped it or restarted meanwhile
+DB_IDLE_CHECK_INTERVAL = 30
+
+
+def prepare_connections(last_used):
+    """Close broken, expired and dead idle connections of this thread.
+
+    Django opens a new connection on the next query. Return the time the
+    connections are used at.
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        connection.close_if_unusable_or_obsolete()
+        if connection.connection is not None \
+                and now - last_used > DB_IDLE_CHECK_INTERVAL \
+                and not connection.is_usable():
+            connection.close()
+    return now
+
+
+class StripedExecutor:
+    """Threads running tasks with the same key one by one, in order"""
+
+    def __init__(self, threads, name='handler'):
+        self.queues = [Queue() for _ in range(threads)]
+        self.threads = [
+            threading.Thread(
+                target=self._work,
+                args=(queue,),
+                name=f'{name}-{index}',
+                daemon=True,
+            )
+            for index, queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, function, *args):
+        self.queues[key % len(self.queues)].put((function, args))
+
+    def shutdown(self):
+        """Finish the submitted tasks and stop the threads"""
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    @staticmethod
+    def _work(queue):
+        last_used = time.monotonic()
+        try:
+            while True:
+                task = queue.get()
+                if task is None:
+                    return
+                function, args = task
+                last_used = prepare_connections(last_used)
+                try:
+                    function(*args)
+                except Exception:
+                    logger.exception('Task failed')
+        finally:
+            connections.close_all()
+
+
+class ConcurrentDispatcher(Dispatcher):
+    """Dispatcher running handlers on a pool of threads.
+
+    Updates of a user are processed by the same thread in order, so
+    conversations keep their state transitions consistent.
+    """
+
+    def __init__(self, *args, handler_threads=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handler_threads = handler_threads
+        self.executor = None
+        self._executor_lock = threading.Lock()
+
+    def process_update(self, update):
+        if not isinstance(update, Update):
+            super().process_update(update)
+            return
+        with self._executor_lock:
+            if self.executor is None:
+                self.executor = StripedExecutor(self.handler_threads)
+        self.executor.submit(
+            shard_for(update, self.handler_threads),
+            super().process_update,
+            update,
+        )
+
+    def stop(self):
+        super().stop()
+        with self._executor_lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown()
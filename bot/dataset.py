@@ -0,0 +1,173 @@
+import random
+from datetime import time as day_time
+
+from django.db import transaction
+
+from .batching import batches
+from .matchmaking import reset_matchmaking
+from .models import Event, EventGroup, Presentation, Profile, Question
+from .profiles import clear_profile_cache
+from .program import bump_program_version, default_meetup
+
+DATASET_FIRST_ID = 7_000_000_000
+DATASET_GROUP_PREFIX = 'Датасет'
+DATASET_USERNAME_PREFIX = 'dataset_'
+BATCH_SIZE = 5000
+
+FIRST_NAMES = [
+    'Александр', 'Мария', 'Иван', 'Анна', 'Дмитрий', 'Елена', 'Сергей',
+    'Ольга', 'Андрей', 'Наталья', 'Михаил', 'Татьяна', 'Алексей', 'Ирина',
+]
+LAST_NAMES = [
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров',
+    'Соколов', 'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков',
+]
+COMPANIES = ['ООО Ромашка', 'Яндекс', 'Сбер', 'Тинькофф', 'Авито', 'VK']
+JOBS = ['Разработчик', 'Тимлид', 'Аналитик', 'Тестировщик', 'CTO', 'DevOps']
+
+
+def _create_profiles(rng, count, speakers):
+    profile_ids = []
+    for batch in batches(range(count), BATCH_SIZE):
+        telegram_ids = [str(DATASET_FIRST_ID + number) for number in batch]
+        Profile.objects.bulk_create(
+            Profile(
+                name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} '
+                     f'{number}',
+                telegram_id=telegram_id,
+                telegram_username=f'{DATASET_USERNAME_PREFIX}{number}',
+                company=rng.choice(COMPANIES),
+                job=rng.choice(JOBS),
+                ready_meet=rng.random() < 0.3,
+                is_speaker=number < speakers,
+            )
+            for number, telegram_id in zip(batch, telegram_ids)
+        )
+        profile_ids.extend(
+            Profile.objects
+            .filter(telegram_id__in=telegram_ids)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+    return profile_ids
+
+
+def _create_program(groups, events_per_group):
+    meetup = default_meetup()
+    EventGroup.objects.bulk_create(
+        EventGroup(title=f'{DATASET_GROUP_PREFIX} поток {number}',
+                   meetup=meetup, day=meetup.starts_on)
+        for number in range(1, groups + 1)
+    )
+    group_ids = EventGroup.objects \
+        .filter(title__startswith=DATASET_GROUP_PREFIX) \
+        .order_by('id') \
+        .values_list('id', flat=True)
+    events = []
+    for group_number, group_id in enumerate(group_ids, start=1):
+        for slot in range(events_per_group):
+            hour = 9 + slot % 12
+            is_presentation = slot % 4 != 3
+            title = f'Доклады {group_number}.{slot + 1}' if is_presentation \
+                else 'Кофе-брейк'
+            events.append(Event(
+                title=title,
+                time_from=day_time(hour),
+                time_to=day_time(hour, 50),
+                event_group_id=group_id,
+                is_presentation=is_presentation,
+            ))
+    Event.objects.bulk_create(events, batch_size=BATCH_SIZE)
+    return list(
+        Event.objects
+        .filter(
+            event_group__title__startswith=DATASET_GROUP_PREFIX,
+            is_presentation=True,
+        )
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+def generate_dataset(profiles=50_000, groups=100, events_per_group=8,
+                     presentations=3000, questions=500_000, seed=0,
+                     log=None):
+    """Fill the database with a reproducible synthetic meetup.
+
+    Speakers are the first profiles, each giving about two talks. Questions
+    favour popular talks, about a third of them are answered.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    speakers = max(1, presentations // 2)
+    with transaction.atomic():
+        profile_ids = _create_profiles(rng, profiles, speakers)
+        log(f'{len(profile_ids)} profiles')
+        event_ids = _create_program(groups, events_per_group)
+        log(f'{groups} event groups, {groups * events_per_group} events')
+
+        Presentation.objects.bulk_create(
+            (
+                Presentation(
+                    title=f'Доклад {number}',
+                    description='Описание доклада ' * 10,
+                    event_id=event_ids[number % len(event_ids)],
+                    speaker_id=profile_ids[number % speakers],
+                )
+                for number in range(presentations)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        presentation_ids = list(
+            Presentation.objects
+            .filter(event__event_group__title__startswith=DATASET_GROUP_PREFIX)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        log(f'{len(presentation_ids)} presentations')
+
+        weights = [1 / rank for rank in range(1, len(presentation_ids) + 1)]
+        rng.shuffle(weights)
+        for batch in batches(range(questions), BATCH_SIZE):
+            presentation_batch = rng.choices(
+                presentation_ids, weights=weights, k=len(batch))
+            Question.objects.bulk_create(
+                Question(
+                    presentation_id=presentation_id,
+                    text=f'Вопрос {number}: как это работает под нагрузкой?',
+                    listener_id=rng.choice(profile_ids),
+                    answer='Ответ' if answered else '',
+                    is_active=not answered,
+                )
+                for number, presentation_id, answered in zip(
+                    batch,
+                    presentation_batch,
+                    (rng.random() < 0.3 for _ in batch),
+                )
+            )
+        log(f'{questions} questions')
+        # bulk_create sends no signals, drop what the caches know
+        bump_program_version()
+    clear_profile_cache()
+    reset_matchmaking()
+
+
+def remove_dataset():
+    """Delete the generated meetup, keeping the real data"""
+    profiles = Profile.objects.filter(
+        telegram_username__startswith=DATASET_USERNAME_PREFIX,
+        telegram_id__startswith=str(DATASET_FIRST_ID)[:4],
+    )
+    with transaction.atomic():
+        # Questions go first in one statement, not through the cascade
+        Question.objects.filter(
+            presentation__event__event_group__title__startswith=(
+                DATASET_GROUP_PREFIX),
+        ).delete()
+        Question.objects.filter(listener__in=profiles).delete()
+        EventGroup.objects \
+            .filter(title__startswith=DATASET_GROUP_PREFIX) \
+            .delete()
+        profiles.delete()
+    clear_profile_cache()
+    reset_matchmaking()
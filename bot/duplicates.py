@@ -0,0 +1,129 @@
+import math
+import re
+import threading
+import time
+
+from .models import Question
+
+# Share of common trigrams for two questions to count as the same one
+DUPLICATE_THRESHOLD = 0.6
+# Questions asked or answered in other processes are picked up this late
+QUESTION_INDEX_TTL = 60
+
+_word_re = re.compile(r'\w+')
+
+
+def question_trigrams(text):
+    """Trigrams of the normalized words, each word padded with spaces"""
+    words = _word_re.findall(text.lower().replace('ё', 'е'))
+    trigrams = set()
+    for word in words:
+        padded = f'  {word} '
+        trigrams.update(
+            padded[index:index + 3] for index in range(len(padded) - 2))
+    return frozenset(trigrams)
+
+
+class PresentationIndex:
+    """Inverted trigram index of the active questions of a presentation"""
+
+    def __init__(self, questions=()):
+        self.postings = {}
+        self.trigrams = {}
+        self.loaded_at = time.monotonic()
+        for question_id, text in questions:
+            self.add(question_id, text)
+
+    def add(self, question_id, text):
+        trigrams = question_trigrams(text)
+        self.trigrams[question_id] = trigrams
+        for trigram in trigrams:
+            self.postings.setdefault(trigram, set()).add(question_id)
+
+    def remove(self, question_id):
+        for trigram in self.trigrams.pop(question_id, ()):
+            posting = self.postings[trigram]
+            posting.discard(question_id)
+            if not posting:
+                del self.postings[trigram]
+
+    def find(self, text, threshold=DUPLICATE_THRESHOLD):
+        """Return the id of the oldest most similar question, or None"""
+        trigrams = question_trigrams(text)
+        if not trigrams:
+            return None
+        # A similar question shares at least threshold * len(trigrams) of
+        # them, so it has one of the rarest len - that + 1 trigrams
+        rarest = sorted(
+            trigrams, key=lambda trigram: len(self.postings.get(trigram, ())))
+        prefix = len(trigrams) - math.ceil(threshold * len(trigrams)) + 1
+        candidates = set()
+        for trigram in rarest[:prefix]:
+            candidates.update(self.postings.get(trigram, ()))
+        best_id, best_key = None, None
+        for question_id in candidates:
+            other = self.trigrams[question_id]
+            count = len(trigrams & other)
+            score = count / (len(trigrams) + len(other) - count)
+            if score < threshold:
+                continue
+            key = (score, -question_id)
+            if best_key is None or key > best_key:
+                best_id, best_key = question_id, key
+        return best_id
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _get_index(presentation_id):
+    index = _indexes.get(presentation_id)
+    if index and time.monotonic() - index.loaded_at < QUESTION_INDEX_TTL:
+        return index
+    questions = Question.objects \
+        .filter(presentation_id=presentation_id, is_active=True) \
+        .values_list('id', 'text')
+    index = _indexes[presentation_id] = PresentationIndex(questions)
+    return index
+
+
+def find_duplicate(presentation_id, text):
+    """Return the id of an active question of the presentation like text"""
+    with _lock:
+        return _get_index(presentation_id).find(text)
+
+
+def remember_question(presentation_id, question_id, text):
+    with _lock:
+        index = _indexes.get(presentation_id)
+        if index:
+            index.add(question_id, text)
+
+
+def forget_question(presentation_id, question_id):
+    with _lock:
+        index = _indexes.get(presentation_id)
+        if index:
+            index.remove(question_id)
+
+
+def join_question(question_id, profile_id):
+    """Add the profile to the listeners of the question if still active.
+
+    Return False when the question has been answered meanwhile.
+    """
+    question = Question.objects \
+        .filter(id=question_id, is_active=True) \
+        .only('id', 'listener_id') \
+        .first()
+    if question is None:
+        return False
+    if question.listener_id != profile_id:
+        question.extra_listeners.add(profile_id)
+    return True
+
+
+def clear_question_indexes():
+    with _lock:
+        _indexes.clear()
@@ -0,0 +1,110 @@
+import csv
+import json
+
+from .models import ArchivedQuestion, Meetup, Question
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_COLUMNS = ('id', 'event_group', 'day', 'event', 'time_from',
+                  'presentation', 'speaker', 'speaker_username', 'listener',
+                  'listener_username', 'text', 'answer', 'is_active')
+EXPORT_FIELDS = {
+    Question: (
+        'id',
+        'presentation__event__event_group__title',
+        'presentation__event__event_group__day',
+        'presentation__event__title',
+        'presentation__event__time_from',
+        'presentation__title',
+        'presentation__speaker__name',
+        'presentation__speaker__telegram_username',
+        'listener__name',
+        'listener__telegram_username',
+        'text',
+        'answer',
+        'is_active',
+    ),
+    ArchivedQuestion: (
+        'original_id',
+        'presentation__group_title',
+        'presentation__day',
+        'presentation__event_title',
+        'presentation__time_from',
+        'presentation__title',
+        'presentation__speaker_name',
+        'presentation__speaker__telegram_username',
+        'listener__name',
+        'listener__telegram_username',
+        'text',
+        'answer',
+        'is_active',
+    ),
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_questions(event_group_id=None, presentation_id=None,
+                     meetup_id=None):
+    """Questions to export, from the archive for an archived meetup"""
+    if meetup_id is not None and Meetup.objects.filter(
+            id=meetup_id, archived_at__isnull=False).exists():
+        if event_group_id is not None:
+            raise ExportError('Секции архивного митапа не хранятся')
+        questions = ArchivedQuestion.objects \
+            .filter(presentation__meetup_id=meetup_id) \
+            .order_by('original_id')
+        if presentation_id is not None:
+            questions = questions.filter(
+                presentation__original_id=presentation_id)
+        return questions
+    questions = Question.objects.order_by('id')
+    if meetup_id is not None:
+        questions = questions.filter(
+            presentation__event__event_group__meetup_id=meetup_id)
+    if event_group_id is not None:
+        questions = questions.filter(
+            presentation__event__event_group_id=event_group_id)
+    if presentation_id is not None:
+        questions = questions.filter(presentation_id=presentation_id)
+    return questions
+
+
+def iter_question_rows(questions, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield a tuple of EXPORT_COLUMNS per question, chunk_size at a time.
+
+    The related names come from the same query through joins, rows are
+    read as tuples: building model instances takes most of the time.
+    """
+    rows = questions.values_list(*EXPORT_FIELDS[questions.model])
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield row[:2] + (row[2].isoformat(), row[3],
+                         row[4].strftime('%H:%M')) + row[5:]
+
+
+class _Line:
+    """File-like object handing back what csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def render_export(rows, export_format):
+    """Yield the export line by line, nothing is kept in memory"""
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f'Неизвестный формат: {export_format}')
+    if export_format == 'csv':
+        writer = csv.writer(_Line())
+        yield writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, row)),
+                         ensure_ascii=False) + '\n'
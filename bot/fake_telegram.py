@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'Meetup',
+    'username': 'meetup_bot',
+}
+
+
+def message_update(update_id, user_id, text=None, **fields):
+    """Build the JSON of an update with a private message"""
+    message = {
+        'message_id': update_id,
+        'date': 0,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Участник'},
+        **fields,
+    }
+    if text is not None:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [
+                {'type': 'bot_command', 'offset': 0, 'length': len(text)},
+            ]
+    return {'update_id': update_id, 'message': message}
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:
+            params = {}
+        method = self.path.rstrip('/').rsplit('/', 1)[-1]
+        self.server.record(method, params)
+        if method.startswith('send') and self.server.latency:
+            time.sleep(self.server.latency)
+        payload = json.dumps({
+            'ok': True,
+            'result': self.server.answer(method, params),
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    """Minimal Bot API server recording the calls made by the bot.
+
+    Point the bot to it with base_url=server.base_url. Sending methods
+    answer after latency seconds, like the real API would.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0):
+        super().__init__((host, port), FakeTelegramHandler)
+        self.latency = latency
+        # Called with (method, params) for every message sent by the bot
+        self.on_send = None
+        self.calls = []
+        self.updates = []
+        self._lock = threading.Lock()
+        self._has_updates = threading.Condition(self._lock)
+        self._message_id = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    def record(self, method, params):
+        with self._lock:
+            self.calls.append((method, params))
+
+    def push_update(self, data):
+        """Queue an update for getUpdates"""
+        with self._has_updates:
+            self.updates.append(data)
+            self._has_updates.notify_all()
+
+    def get_updates(self, offset=0, timeout=0):
+        with self._has_updates:
+            self.updates = [
+                data for data in self.updates if data['update_id'] >= offset]
+            if not self.updates:
+                self._has_updates.wait(min(timeout, 1))
+            return list(self.updates)
+
+    def calls_of(self, method):
+        with self._lock:
+            return [params for name, params in self.calls if name == method]
+
+    def answer(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return self.get_updates(
+                int(params.get('offset') or 0),
+                float(params.get('timeout') or 0),
+            )
+        if method in ('sendMessage', 'sendInvoice'):
+            with self._lock:
+                self._message_id += 1
+                message_id = self._message_id
+            message = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)),
+                         'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', params.get('title', '')),
+            }
+            if self.on_send:
+                self.on_send(method, params)
+            return message
+        return True
+
+    def start(self):
+        threading.Thread(
+            target=self.serve_forever, name='fake-telegram', daemon=True,
+        ).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
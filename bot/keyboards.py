@@ -0,0 +1,78 @@
+import threading
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup
+
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """Reply keyboard serialized to JSON only once.
+
+    Instances are shared between users, never change them after creation.
+    """
+
+    __slots__ = ('_json',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._json = None
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = super().to_json()
+        return self._json
+
+
+def split_keyboard(captions, num_cols):
+    """Create structure of keyboard with several columns"""
+    buttons, row = [], []
+    for caption in captions:
+        row.append(KeyboardButton(caption))
+        if len(row) == num_cols:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+    return buttons
+
+
+def build_keyboard(captions, num_cols, footer=(), **kwargs):
+    """Build a keyboard of captions with a row of footer buttons"""
+    buttons = split_keyboard(captions, num_cols or len(captions))
+    if footer:
+        buttons.append([KeyboardButton(caption) for caption in footer])
+    return FrozenReplyKeyboardMarkup(
+        keyboard=buttons, resize_keyboard=True, **kwargs)
+
+
+class KeyboardRegistry:
+    """Keyboards derived from the program, built once per program version"""
+
+    def __init__(self):
+        self._version = None
+        self._keyboards = {}
+        self._lock = threading.Lock()
+
+    def get(self, version, captions, num_cols, footer=(),
+            one_time_keyboard=True):
+        key = (tuple(captions), num_cols, tuple(footer), one_time_keyboard)
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._keyboards = {}
+            markup = self._keyboards.get(key)
+            if markup is None:
+                markup = build_keyboard(
+                    key[0], num_cols, key[2],
+                    one_time_keyboard=one_time_keyboard,
+                )
+                self._keyboards[key] = markup
+        return markup
+
+
+keyboard_registry = KeyboardRegistry()
+
+
+def program_keyboard(program, captions, num_cols=2, footer=(),
+                     one_time_keyboard=True):
+    """Return the shared keyboard for captions taken from the program"""
+    return keyboard_registry.get(
+        program.version, captions, num_cols, footer, one_time_keyboard)
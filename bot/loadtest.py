@@ -0,0 +1,292 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import time as day_time
+
+from .fake_telegram import message_update
+from .matchmaking import reset_matchmaking
+from .models import (BotState, Event, EventGroup, OutboxMessage, Presentation,
+                     Profile, Question)
+from .profiles import clear_profile_cache
+
+FIRST_USER_ID = 8_000_000_000
+SEED_GROUP_PREFIX = 'Нагрузочный поток'
+# Messages the bot sends to other users, they do not answer a step
+NOTIFICATIONS = ('Появились новые анкеты', 'Получен ответ на вопрос')
+SUCCESSFUL_PAYMENT = {
+    'currency': 'RUB',
+    'total_amount': 10000,
+    'invoice_payload': 'Donate Meetup-BOT',
+    'telegram_payment_charge_id': 'loadtest',
+    'provider_payment_charge_id': 'loadtest',
+}
+
+
+def seed_program(groups=2, slots=3, speakers_per_slot=2,
+                 questions_per_speaker=20):
+    """Create a synthetic program with speakers from the load test range.
+
+    The speakers ask each other questions, so the answer path has
+    something to answer.
+    """
+    speaker_number = 0
+    presentations = []
+    for group_number in range(1, groups + 1):
+        group = EventGroup.objects.create(
+            title=f'{SEED_GROUP_PREFIX} {group_number}')
+        for slot in range(slots):
+            event = Event.objects.create(
+                title=f'Доклады {group_number}.{slot + 1}',
+                time_from=day_time(10 + slot),
+                time_to=day_time(11 + slot),
+                event_group=group,
+                is_presentation=True,
+            )
+            for _ in range(speakers_per_slot):
+                speaker_number += 1
+                speaker = Profile.objects.create(
+                    name=f'Спикер {speaker_number}',
+                    telegram_id=str(FIRST_USER_ID - speaker_number),
+                )
+                presentations.append(Presentation.objects.create(
+                    title=f'Доклад {speaker_number}',
+                    description='',
+                    event=event,
+                    speaker=speaker,
+                ))
+    Question.objects.bulk_create(
+        Question(
+            presentation=presentation,
+            listener=presentations[number - 1].speaker,
+            text=f'Вопрос {question_number + 1} к докладу {presentation}',
+        )
+        for number, presentation in enumerate(presentations)
+        for question_number in range(questions_per_speaker)
+    )
+
+
+def remove_seeded_data():
+    speaker_ids = list(
+        Presentation.objects
+        .filter(event__event_group__title__startswith=SEED_GROUP_PREFIX)
+        .values_list('speaker_id', flat=True)
+    )
+    EventGroup.objects.filter(title__startswith=SEED_GROUP_PREFIX).delete()
+    speakers = Profile.objects.filter(id__in=speaker_ids)
+    OutboxMessage.objects \
+        .filter(chat_id__in=speakers.values('telegram_id')) \
+        .delete()
+    speakers.delete()
+
+
+def forget_users(user_ids):
+    """Delete the profiles, messages and bot state of synthetic users"""
+    keys = [str(user_id) for user_id in user_ids]
+    Profile.objects.filter(telegram_id__in=keys).delete()
+    OutboxMessage.objects.filter(chat_id__in=keys).delete()
+    BotState.objects.filter(
+        kind__in=[BotState.USER_DATA, BotState.CHAT_DATA],
+        key__in=keys,
+    ).delete()
+    BotState.objects.filter(
+        kind=BotState.CONVERSATION,
+        key__in=[
+            f'{name}:{json.dumps([user_id, user_id])}'
+            for name in ('main', 'survey')
+            for user_id in user_ids
+        ],
+    ).delete()
+    clear_profile_cache()
+    reset_matchmaking()
+
+
+def build_paths(program, speakers):
+    """Scripted walks through the conversation states, by name"""
+    paths = {}
+    groups = [group for group in program.groups if group.events]
+    talks = [
+        (group, event)
+        for group in groups
+        for event in group.events
+        if event.presentations
+    ]
+    if talks:
+        def browse(rng):
+            group, event = rng.choice(talks)
+            return [
+                '/start', 'Программа', program.group_caption(group),
+                f'{event.time_from:%H:%M} {event.title}',
+                'Назад', 'Главное меню',
+            ]
+        paths['program'] = browse
+
+    slots = [
+        (group, event)
+        for group in groups
+        for event in group.events
+        if event.is_presentation and event.presentations
+    ]
+    if slots:
+        def ask(rng):
+            group, event = rng.choice(slots)
+            presentation = rng.choice(event.presentations)
+            return [
+                '/start', 'Задать вопрос', program.group_caption(group),
+                f'{event.time_from:%H:%M}-{event.time_to:%H:%M}',
+                presentation.speaker.name,
+                f'Вопрос {rng.randrange(1_000_000)}',
+                'Главное меню',
+            ]
+        paths['ask'] = ask
+
+    def meet(rng):
+        return [
+            '/start', 'Познакомиться', 'Заполнить анкету',
+            f'Участник {rng.randrange(1_000_000)}', 'ООО', 'Разработчик',
+            'Да, всё верно', 'Подобрать знакомство', 'Главное меню',
+        ]
+    paths['meet'] = meet
+
+    def donate(rng):
+        return [
+            '/start', 'Задонатить', '100',
+            {'successful_payment': SUCCESSFUL_PAYMENT},
+        ]
+    paths['donate'] = donate
+
+    if speakers:
+        def answer(rng):
+            return [
+                '/start', 'Ответить на вопрос', 'Спасибо за вопрос',
+                'Следующий вопрос', 'Главное меню',
+            ]
+        paths['answer'] = answer
+    return paths
+
+
+def percentile(values, share):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class SimulatedUser:
+    __slots__ = ('user_id', 'path', 'steps', 'sent_at')
+
+    def __init__(self, user_id, path, steps):
+        self.user_id = user_id
+        self.path = path
+        self.steps = steps
+        self.sent_at = None
+
+
+class LoadTest:
+    """Users walking scripted paths against the fake Bot API.
+
+    Each user sends the next step as soon as the bot replies to the
+    previous one. A step without a reply within reply_timeout seconds is
+    counted as lost and the user moves on.
+    """
+
+    def __init__(self, server, users, reply_timeout=10):
+        self.server = server
+        self.users = {user.user_id: user for user in users}
+        self.reply_timeout = reply_timeout
+        self.latencies = defaultdict(list)
+        self.lost = defaultdict(int)
+        self.active = len(self.users)
+        self._update_id = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def _send_next(self, user):
+        if not user.steps:
+            user.sent_at = None
+            self.active -= 1
+            if not self.active:
+                self._done.set()
+            return
+        step = user.steps.pop(0)
+        self._update_id += 1
+        if isinstance(step, dict):
+            data = message_update(self._update_id, user.user_id, **step)
+        else:
+            data = message_update(self._update_id, user.user_id, step)
+        user.sent_at = time.monotonic()
+        self.server.push_update(data)
+
+    def on_send(self, method, params):
+        received_at = time.monotonic()
+        text = params.get('text') or ''
+        if any(notification in text for notification in NOTIFICATIONS):
+            return
+        with self._lock:
+            user = self.users.get(int(params.get('chat_id', 0)))
+            if user is None or user.sent_at is None:
+                return
+            self.latencies[user.path].append(received_at - user.sent_at)
+            self._send_next(user)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.reply_timeout
+        with self._lock:
+            for user in self.users.values():
+                if user.sent_at is not None and user.sent_at < deadline:
+                    self.lost[user.path] += 1
+                    self._send_next(user)
+
+    def run(self):
+        """Walk all users through their paths, return the elapsed time"""
+        self.server.on_send = self.on_send
+        started_at = time.monotonic()
+        try:
+            with self._lock:
+                for user in list(self.users.values()):
+                    self._send_next(user)
+            while not self._done.wait(0.5):
+                self._expire()
+        finally:
+            self.server.on_send = None
+        return time.monotonic() - started_at
+
+    def report(self, elapsed):
+        lines = []
+        all_latencies = [
+            latency
+            for latencies in self.latencies.values()
+            for latency in latencies
+        ]
+        replies = len(all_latencies)
+        lines.append(
+            f'{len(self.users)} users, {replies} replies in {elapsed:.1f} s, '
+            f'{replies / elapsed:.1f} replies/s, '
+            f'{sum(self.lost.values())} lost'
+        )
+        rows = [('all', all_latencies)] + sorted(self.latencies.items())
+        for path, latencies in rows:
+            lines.append(
+                f'{path:>8}: p50 {percentile(latencies, 0.5) * 1000:7.1f} ms'
+                f'  p95 {percentile(latencies, 0.95) * 1000:7.1f} ms'
+                f'  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms'
+                f'  lost {self.lost.get(path, 0)}'
+            )
+        return '\n'.join(lines)
+
+
+def create_users(paths, count, speakers, seed=None):
+    """Assign paths to users, the answer path goes to the speakers"""
+    rng = random.Random(seed)
+    users = []
+    listener_paths = [name for name in paths if name != 'answer']
+    for number in range(count):
+        path = rng.choice(listener_paths)
+        users.append(SimulatedUser(
+            FIRST_USER_ID + number, path, paths[path](rng)))
+    if 'answer' in paths:
+        for speaker in speakers:
+            users.append(SimulatedUser(
+                int(speaker.telegram_id), 'answer', paths['answer'](rng)))
+    return users
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .broadcast import BroadcastReport, RateLimiter, broadcast
+from .models import MailingDelivery, MailingJob, Profile
+
+logger = logging.getLogger(__name__)
+
+MAILING_POLL_INTERVAL = 5
+HEARTBEAT_INTERVAL = 2
+STALE_JOB_TIMEOUT = timedelta(minutes=5)
+MAILING_BATCH_SIZE = 200
+INTERRUPTED_ERROR = 'Отправка прервана, сообщение могло дойти'
+
+
+def enqueue_mailing(mailing):
+    """Create a job with a delivery row for every current recipient"""
+    with transaction.atomic():
+        job = MailingJob.objects.create(mailing=mailing)
+        chat_ids = Profile.objects \
+            .filter(telegram_id__isnull=False) \
+            .values_list('telegram_id', flat=True) \
+            .distinct()
+        deliveries = MailingDelivery.objects.bulk_create(
+            (MailingDelivery(job=job, chat_id=chat_id) for chat_id in chat_ids),
+            batch_size=1000,
+        )
+        job.total = len(deliveries)
+        job.save(update_fields=['total'])
+    return job
+
+
+def claim_job():
+    """Lock the oldest queued or abandoned job and mark it as running.
+
+    Deliveries an abandoned job was sending may have reached the chat,
+    they are marked as failed rather than sent twice.
+    """
+    stale_at = timezone.now() - STALE_JOB_TIMEOUT
+    with transaction.atomic():
+        job = MailingJob.objects \
+            .select_for_update(skip_locked=True) \
+            .filter(
+                Q(status=MailingJob.QUEUED)
+                | Q(status=MailingJob.RUNNING, heartbeat_at__lt=stale_at)
+            ) \
+            .select_related('mailing') \
+            .order_by('id') \
+            .first()
+        if job:
+            job.deliveries \
+                .filter(status=MailingDelivery.SENDING) \
+                .update(status=MailingDelivery.FAILED,
+                        error=INTERRUPTED_ERROR)
+            job.status = MailingJob.RUNNING
+            job.heartbeat_at = timezone.now()
+            job.attempt += 1
+            job.save(update_fields=['status', 'heartbeat_at', 'attempt'])
+    return job
+
+
+def _owned_jobs(job):
+    """The job while this worker still runs it"""
+    return MailingJob.objects.filter(
+        id=job.id, status=MailingJob.RUNNING, attempt=job.attempt)
+
+
+def claim_deliveries(job, limit=MAILING_BATCH_SIZE):
+    """Mark the next pending deliveries as sending and return their chats.
+
+    Return None when the job was taken over by another worker.
+    """
+    with transaction.atomic():
+        # Also locks the job, claims of a job do not overlap
+        if not _owned_jobs(job).update(heartbeat_at=timezone.now()):
+            return None
+        chat_ids = list(
+            job.deliveries
+            .filter(status=MailingDelivery.PENDING)
+            .order_by('id')
+            .values_list('chat_id', flat=True)[:limit]
+        )
+        job.deliveries \
+            .filter(chat_id__in=chat_ids, status=MailingDelivery.PENDING) \
+            .update(status=MailingDelivery.SENDING)
+    return chat_ids
+
+
+class Heartbeat:
+    """Refresh the heartbeat of a running job from a background thread.
+
+    A job is taken over when its heartbeat is older than
+    STALE_JOB_TIMEOUT, flood control pauses can be longer than a batch.
+    """
+
+    def __init__(self, job, interval=HEARTBEAT_INTERVAL):
+        self.job = job
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self.run, name=f'mailing-heartbeat-{self.job.id}',
+            daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    _owned_jobs(self.job).update(heartbeat_at=timezone.now())
+                except Exception:
+                    logger.exception('Failed to refresh %s', self.job)
+        finally:
+            connections.close_all()
+
+
+def _count_results(job):
+    counts = dict(
+        job.deliveries
+        .order_by()
+        .values_list('status')
+        .annotate(Count('id'))
+    )
+    job.sent = counts.get(MailingDelivery.SENT, 0)
+    job.failed = counts.get(MailingDelivery.FAILED, 0)
+
+
+def run_job(bot, job):
+    """Send the job's pending deliveries batch by batch, record each result"""
+    report = BroadcastReport()
+    limiter = RateLimiter()
+    started_at = time.monotonic()
+
+    def save_result(chat_id, exc):
+        if exc is None:
+            status, error = MailingDelivery.SENT, ''
+        else:
+            status, error = MailingDelivery.FAILED, repr(exc)[:250]
+        job.deliveries \
+            .filter(chat_id=chat_id) \
+            .update(status=status, error=error)
+
+    with Heartbeat(job):
+        while True:
+            chat_ids = claim_deliveries(job)
+            if not chat_ids:
+                break
+            batch = broadcast(bot, chat_ids, job.mailing.message,
+                              limiter=limiter, on_result=save_result)
+            report.total += batch.total
+            report.sent += batch.sent
+            report.retries += batch.retries
+            report.failures.update(batch.failures)
+            _count_results(job)
+            _owned_jobs(job).update(sent=job.sent, failed=job.failed)
+    report.elapsed = time.monotonic() - started_at
+    if chat_ids is None:
+        logger.warning('%s was taken over by another worker', job)
+        return report
+
+    _count_results(job)
+    job.finished_at = job.heartbeat_at = timezone.now()
+    _owned_jobs(job).update(
+        status=MailingJob.DONE, sent=job.sent, failed=job.failed,
+        heartbeat_at=job.heartbeat_at, finished_at=job.finished_at)
+    job.status = MailingJob.DONE
+    return report
+
+
+def process_mailing_jobs(context):
+    """Job queue callback: run every queued mailing job"""
+    close_old_connections()
+    try:
+        job = claim_job()
+        while job:
+            report = run_job(context.bot, job)
+            logger.info('%s: %s', job, report)
+            job = claim_job()
+    finally:
+        close_old_connections()
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.archive import ARCHIVE_BATCH_SIZE, archive_meetup, finished_meetups
+from bot.models import Meetup
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the presentations and questions of the meetups that are over '
+        'to the archive tables and delete their program.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--meetup',
+            type=int,
+            action='append',
+            help='Archive this meetup even if it is not over, can repeat',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        meetups = finished_meetups()
+        if options['meetup']:
+            meetups = Meetup.objects.filter(id__in=options['meetup'])
+            if len(meetups) != len(set(options['meetup'])):
+                raise CommandError('Meetup not found')
+        for meetup in meetups:
+            started_at = time.perf_counter()
+            presentations, questions = archive_meetup(
+                meetup, options['batch_size'])
+            self.stdout.write(
+                f'{meetup}: {presentations} presentations, '
+                f'{questions} questions archived in '
+                f'{time.perf_counter() - started_at:.1f} s'
+            )
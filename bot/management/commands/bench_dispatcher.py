@@ -0,0 +1,71 @@
+import os
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from telegram import Update
+
+from bot.fake_telegram import FakeTelegramServer, message_update
+from bot.loadtest import forget_users
+
+SURVEY_STEPS = [
+    '/start',
+    'Познакомиться',
+    'Заполнить анкету',
+    'Иван Иванов',
+    'ООО',
+    'Разработчик',
+]
+FIRST_USER_ID = 9_000_000_000
+
+
+class Command(BaseCommand):
+    help = 'Measure bot throughput on synthetic users filling the survey'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.05,
+            help='Bot API response time, seconds',
+        )
+
+    def handle(self, *args, **options):
+        # The handlers live in the bot script at the project root
+        from bot_backend import create_updater
+
+        server = FakeTelegramServer(latency=options['latency']).start()
+        user_ids = range(FIRST_USER_ID, FIRST_USER_ID + options['users'])
+        try:
+            for threads in sorted({1, options['threads']}):
+                forget_users(user_ids)
+                with mock.patch.dict(os.environ, TG_BASE_URL=server.base_url):
+                    updater = create_updater(
+                        '123:BENCH', handler_threads=threads)
+                elapsed = self.run_users(updater, user_ids)
+                replies = len(server.calls_of('sendMessage'))
+                server.calls.clear()
+                updates = len(user_ids) * len(SURVEY_STEPS)
+                self.stdout.write(
+                    f'{threads} handler thread(s): {updates} updates '
+                    f'in {elapsed:.2f} s, {updates / elapsed:.1f} updates/s, '
+                    f'{replies} replies'
+                )
+        finally:
+            server.stop()
+            forget_users(user_ids)
+
+    @staticmethod
+    def run_users(updater, user_ids):
+        dispatcher = updater.dispatcher
+        update_id = 0
+        started_at = time.monotonic()
+        for text in SURVEY_STEPS:
+            for user_id in user_ids:
+                update_id += 1
+                dispatcher.process_update(Update.de_json(
+                    message_update(update_id, user_id, text), updater.bot))
+        dispatcher.stop()
+        return time.monotonic() - started_at
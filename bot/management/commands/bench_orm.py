@@ -0,0 +1,194 @@
+import json
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from bot import matchmaking
+from bot.answers import get_answered_pages, render_answered_pages
+from bot.models import Event, EventGroup, Presentation, Profile, Question
+from bot.program import get_program_version, load_program
+
+
+def build_scenarios(rng, samples):
+    """Handler query paths, each a callable taking a sample number"""
+    # The handlers live in the bot script at the project root
+    from bot_backend import get_questions_from_the_speaker
+
+    speakers = list(
+        Profile.objects
+        .filter(is_speaker=True)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    telegram_ids = list(
+        Profile.objects.order_by('id').values_list('telegram_id', flat=True))
+    candidates = list(
+        Profile.objects
+        .filter(ready_meet=True)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    speakers = rng.sample(speakers, min(samples, len(speakers)))
+    telegram_ids = rng.sample(telegram_ids, min(samples, len(telegram_ids)))
+    candidates = rng.sample(candidates, min(samples, len(candidates)))
+    version = get_program_version()
+
+    def speaker_queue(number):
+        speaker_id = speakers[number % len(speakers)]
+        question = get_questions_from_the_speaker(speaker_id)
+        for _ in range(9):
+            if not question:
+                break
+            question = get_questions_from_the_speaker(speaker_id, question.id)
+
+    def answered_questions(number):
+        speaker_id = speakers[number % len(speakers)]
+        render_answered_pages(speaker_id)
+
+    def answered_questions_cached(number):
+        speaker_id = speakers[number % len(speakers)]
+        get_answered_pages(speaker_id)
+
+    def matchmaking_cold(number):
+        matchmaking.reset_matchmaking()
+        matchmaking.next_person(candidates[number % len(candidates)])
+
+    def matchmaking_warm(number):
+        matchmaking.next_person(candidates[number % len(candidates)])
+
+    scenarios = {
+        'program: load': lambda number: load_program(version),
+        'start: profile by telegram_id':
+            lambda number: Profile.objects.filter(
+                telegram_id=telegram_ids[number % len(telegram_ids)]).first(),
+    }
+    if speakers:
+        for speaker_id in speakers:
+            get_answered_pages(speaker_id)
+        scenarios['speaker: walk 10 questions'] = speaker_queue
+        scenarios['ask: render answered questions'] = answered_questions
+        scenarios['ask: cached answered questions'] = \
+            answered_questions_cached
+    if candidates:
+        scenarios['meet: first person, cold pool'] = matchmaking_cold
+        scenarios['meet: next person'] = matchmaking_warm
+    return scenarios
+
+
+def build_admin_scenarios():
+    """Admin changelist pages, rendered the way a superuser sees them"""
+    user = User(is_superuser=True, is_staff=True, is_active=True)
+    pages = {
+        'admin: profiles': (Profile, {}),
+        'admin: profiles search': (Profile, {'q': 'dataset_1'}),
+        'admin: questions': (Question, {}),
+        'admin: answered questions': (Question, {'is_active__exact': '0'}),
+        'admin: questions search': (Question, {'q': 'dataset_1'}),
+        'admin: presentations': (Presentation, {}),
+    }
+    scenarios = {}
+    for name, (model, params) in pages.items():
+        def changelist(number, model=model, params=params):
+            request = RequestFactory().get('/admin/', params)
+            request.user = user
+            admin.site._registry[model].changelist_view(request).render()
+        scenarios[name] = changelist
+    return scenarios
+
+
+def run_scenario(scenario, repeat):
+    durations = []
+    with CaptureQueriesContext(connection) as queries:
+        for number in range(repeat):
+            started_at = time.perf_counter()
+            scenario(number)
+            durations.append((time.perf_counter() - started_at) * 1000)
+    return {
+        'min_ms': round(min(durations), 3),
+        'median_ms': round(statistics.median(durations), 3),
+        'mean_ms': round(statistics.mean(durations), 3),
+        'max_ms': round(max(durations), 3),
+        'queries': len(queries) / repeat,
+    }
+
+
+def describe_database():
+    return {
+        'vendor': connection.vendor,
+        'counts': {
+            model.__name__: model.objects.count()
+            for model in (Profile, EventGroup, Event, Presentation, Question)
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the query paths of the bot handlers against the current '
+        'database, see generate_dataset. Results can be saved as JSON and '
+        'compared with an earlier run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=50,
+            help='Speakers, users and candidates picked for the scenarios',
+        )
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--output', help='Save the results as JSON')
+        parser.add_argument('--compare', help='Results of an earlier run')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['random_seed'])
+        scenarios = build_scenarios(rng, options['samples'])
+        scenarios.update(build_admin_scenarios())
+        results = {}
+        for name, scenario in scenarios.items():
+            # The first call warms up the connection and the caches
+            scenario(0)
+            results[name] = run_scenario(scenario, options['repeat'])
+        matchmaking.reset_matchmaking()
+
+        report = {
+            'database': describe_database(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as file:
+                previous = json.load(file)['results']
+
+        database = report['database']
+        self.stdout.write(
+            f"{database['vendor']}: "
+            + ', '.join(f'{count} {model}'
+                        for model, count in database['counts'].items())
+        )
+        for name, result in results.items():
+            line = (
+                f'{name:>32}: median {result["median_ms"]:9.3f} ms'
+                f'  max {result["max_ms"]:9.3f} ms'
+                f'  {result["queries"]:g} queries'
+            )
+            if name in previous and previous[name]['median_ms']:
+                ratio = result['median_ms'] / previous[name]['median_ms']
+                line += f'  x{ratio:.2f} vs previous'
+            self.stdout.write(line)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,102 @@
+import time
+
+from django.core.management.base import BaseCommand
+from telegram import Update
+from telegram.ext import ConversationHandler, Dispatcher, DictPersistence
+
+from bot.fake_telegram import message_update
+from bot.routing import CaptionRouter
+
+USER_ID = 1
+FREE_TEXT = 'Произвольный текст'
+
+
+def expand_routers(conv_handler):
+    """Replace caption routers with the regex handlers they stand for"""
+    handler_lists = [conv_handler.entry_points, conv_handler.fallbacks]
+    handler_lists.extend(conv_handler.states.values())
+    for handlers in handler_lists:
+        expanded = []
+        for handler in handlers:
+            if isinstance(handler, CaptionRouter):
+                expanded.extend(handler.as_regex_handlers())
+            else:
+                if isinstance(handler, ConversationHandler):
+                    expand_routers(handler)
+                expanded.append(handler)
+        handlers[:] = expanded
+
+
+def build_dispatcher(regex):
+    # The handlers live in the bot script at the project root
+    from bot_backend import setup_dispatcher
+
+    dispatcher = Dispatcher(None, None, persistence=DictPersistence())
+    setup_dispatcher(dispatcher)
+    if regex:
+        for handlers in dispatcher.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    expand_routers(handler)
+    return dispatcher
+
+
+def find_conversation(dispatcher, name):
+    return next(
+        handler
+        for handlers in dispatcher.handlers.values()
+        for handler in handlers
+        if isinstance(handler, ConversationHandler) and handler.name == name
+    )
+
+
+def build_workload(conv_handler):
+    """Updates with every caption of every state, plus a free text"""
+    workload = []
+    for state, handlers in conv_handler.states.items():
+        captions = [FREE_TEXT]
+        for handler in handlers:
+            if isinstance(handler, CaptionRouter):
+                captions.extend(handler.routes)
+        for caption in captions:
+            update = Update.de_json(
+                message_update(len(workload) + 1, USER_ID, caption), None)
+            workload.append((state, update))
+    return workload
+
+
+def select_handler(dispatcher, update):
+    """The handler lookup of Dispatcher.process_update"""
+    for group in dispatcher.groups:
+        for handler in dispatcher.handlers[group]:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                return handler
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Measure handler selection speed, regex filters vs caption routers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        workload = build_workload(
+            find_conversation(build_dispatcher(regex=False), 'main'))
+        for name, regex in (('regex filters', True),
+                            ('caption routers', False)):
+            dispatcher = build_dispatcher(regex)
+            conv_handler = find_conversation(dispatcher, 'main')
+            key = (USER_ID, USER_ID)
+            started_at = time.perf_counter()
+            for _ in range(options['rounds']):
+                for state, update in workload:
+                    conv_handler.conversations[key] = state
+                    select_handler(dispatcher, update)
+            elapsed = time.perf_counter() - started_at
+            updates = options['rounds'] * len(workload)
+            self.stdout.write(
+                f'{name}: {updates / elapsed:,.0f} updates/s '
+                f'({len(workload)} updates per round)'
+            )
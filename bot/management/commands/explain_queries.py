@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from bot.models import (Event, EventGroup, Meetup, Presentation, Profile,
+                        ProgramRevision, Question)
+
+
+def get_handler_queries(telegram_id='0', meetup_id=0, presentation_ids=(0,)):
+    """Querysets made by the bot handlers, the way the handlers build them.
+
+    The program is read once per version into a snapshot, the handlers
+    look up groups and events there without queries.
+    """
+    return {
+        'start: profile by telegram_id':
+            Profile.objects.filter(telegram_id=telegram_id),
+        'program: version':
+            ProgramRevision.objects.filter(pk=1)
+            .values_list('version', flat=True),
+        'program: active meetup':
+            Meetup.objects.filter(
+                archived_at__isnull=True, ends_on__gte=timezone.localdate(),
+            ).order_by('starts_on', 'id')[:1],
+        'program: event groups':
+            EventGroup.objects.filter(meetup_id=meetup_id)
+            .order_by('day', 'id'),
+        'program: events':
+            Event.objects.filter(event_group__meetup_id=meetup_id)
+            .order_by('time_from', 'id'),
+        'program: presentations with speakers':
+            Presentation.objects.filter(
+                event__event_group__meetup_id=meetup_id,
+            ).select_related('speaker').order_by('id'),
+        'speaker: next question':
+            Question.objects.filter(
+                is_active=True, presentation_id__in=presentation_ids, id__gt=0,
+            ).select_related('listener').order_by('id')[:1],
+        'ask: answers version':
+            Profile.objects.filter(id=0)
+            .values_list('answers_version', flat=True),
+        'ask: answered questions':
+            Question.objects.filter(
+                presentation_id__in=presentation_ids, is_active=False,
+            ).order_by('id').values_list('id', 'text', 'answer'),
+        'meet: candidate ids':
+            Profile.objects.filter(ready_meet=True).order_by('id')
+            .values_list('id', flat=True),
+        'meet: person by id':
+            Profile.objects.filter(id=0, ready_meet=True).order_by('id')[:1],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Print EXPLAIN plans of the queries made by the bot handlers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Run the queries (EXPLAIN ANALYZE), Postgres only',
+        )
+
+    def handle(self, *args, **options):
+        explain_options = {}
+        if options['analyze'] and connection.vendor == 'postgresql':
+            explain_options['analyze'] = True
+        self.stdout.write(f'Database: {connection.vendor}\n')
+        for name, queryset in get_handler_queries().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f'{queryset.query}\n')
+            self.stdout.write(f'{queryset.explain(**explain_options)}\n\n')
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.export import (EXPORT_CHUNK_SIZE, EXPORT_FORMATS, ExportError,
+                        export_questions, iter_question_rows, render_export)
+
+
+class Command(BaseCommand):
+    help = (
+        'Export the questions with their answers, speakers and listeners '
+        'as CSV or JSON Lines. Rows are streamed, memory use does not grow '
+        'with the number of questions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--meetup', type=int, help='Meetup id')
+        parser.add_argument('--event-group', type=int, help='Event group id')
+        parser.add_argument('--presentation', type=int, help='Presentation id')
+        parser.add_argument(
+            '--output', help='File to write, standard output by default')
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            questions = export_questions(
+                meetup_id=options['meetup'],
+                event_group_id=options['event_group'],
+                presentation_id=options['presentation'],
+            )
+        except ExportError as error:
+            raise CommandError(error)
+        rows = iter_question_rows(questions, chunk_size=options['chunk_size'])
+        lines = render_export(rows, options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as file:
+            file.writelines(lines)
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bot.dataset import generate_dataset, remove_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a large reproducible meetup for '
+        'benchmarks. Run it against a copy of the data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=50_000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--events-per-group', type=int, default=8)
+        parser.add_argument('--presentations', type=int, default=3000)
+        parser.add_argument('--questions', type=int, default=500_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Only delete a previously generated dataset',
+        )
+
+    def handle(self, *args, **options):
+        started_at = time.perf_counter()
+        remove_dataset()
+        if options['clear']:
+            self.stdout.write('Dataset removed')
+            return
+        generate_dataset(
+            profiles=options['profiles'],
+            groups=options['groups'],
+            events_per_group=options['events_per_group'],
+            presentations=options['presentations'],
+            questions=options['questions'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            f'Done in {time.perf_counter() - started_at:.1f} s')
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.program_import import (IMPORT_BATCH_SIZE, PROGRAM_FORMATS,
+                                ProgramImportError, guess_format,
+                                import_program)
+
+
+class Command(BaseCommand):
+    help = (
+        'Import the program and the speakers from a CSV or JSON Lines file. '
+        'Existing records are updated, nothing is deleted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=PROGRAM_FORMATS,
+            help='Guessed from the file extension by default',
+        )
+        parser.add_argument(
+            '--meetup', type=int, help='Meetup id, the active one by default')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the changes and roll them back',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        program_format = options['format'] or guess_format(options['path'])
+
+        def show_change(action, kind, label):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{action} {kind}: {label}')
+
+        started_at = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as file:
+                report = import_program(
+                    file,
+                    program_format,
+                    meetup_id=options['meetup'],
+                    dry_run=options['dry_run'],
+                    batch_size=options['batch_size'],
+                    on_change=show_change,
+                )
+        except ProgramImportError as error:
+            raise CommandError(error)
+        self.stdout.write(str(report))
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing saved')
+        self.stdout.write(
+            f'Done in {time.perf_counter() - started_at:.1f} s')
@@ -0,0 +1,84 @@
+import os
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+
+from bot.fake_telegram import FakeTelegramServer
+from bot.loadtest import (LoadTest, build_paths, create_users, forget_users,
+                          remove_seeded_data, seed_program)
+from bot.outbox import OutboxSender
+from bot.program import get_program, invalidate_program
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate users walking through the bot against a local fake Bot '
+        'API and report reply latency. Writes to the database: run it '
+        'against a copy of the data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument(
+            '--seed',
+            action='store_true',
+            help='Create a synthetic program and let its speakers answer',
+        )
+        parser.add_argument(
+            '--handler-threads',
+            type=int,
+            default=int(os.getenv('BOT_HANDLER_THREADS', 1)),
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.05,
+            help='Bot API response time, seconds',
+        )
+        parser.add_argument('--reply-timeout', type=float, default=10)
+        parser.add_argument('--random-seed', type=int)
+
+    def handle(self, *args, **options):
+        # The handlers live in the bot script at the project root
+        from bot_backend import create_updater
+
+        server = FakeTelegramServer(latency=options['latency']).start()
+        users = []
+        try:
+            if options['seed']:
+                seed_program()
+            invalidate_program()
+            program = get_program()
+            speakers = []
+            if options['seed']:
+                speakers = [
+                    presentation.speaker
+                    for group in program.groups
+                    for event in group.events
+                    for presentation in event.presentations
+                ]
+            paths = build_paths(program, speakers)
+            users = create_users(
+                paths, options['users'], speakers, options['random_seed'])
+
+            with mock.patch.dict(os.environ, TG_BASE_URL=server.base_url):
+                updater = create_updater(
+                    '123:LOADTEST',
+                    handler_threads=options['handler_threads'],
+                )
+            updater.start_polling(poll_interval=0, timeout=1)
+            outbox_sender = OutboxSender(updater.bot).start()
+            try:
+                loadtest = LoadTest(server, users, options['reply_timeout'])
+                elapsed = loadtest.run()
+            finally:
+                updater.stop()
+                outbox_sender.stop()
+            self.stdout.write(loadtest.report(elapsed))
+        finally:
+            server.stop()
+            forget_users(user.user_id for user in users
+                         if user.path != 'answer')
+            if options['seed']:
+                remove_seeded_data()
+            invalidate_program()
@@ -0,0 +1,190 @@
+import random
+import threading
+from array import array
+
+from django.db import close_old_connections
+
+from .models import Profile
+
+
+class CandidatePool:
+    """Profiles ready to meet.
+
+    Every profile gets a stable position. Positions of profiles that
+    (re)joined are appended to the feed so decks pick them up
+    incrementally.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+        self.active = bytearray()
+        self.feed = array('I')
+        self.loaded = False
+
+    def load(self):
+        profile_ids = Profile.objects \
+            .filter(ready_meet=True) \
+            .order_by('id') \
+            .values_list('id', flat=True)
+        for profile_id in profile_ids:
+            self.add(profile_id)
+        self.loaded = True
+
+    def add(self, profile_id):
+        position = self.positions.get(profile_id)
+        if position is None:
+            position = len(self.ids)
+            self.positions[profile_id] = position
+            self.ids.append(profile_id)
+            self.active.append(1)
+        elif self.active[position]:
+            return
+        self.active[position] = 1
+        self.feed.append(position)
+
+    def remove(self, profile_id):
+        position = self.positions.get(profile_id)
+        if position is not None:
+            self.active[position] = 0
+
+
+class Deck:
+    """Shuffled positions not yet shown to a user and a bitmap of shown ones"""
+
+    __slots__ = ('order', 'seen', 'known')
+
+    def __init__(self, pool):
+        self.order = array('I')
+        self.seen = bytearray(len(pool.ids) // 8 + 1)
+        self.known = 0
+
+    def is_seen(self, position):
+        byte = position >> 3
+        return byte < len(self.seen) and self.seen[byte] >> (position & 7) & 1
+
+    def mark_seen(self, position):
+        byte = position >> 3
+        if byte >= len(self.seen):
+            self.seen.extend(bytes(byte - len(self.seen) + 1))
+        self.seen[byte] |= 1 << (position & 7)
+
+    def sync(self, pool):
+        """Shuffle positions that joined the pool into the deck"""
+        for position in pool.feed[self.known:]:
+            if self.is_seen(position):
+                continue
+            self.order.append(position)
+            index = random.randrange(len(self.order))
+            self.order[index], self.order[-1] = self.order[-1], self.order[index]
+        self.known = len(pool.feed)
+
+    def draw(self, pool, own_id):
+        """Pop the next unseen active position, None when the deck is empty.
+
+        The user is skipped by profile id, they may join the pool after
+        the deck was made.
+        """
+        self.sync(pool)
+        while self.order:
+            position = self.order.pop()
+            if pool.active[position] and not self.is_seen(position):
+                self.mark_seen(position)
+                if pool.ids[position] != own_id:
+                    return position
+        return None
+
+
+_pool = CandidatePool()
+_decks = {}
+_lock = threading.RLock()
+
+
+def _draw_position(profile_id):
+    if not _pool.loaded:
+        _pool.load()
+    deck = _decks.get(profile_id)
+    if deck is None:
+        deck = _decks[profile_id] = Deck(_pool)
+    position = deck.draw(_pool, profile_id)
+    if position is None:
+        deck = _decks[profile_id] = Deck(_pool)
+        position = deck.draw(_pool, profile_id)
+    return position
+
+
+def next_person(profile_id):
+    """Return a random profile ready to meet not shown to the user lately.
+
+    When everybody has been shown the deck is shuffled again. Return None
+    when there is nobody to meet.
+    """
+    while True:
+        with _lock:
+            position = _draw_position(profile_id)
+            if position is None:
+                return None
+            person_id = _pool.ids[position]
+        person = Profile.objects.filter(id=person_id, ready_meet=True).first()
+        if person:
+            return person
+        with _lock:
+            _pool.remove(person_id)
+
+
+def update_candidate(profile_id, ready_meet):
+    """Keep the pool in sync with Profile.ready_meet"""
+    with _lock:
+        if not _pool.loaded:
+            return
+        if ready_meet:
+            _pool.add(profile_id)
+        else:
+            _pool.remove(profile_id)
+
+
+def sync_candidates():
+    """Pick up profiles that joined or left the pool in other processes"""
+    profile_ids = set(
+        Profile.objects.filter(ready_meet=True).values_list('id', flat=True))
+    with _lock:
+        if not _pool.loaded:
+            return
+        for profile_id, position in _pool.positions.items():
+            if _pool.active[position] and profile_id not in profile_ids:
+                _pool.active[position] = 0
+        for profile_id in sorted(profile_ids):
+            _pool.add(profile_id)
+
+
+def refresh_candidates(context):
+    """Job queue callback: sync the pool with the database"""
+    close_old_connections()
+    sync_candidates()
+
+
+def wait_for_people(profile_id):
+    """Remember to tell the user when new profiles appear"""
+    Profile.objects.filter(id=profile_id).update(waits_meet=True)
+
+
+def pop_waiting_people(profile_id):
+    """Return telegram ids of the users waiting for profiles, forget them"""
+    waiting = dict(
+        Profile.objects
+        .filter(waits_meet=True)
+        .exclude(id=profile_id)
+        .values_list('id', 'telegram_id')
+    )
+    if waiting:
+        Profile.objects \
+            .filter(id__in=waiting, waits_meet=True) \
+            .update(waits_meet=False)
+    return list(waiting.values())
+
+
+def reset_matchmaking():
+    global _pool
+    with _lock:
+        _pool = CandidatePool()
+        _decks.clear()
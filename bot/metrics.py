@@ -0,0 +1,392 @@
+import hmac
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import partial, wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from telegram.ext import ConversationHandler, Handler
+from telegram.utils.request import Request
+
+from .models import MetricsSnapshot
+from .routing import CaptionRouter
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+METRICS_PUBLISH_INTERVAL = 15
+# Snapshots of processes that stopped publishing are dropped after a while
+METRICS_MAX_AGE = timedelta(hours=1)
+
+DESCRIPTIONS = {
+    'bot_handler_seconds': ('histogram', 'Bot handler latency'),
+    'bot_handler_errors_total': ('counter', 'Bot handler errors by type'),
+    'bot_handler_db_queries_total': (
+        'counter', 'Database queries made by bot handlers'),
+    'bot_handler_db_seconds_total': (
+        'counter', 'Time bot handlers spent in database queries'),
+    'telegram_api_seconds': ('histogram', 'Telegram Bot API call latency'),
+    'telegram_api_errors_total': (
+        'counter', 'Failed Telegram Bot API calls by type'),
+    'http_request_seconds': ('histogram', 'Web request latency'),
+    'http_request_errors_total': ('counter', 'Web request errors by type'),
+    'http_request_db_queries_total': (
+        'counter', 'Database queries made by web requests'),
+    'http_request_db_seconds_total': (
+        'counter', 'Time web requests spent in database queries'),
+}
+
+
+class Registry:
+    """Counters and histograms of this process"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(HISTOGRAM_BUCKETS),
+                    'sum': 0,
+                    'count': 0,
+                }
+            histogram['buckets'][bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """JSON-serializable copy of the metrics"""
+        with self._lock:
+            return {
+                'counters': [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                'histograms': [
+                    [name, dict(labels), dict(histogram,
+                                              buckets=histogram['buckets'][:])]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+_source = f'{socket.gethostname()}:{os.getpid()}'
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started_at
+
+
+def timed_handler(callback, name=None):
+    """Wrap a handler callback to record its latency, queries and errors"""
+    if name is None:
+        function = callback.func if isinstance(callback, partial) \
+            else callback
+        name = function.__name__
+    labels = {'handler': name}
+
+    @wraps(callback)
+    def wrapper(update, context):
+        queries = QueryTimer()
+        started_at = time.perf_counter()
+        try:
+            with connection.execute_wrapper(queries):
+                return callback(update, context)
+        except Exception as error:
+            registry.inc(
+                'bot_handler_errors_total',
+                dict(labels, error=type(error).__name__),
+            )
+            raise
+        finally:
+            registry.observe(
+                'bot_handler_seconds', labels,
+                time.perf_counter() - started_at)
+            registry.inc('bot_handler_db_queries_total', labels, queries.count)
+            registry.inc(
+                'bot_handler_db_seconds_total', labels, queries.duration)
+
+    return wrapper
+
+
+def _instrument_handlers(handlers, seen):
+    for handler in handlers:
+        if id(handler) in seen:
+            continue
+        seen.add(id(handler))
+        if isinstance(handler, ConversationHandler):
+            _instrument_handlers(handler.entry_points, seen)
+            _instrument_handlers(handler.fallbacks, seen)
+            for state_handlers in handler.states.values():
+                _instrument_handlers(state_handlers, seen)
+        elif isinstance(handler, CaptionRouter):
+            for caption, callback in handler.routes.items():
+                handler.routes[caption] = timed_handler(callback)
+        elif isinstance(handler, Handler):
+            handler.callback = timed_handler(handler.callback)
+
+
+def instrument_dispatcher(dispatcher):
+    """Record metrics for every handler callback of the dispatcher"""
+    seen = set()
+    for handlers in dispatcher.handlers.values():
+        _instrument_handlers(handlers, seen)
+
+
+class InstrumentedRequest(Request):
+    """Bot API connection recording the latency of every call"""
+
+    def post(self, url, data, timeout=None):
+        labels = {'method': url.rsplit('/', 1)[-1]}
+        started_at = time.perf_counter()
+        try:
+            return super().post(url, data, timeout=timeout)
+        except Exception as error:
+            registry.inc(
+                'telegram_api_errors_total',
+                dict(labels, error=type(error).__name__),
+            )
+            raise
+        finally:
+            registry.observe(
+                'telegram_api_seconds', labels,
+                time.perf_counter() - started_at)
+
+
+# Queries of the web request being handled. Async views reach the ORM
+# through sync_to_async, its threads run in a copy of the context.
+_request_queries = ContextVar('request_queries', default=None)
+
+
+def _time_request_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+def install_request_query_timer(connection, **kwargs):
+    """Time the queries of web requests made on the connection"""
+    if _time_request_query not in connection.execute_wrappers:
+        # First, execute_wrapper() removes the last wrapper on exit
+        connection.execute_wrappers.insert(0, _time_request_query)
+
+
+connection_created.connect(install_request_query_timer)
+
+
+class MetricsMiddleware:
+    """Record latency, queries and errors of web requests.
+
+    Works in the mode of the rest of the chain, so async views are not
+    run in a thread because of it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported
+        for open_connection in connections.all():
+            install_request_query_timer(open_connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryTimer()
+        token = _request_queries.set(queries)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, started_at, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryTimer()
+        token = _request_queries.set(queries)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, started_at, queries)
+        return response
+
+    def record(self, request, started_at, queries):
+        match = request.resolver_match
+        labels = {'view': match.view_name if match else 'unresolved'}
+        registry.observe(
+            'http_request_seconds', labels, time.perf_counter() - started_at)
+        registry.inc('http_request_db_queries_total', labels, queries.count)
+        registry.inc('http_request_db_seconds_total', labels, queries.duration)
+
+    def process_exception(self, request, exception):
+        match = request.resolver_match
+        registry.inc('http_request_errors_total', {
+            'view': match.view_name if match else 'unresolved',
+            'error': type(exception).__name__,
+        })
+
+
+def publish_metrics():
+    """Store the metrics of this process for the /metrics/ endpoint"""
+    MetricsSnapshot.objects.update_or_create(
+        source=_source, defaults={'data': registry.snapshot()})
+
+
+def _publish_periodically():
+    while True:
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+        try:
+            publish_metrics()
+        except Exception:
+            logger.exception('Failed to publish the metrics')
+        finally:
+            close_old_connections()
+
+
+def start_metrics_publisher():
+    """Publish the metrics of a web process from a background thread.
+
+    Requests never write the snapshot themselves. Called by wsgi.py and
+    asgi.py, once per process.
+    """
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = threading.Thread(
+                target=_publish_periodically,
+                name='metrics-publisher',
+                daemon=True,
+            )
+            _publisher.start()
+
+
+def publish_metrics_job(context):
+    """Job queue callback: publish the metrics of the bot process"""
+    close_old_connections()
+    publish_metrics()
+
+
+def collect_metrics():
+    """Sum the metrics of all processes, this one taken from memory"""
+    counters = {}
+    histograms = {}
+    snapshots = MetricsSnapshot.objects \
+        .filter(updated_at__gte=timezone.now() - METRICS_MAX_AGE) \
+        .exclude(source=_source) \
+        .values_list('data', flat=True)
+    for data in [*snapshots, registry.snapshot()]:
+        for name, labels, value in data['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in data['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            total = histograms.setdefault(key, {
+                'buckets': [0] * len(HISTOGRAM_BUCKETS),
+                'sum': 0,
+                'count': 0,
+            })
+            for index, count in enumerate(histogram['buckets']):
+                total['buckets'][index] += count
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+
+def _format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+         .replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def render_metrics(counters, histograms):
+    """Prometheus text exposition format"""
+    lines = []
+    names = sorted({name for name, _ in counters}
+                   | {name for name, _ in histograms})
+    for name in names:
+        kind, description = DESCRIPTIONS.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS, histogram['buckets']):
+                cumulative += count
+                bucket_labels = _format_labels(labels, le=_format_bound(bound))
+                lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+            lines.append(
+                f'{name}_sum{_format_labels(labels)} {histogram["sum"]}')
+            lines.append(
+                f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def is_authorized(request):
+    """Check the bearer token, without one the metrics are open in DEBUG"""
+    token = settings.METRICS_TOKEN
+    if not token:
+        return settings.DEBUG
+    return hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(),
+        f'Bearer {token}'.encode())
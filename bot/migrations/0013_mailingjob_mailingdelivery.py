@@ -0,0 +1,78 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_alter_profile_telegram_username'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='event',
+            options={'verbose_name': 'событие', 'verbose_name_plural': 'события'},
+        ),
+        migrations.AlterModelOptions(
+            name='eventgroup',
+            options={'verbose_name': 'группа события', 'verbose_name_plural': 'группы событий'},
+        ),
+        migrations.AlterModelOptions(
+            name='presentation',
+            options={'verbose_name': 'презентация', 'verbose_name_plural': 'презентации'},
+        ),
+        migrations.AlterModelOptions(
+            name='profile',
+            options={'verbose_name': 'профиль', 'verbose_name_plural': 'профили'},
+        ),
+        migrations.AlterModelOptions(
+            name='question',
+            options={'verbose_name': 'вопрос', 'verbose_name_plural': 'вопросы'},
+        ),
+        migrations.CreateModel(
+            name='MailingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'в очереди'), ('running', 'отправляется'), ('done', 'завершена')], default='queued', max_length=10, verbose_name='статус')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='получателей')),
+                ('sent', models.PositiveIntegerField(default=0, verbose_name='отправлено')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='ошибок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='создана')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='активность')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='завершена')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='bot.mailinglist', verbose_name='рассылка')),
+            ],
+            options={
+                'verbose_name': 'отправка рассылки',
+                'verbose_name_plural': 'отправки рассылок',
+            },
+        ),
+        migrations.CreateModel(
+            name='MailingDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=20, verbose_name='телеграм ИД')),
+                ('status', models.CharField(choices=[('pending', 'ожидает'), ('sent', 'доставлено'), ('failed', 'ошибка')], default='pending', max_length=10, verbose_name='статус')),
+                ('error', models.CharField(blank=True, max_length=250, verbose_name='ошибка')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='bot.mailingjob')),
+            ],
+            options={
+                'verbose_name': 'доставка',
+                'verbose_name_plural': 'доставки',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mailingjob',
+            index=models.Index(fields=['status', 'heartbeat_at'], name='bot_mailing_status_019eab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingdelivery',
+            index=models.Index(fields=['job', 'status'], name='bot_mailing_job_id_f0f612_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='mailingdelivery',
+            constraint=models.UniqueConstraint(fields=('job', 'chat_id'), name='unique_job_delivery'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0013_mailingjob_mailingdelivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgramRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='версия')),
+            ],
+            options={
+                'verbose_name': 'версия программы',
+                'verbose_name_plural': 'версии программы',
+            },
+        ),
+    ]
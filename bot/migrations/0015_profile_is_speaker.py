@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:45
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def fill_is_speaker(apps, schema_editor):
+    Profile = apps.get_model('bot', 'Profile')
+    Presentation = apps.get_model('bot', 'Presentation')
+    Profile.objects.update(
+        is_speaker=Exists(
+            Presentation.objects.filter(speaker=OuterRef('pk'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0014_programrevision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='is_speaker',
+            field=models.BooleanField(default=False, editable=False, verbose_name='докладчик'),
+        ),
+        migrations.RunPython(fill_is_speaker, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:46
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+MERGED_FIELDS = ('name', 'telegram_username', 'company', 'job')
+
+
+def merge_fields(keep, profiles):
+    """Fill the kept profile with the latest non-empty answers"""
+    for profile in profiles:
+        for field_name in MERGED_FIELDS:
+            value = getattr(profile, field_name)
+            if value:
+                setattr(keep, field_name, value)
+        keep.ready_meet = keep.ready_meet or profile.ready_meet
+
+
+def merge_duplicate_profiles(apps, schema_editor):
+    Profile = apps.get_model('bot', 'Profile')
+    Presentation = apps.get_model('bot', 'Presentation')
+    Question = apps.get_model('bot', 'Question')
+    duplicates = Profile.objects \
+        .values('telegram_id') \
+        .annotate(count=Count('id'), keep_id=Min('id')) \
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        extra_profiles = Profile.objects \
+            .filter(telegram_id=duplicate['telegram_id']) \
+            .exclude(id=keep_id)
+        Presentation.objects \
+            .filter(speaker__in=extra_profiles) \
+            .update(speaker_id=keep_id)
+        Question.objects \
+            .filter(listener__in=extra_profiles) \
+            .update(listener_id=keep_id)
+        keep = Profile.objects.get(id=keep_id)
+        merge_fields(keep, extra_profiles.order_by('id'))
+        extra_profiles.delete()
+        keep.is_speaker = Presentation.objects \
+            .filter(speaker_id=keep_id) \
+            .exists()
+        keep.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0015_profile_is_speaker'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0016_merge_duplicate_profiles'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='title',
+            field=models.CharField(db_index=True, max_length=250, verbose_name='название'),
+        ),
+        migrations.AlterField(
+            model_name='eventgroup',
+            name='title',
+            field=models.CharField(db_index=True, max_length=250, verbose_name='название'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='telegram_id',
+            field=models.CharField(max_length=20, unique=True, verbose_name='телеграм ИД'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['event_group', 'is_presentation', 'time_from'], name='event_group_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['presentation', 'is_active', 'id'], name='question_queue_idx'),
+        ),
+    ]
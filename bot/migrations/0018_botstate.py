@@ -0,0 +1,31 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0017_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'данные пользователя'), ('chat', 'данные чата'), ('bot', 'данные бота'), ('conversation', 'состояние диалога')], max_length=20, verbose_name='тип')),
+                ('key', models.CharField(max_length=100, verbose_name='ключ')),
+                ('data', models.JSONField(verbose_name='данные')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='изменено')),
+            ],
+            options={
+                'verbose_name': 'состояние бота',
+                'verbose_name_plural': 'состояния бота',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='botstate',
+            constraint=models.UniqueConstraint(fields=('kind', 'key'), name='unique_bot_state'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0018_botstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='waits_meet',
+            field=models.BooleanField(default=False, editable=False, verbose_name='ждёт новых анкет'),
+        ),
+    ]
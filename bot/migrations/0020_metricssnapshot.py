@@ -0,0 +1,26 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0019_profile_waits_meet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=100, unique=True, verbose_name='процесс')),
+                ('data', models.JSONField(verbose_name='метрики')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='изменено')),
+            ],
+            options={
+                'verbose_name': 'снимок метрик',
+                'verbose_name_plural': 'снимки метрик',
+            },
+        ),
+    ]
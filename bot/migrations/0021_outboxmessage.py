@@ -0,0 +1,35 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0020_metricssnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=20, verbose_name='телеграм ИД')),
+                ('text', models.TextField(verbose_name='сообщение')),
+                ('status', models.CharField(choices=[('pending', 'ожидает'), ('sent', 'отправлено'), ('failed', 'ошибка')], default='pending', max_length=10, verbose_name='статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='попыток')),
+                ('next_attempt_at', models.DateTimeField(verbose_name='следующая попытка')),
+                ('error', models.CharField(blank=True, max_length=250, verbose_name='ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='создано')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='отправлено')),
+            ],
+            options={
+                'verbose_name': 'исходящее сообщение',
+                'verbose_name_plural': 'исходящие сообщения',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'id'], name='outbox_queue_idx'),
+        ),
+    ]
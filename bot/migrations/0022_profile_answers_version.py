@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0021_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='answers_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='версия ответов'),
+        ),
+    ]
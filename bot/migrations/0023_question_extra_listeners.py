@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0022_profile_answers_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='extra_listeners',
+            field=models.ManyToManyField(blank=True, related_name='joined_questions', to='bot.profile', verbose_name='задали такой же вопрос'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0023_question_extra_listeners'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='name',
+            field=models.CharField(db_index=True, max_length=150, verbose_name='имя пользователя'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='telegram_username',
+            field=models.CharField(db_index=True, max_length=50, null=True, verbose_name='телеграм имя'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0024_profile_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='telegram_id',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True, verbose_name='телеграм ИД'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0025_profile_placeholder_telegram_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPresentation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveBigIntegerField(verbose_name='ИД доклада')),
+                ('group_title', models.CharField(max_length=250, verbose_name='секция')),
+                ('event_title', models.CharField(max_length=250, verbose_name='событие')),
+                ('time_from', models.TimeField(verbose_name='время начала')),
+                ('time_to', models.TimeField(verbose_name='время окончания')),
+                ('title', models.CharField(max_length=250, verbose_name='название')),
+                ('description', models.TextField(verbose_name='описание')),
+                ('speaker_name', models.CharField(max_length=150, verbose_name='имя спикера')),
+            ],
+            options={
+                'verbose_name': 'архивная презентация',
+                'verbose_name_plural': 'архивные презентации',
+            },
+        ),
+        migrations.CreateModel(
+            name='Meetup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=250, verbose_name='название')),
+                ('starts_on', models.DateField(verbose_name='начало')),
+                ('ends_on', models.DateField(verbose_name='окончание')),
+                ('archived_at', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='перенесён в архив')),
+            ],
+            options={
+                'verbose_name': 'митап',
+                'verbose_name_plural': 'митапы',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveBigIntegerField(verbose_name='ИД вопроса')),
+                ('text', models.TextField(verbose_name='текст вопроса')),
+                ('extra_listeners_count', models.PositiveIntegerField(default=0, verbose_name='задали такой же вопрос')),
+                ('answer', models.TextField(blank=True, verbose_name='ответ на вопрос')),
+                ('is_active', models.BooleanField(verbose_name='актуальный')),
+                ('listener', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_questions', to='bot.profile', verbose_name='слушатель')),
+                ('presentation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='bot.archivedpresentation', verbose_name='презентация')),
+            ],
+            options={
+                'verbose_name': 'архивный вопрос',
+                'verbose_name_plural': 'архивные вопросы',
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedpresentation',
+            name='meetup',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_presentations', to='bot.meetup', verbose_name='митап'),
+        ),
+        migrations.AddField(
+            model_name='archivedpresentation',
+            name='speaker',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_presentations', to='bot.profile', verbose_name='спикер'),
+        ),
+        migrations.AddField(
+            model_name='eventgroup',
+            name='meetup',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='event_groups', to='bot.meetup', verbose_name='митап'),
+        ),
+    ]
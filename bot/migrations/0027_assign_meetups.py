@@ -0,0 +1,28 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def assign_current_program(apps, schema_editor):
+    """Put the program loaded so far into a meetup held today"""
+    EventGroup = apps.get_model('bot', 'EventGroup')
+    Meetup = apps.get_model('bot', 'Meetup')
+    if not EventGroup.objects.exists():
+        return
+    today = timezone.localdate()
+    meetup = Meetup.objects.create(
+        title='Митап', starts_on=today, ends_on=today)
+    EventGroup.objects.update(meetup=meetup)
+
+
+class Migration(migrations.Migration):
+    """Separate from the schema changes: on Postgres the table can not be
+    altered while the deferred foreign key checks of the update are pending
+    """
+
+    dependencies = [
+        ('bot', '0026_meetups'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_current_program, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0027_assign_meetups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventgroup',
+            name='meetup',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='event_groups', to='bot.meetup', verbose_name='митап'),
+        ),
+    ]
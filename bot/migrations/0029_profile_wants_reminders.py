@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0028_alter_eventgroup_meetup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='wants_reminders',
+            field=models.BooleanField(default=False, verbose_name='напоминать о докладах'),
+        ),
+    ]
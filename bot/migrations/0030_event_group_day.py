@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0029_profile_wants_reminders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedpresentation',
+            name='day',
+            field=models.DateField(null=True, verbose_name='день'),
+        ),
+        migrations.AddField(
+            model_name='eventgroup',
+            name='day',
+            field=models.DateField(blank=True, null=True, verbose_name='день'),
+        ),
+    ]
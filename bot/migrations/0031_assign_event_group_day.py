@@ -0,0 +1,23 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def assign_first_day(apps, schema_editor):
+    """Put the groups and archived presentations on the first meetup day"""
+    Meetup = apps.get_model('bot', 'Meetup')
+    starts_on = Subquery(
+        Meetup.objects.filter(pk=OuterRef('meetup_id')).values('starts_on'))
+    for model_name in ('EventGroup', 'ArchivedPresentation'):
+        apps.get_model('bot', model_name).objects.update(day=starts_on)
+
+
+class Migration(migrations.Migration):
+    """Separate from the schema changes, see 0027_assign_meetups"""
+
+    dependencies = [
+        ('bot', '0030_event_group_day'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_first_day, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0031_assign_event_group_day'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedpresentation',
+            name='day',
+            field=models.DateField(verbose_name='день'),
+        ),
+        migrations.AlterField(
+            model_name='eventgroup',
+            name='day',
+            field=models.DateField(blank=True, verbose_name='день'),
+        ),
+    ]
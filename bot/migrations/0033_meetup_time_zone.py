@@ -0,0 +1,19 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:07
+
+import bot.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0032_alter_event_group_day'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meetup',
+            name='time_zone',
+            field=models.CharField(default=bot.models.default_time_zone, help_text='Например, Europe/Moscow. В нём указано время событий', max_length=64, validators=[bot.models.validate_time_zone], verbose_name='часовой пояс'),
+        ),
+    ]
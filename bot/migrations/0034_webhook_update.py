@@ -0,0 +1,26 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0033_meetup_time_zone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('update_id', models.BigIntegerField(unique=True, verbose_name='ИД обновления')),
+                ('data', models.JSONField(verbose_name='обновление')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='получено')),
+            ],
+            options={
+                'verbose_name': 'входящее обновление',
+                'verbose_name_plural': 'входящие обновления',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0034_webhook_update'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingjob',
+            name='attempt',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='запусков'),
+        ),
+        migrations.AlterField(
+            model_name='mailingdelivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'ожидает'), ('sending', 'отправляется'), ('sent', 'доставлено'), ('failed', 'ошибка')], default='pending', max_length=10, verbose_name='статус'),
+        ),
+    ]
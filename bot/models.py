@@ -1,19 +1,29 @@
-from django.contrib import admin
+import zoneinfo
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 
 
 class Profile(models.Model):
-    name = models.CharField('имя пользователя', max_length=150)
-    telegram_id = models.CharField('телеграм ИД', max_length=20)
-    telegram_username = models.CharField('телеграм имя', max_length=50, null=True)
+    name = models.CharField('имя пользователя', max_length=150, db_index=True)
+    # Empty for speakers imported with the program until they start the bot
+    telegram_id = models.CharField(
+        'телеграм ИД', max_length=20, unique=True, null=True, blank=True)
+    telegram_username = models.CharField(
+        'телеграм имя', max_length=50, null=True, db_index=True)
     company = models.CharField(
         'компания', max_length=150, blank=True, null=True)
     job = models.CharField('должность', max_length=150, blank=True, null=True)
     ready_meet = models.BooleanField('готов знакомиться', default=False)
-
-    @admin.display(description='Докладчик')
-    def is_speaker(self):
-        return self.presentations.exists()
+    waits_meet = models.BooleanField(
+        'ждёт новых анкет', default=False, editable=False)
+    is_speaker = models.BooleanField(
+        'докладчик', default=False, editable=False)
+    answers_version = models.PositiveIntegerField(
+        'версия ответов', default=0, editable=False)
+    wants_reminders = models.BooleanField(
+        'напоминать о докладах', default=False)
 
     class Meta:
         verbose_name = 'профиль'
@@ -23,8 +33,51 @@ class Profile(models.Model):
         return f'{self.name} @{self.telegram_username}'
 
 
-class EventGroup(models.Model):
+def default_time_zone():
+    return settings.TIME_ZONE
+
+
+def validate_time_zone(value):
+    try:
+        zoneinfo.ZoneInfo(value)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValidationError(f'Неизвестный часовой пояс: {value}') from None
+
+
+class Meetup(models.Model):
     title = models.CharField('название', max_length=250)
+    starts_on = models.DateField('начало')
+    ends_on = models.DateField('окончание')
+    time_zone = models.CharField(
+        'часовой пояс',
+        max_length=64,
+        default=default_time_zone,
+        validators=[validate_time_zone],
+        help_text='Например, Europe/Moscow. В нём указано время событий',
+    )
+    archived_at = models.DateTimeField(
+        'перенесён в архив', null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = 'митап'
+        verbose_name_plural = 'митапы'
+
+    def __str__(self) -> str:
+        return f'{self.title} {self.starts_on:%d.%m.%Y}'
+
+
+class EventGroup(models.Model):
+    title = models.CharField('название', max_length=250, db_index=True)
+    meetup = models.ForeignKey(
+        Meetup,
+        on_delete=models.CASCADE,
+        related_name='event_groups',
+        verbose_name='митап',
+        # Filled with the active meetup on save when left empty
+        blank=True,
+    )
+    # Filled with the first day of the meetup on save when left empty
+    day = models.DateField('день', blank=True)
 
     class Meta:
         verbose_name = 'группа события'
@@ -33,9 +86,15 @@ class EventGroup(models.Model):
     def __str__(self) -> str:
         return f'{self.title}'
 
+    def clean(self):
+        if self.day and self.meetup_id and not (
+                self.meetup.starts_on <= self.day <= self.meetup.ends_on):
+            raise ValidationError(
+                {'day': 'День должен быть в пределах дат митапа'})
+
 
 class Event(models.Model):
-    title = models.CharField('название', max_length=250)
+    title = models.CharField('название', max_length=250, db_index=True)
     time_from = models.TimeField('время начала')
     time_to = models.TimeField('время окончания')
     event_group = models.ForeignKey(
@@ -48,6 +107,12 @@ class Event(models.Model):
     class Meta:
         verbose_name = 'событие'
         verbose_name_plural = 'события'
+        indexes = [
+            models.Index(
+                fields=['event_group', 'is_presentation', 'time_from'],
+                name='event_group_schedule_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'{self.time_from:%H:%M}-{self.time_to:%H:%M} {self.title}'
@@ -77,17 +142,91 @@ class Question(models.Model):
         Presentation, on_delete=models.CASCADE, related_name='questions')
     text = models.TextField('текст вопроса')
     listener = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    extra_listeners = models.ManyToManyField(
+        Profile,
+        related_name='joined_questions',
+        blank=True,
+        verbose_name='задали такой же вопрос',
+    )
     answer = models.TextField('ответ на вопрос', blank=True)
     is_active = models.BooleanField('актуальный', default=True)
 
     class Meta:
         verbose_name = 'вопрос'
         verbose_name_plural = 'вопросы'
+        indexes = [
+            models.Index(
+                fields=['presentation', 'is_active', 'id'],
+                name='question_queue_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'{self.presentation} - {self.listener}'
 
 
+class ArchivedPresentation(models.Model):
+    """Presentation of an archived meetup with its event flattened in"""
+    meetup = models.ForeignKey(
+        Meetup,
+        on_delete=models.CASCADE,
+        related_name='archived_presentations',
+        verbose_name='митап',
+    )
+    original_id = models.PositiveBigIntegerField('ИД доклада')
+    group_title = models.CharField('секция', max_length=250)
+    day = models.DateField('день')
+    event_title = models.CharField('событие', max_length=250)
+    time_from = models.TimeField('время начала')
+    time_to = models.TimeField('время окончания')
+    title = models.CharField('название', max_length=250)
+    description = models.TextField('описание')
+    speaker = models.ForeignKey(
+        Profile,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='archived_presentations',
+        verbose_name='спикер',
+    )
+    speaker_name = models.CharField('имя спикера', max_length=150)
+
+    class Meta:
+        verbose_name = 'архивная презентация'
+        verbose_name_plural = 'архивные презентации'
+
+    def __str__(self) -> str:
+        return f'{self.title}'
+
+
+class ArchivedQuestion(models.Model):
+    presentation = models.ForeignKey(
+        ArchivedPresentation,
+        on_delete=models.CASCADE,
+        related_name='questions',
+        verbose_name='презентация',
+    )
+    original_id = models.PositiveBigIntegerField('ИД вопроса')
+    text = models.TextField('текст вопроса')
+    listener = models.ForeignKey(
+        Profile,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='archived_questions',
+        verbose_name='слушатель',
+    )
+    extra_listeners_count = models.PositiveIntegerField(
+        'задали такой же вопрос', default=0)
+    answer = models.TextField('ответ на вопрос', blank=True)
+    is_active = models.BooleanField('актуальный')
+
+    class Meta:
+        verbose_name = 'архивный вопрос'
+        verbose_name_plural = 'архивные вопросы'
+
+    def __str__(self) -> str:
+        return f'{self.presentation} - {self.original_id}'
+
+
 class MailingList(models.Model):
     name = models.CharField('название', max_length=250)
     message = models.TextField('сообщение')
@@ -98,3 +237,174 @@ class MailingList(models.Model):
 
     def __str__(self) -> str:
         return f'{self.name}'
+
+
+class MailingJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (QUEUED, 'в очереди'),
+        (RUNNING, 'отправляется'),
+        (DONE, 'завершена'),
+    ]
+
+    mailing = models.ForeignKey(
+        MailingList,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        verbose_name='рассылка',
+    )
+    status = models.CharField(
+        'статус', max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    total = models.PositiveIntegerField('получателей', default=0)
+    sent = models.PositiveIntegerField('отправлено', default=0)
+    failed = models.PositiveIntegerField('ошибок', default=0)
+    created_at = models.DateTimeField('создана', auto_now_add=True)
+    heartbeat_at = models.DateTimeField('активность', null=True, blank=True)
+    finished_at = models.DateTimeField('завершена', null=True, blank=True)
+    # Bumped on every claim, a worker whose job was taken over stops
+    attempt = models.PositiveIntegerField(
+        'запусков', default=0, editable=False)
+
+    class Meta:
+        verbose_name = 'отправка рассылки'
+        verbose_name_plural = 'отправки рассылок'
+        indexes = [
+            models.Index(fields=['status', 'heartbeat_at']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.mailing} #{self.id}'
+
+
+class MailingDelivery(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'ожидает'),
+        (SENDING, 'отправляется'),
+        (SENT, 'доставлено'),
+        (FAILED, 'ошибка'),
+    ]
+
+    job = models.ForeignKey(
+        MailingJob, on_delete=models.CASCADE, related_name='deliveries')
+    chat_id = models.CharField('телеграм ИД', max_length=20)
+    status = models.CharField(
+        'статус', max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.CharField('ошибка', max_length=250, blank=True)
+
+    class Meta:
+        verbose_name = 'доставка'
+        verbose_name_plural = 'доставки'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['job', 'chat_id'], name='unique_job_delivery'),
+        ]
+        indexes = [
+            models.Index(fields=['job', 'status']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.job} -> {self.chat_id}'
+
+
+class ProgramRevision(models.Model):
+    version = models.PositiveIntegerField('версия', default=0)
+
+    class Meta:
+        verbose_name = 'версия программы'
+        verbose_name_plural = 'версии программы'
+
+    def __str__(self) -> str:
+        return f'{self.version}'
+
+
+class BotState(models.Model):
+    USER_DATA = 'user'
+    CHAT_DATA = 'chat'
+    BOT_DATA = 'bot'
+    CONVERSATION = 'conversation'
+    KIND_CHOICES = [
+        (USER_DATA, 'данные пользователя'),
+        (CHAT_DATA, 'данные чата'),
+        (BOT_DATA, 'данные бота'),
+        (CONVERSATION, 'состояние диалога'),
+    ]
+
+    kind = models.CharField('тип', max_length=20, choices=KIND_CHOICES)
+    key = models.CharField('ключ', max_length=100)
+    data = models.JSONField('данные')
+    updated_at = models.DateTimeField('изменено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'состояние бота'
+        verbose_name_plural = 'состояния бота'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'key'], name='unique_bot_state'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.kind} {self.key}'
+
+
+class MetricsSnapshot(models.Model):
+    source = models.CharField('процесс', max_length=100, unique=True)
+    data = models.JSONField('метрики')
+    updated_at = models.DateTimeField('изменено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'снимок метрик'
+        verbose_name_plural = 'снимки метрик'
+
+    def __str__(self) -> str:
+        return f'{self.source}'
+
+
+class OutboxMessage(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'ожидает'),
+        (SENT, 'отправлено'),
+        (FAILED, 'ошибка'),
+    ]
+
+    chat_id = models.CharField('телеграм ИД', max_length=20)
+    text = models.TextField('сообщение')
+    status = models.CharField(
+        'статус', max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField('попыток', default=0)
+    next_attempt_at = models.DateTimeField('следующая попытка')
+    error = models.CharField('ошибка', max_length=250, blank=True)
+    created_at = models.DateTimeField('создано', auto_now_add=True)
+    sent_at = models.DateTimeField('отправлено', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'исходящее сообщение'
+        verbose_name_plural = 'исходящие сообщения'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='outbox_queue_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.chat_id} #{self.id}'
+
+
+class WebhookUpdate(models.Model):
+    """Update received by the webhook, waiting for the bot process"""
+    update_id = models.BigIntegerField('ИД обновления', unique=True)
+    data = models.JSONField('обновление')
+    received_at = models.DateTimeField('получено', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'входящее обновление'
+        verbose_name_plural = 'входящие обновления'
+
+    def __str__(self) -> str:
+        return f'#{self.update_id}'
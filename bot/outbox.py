@@ -0,0 +1,135 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+from telegram import error
+
+from .broadcast import RateLimiter
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_POLL_INTERVAL = 1
+OUTBOX_BATCH_SIZE = 200
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 1
+BACKOFF_MAX = 300
+
+_new_messages = threading.Event()
+
+
+def enqueue_messages(chat_ids, text):
+    """Queue a message to every chat, it is sent after the commit"""
+    now = timezone.now()
+    OutboxMessage.objects.bulk_create(
+        OutboxMessage(chat_id=str(chat_id), text=text, next_attempt_at=now)
+        for chat_id in chat_ids
+    )
+    transaction.on_commit(_new_messages.set)
+
+
+def enqueue_message(chat_id, text):
+    enqueue_messages([chat_id], text)
+
+
+def _retry_later(message, exc, delay):
+    message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    message.error = repr(exc)[:250]
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = OutboxMessage.FAILED
+    message.save(update_fields=[
+        'status', 'attempts', 'next_attempt_at', 'error'])
+
+
+def deliver_due_messages(bot, limiter):
+    """Send the pending messages that are due, return the number sent.
+
+    Messages to a chat are sent in the order they were queued: while the
+    oldest one waits for a retry the later ones wait too. Chats waiting
+    for a retry are left out of the query, so however many of them there
+    are they do not hold back the messages that are due.
+    """
+    now = timezone.now()
+    waiting_chats = OutboxMessage.objects \
+        .filter(status=OutboxMessage.PENDING, next_attempt_at__gt=now) \
+        .values('chat_id')
+    messages = OutboxMessage.objects \
+        .filter(status=OutboxMessage.PENDING) \
+        .exclude(chat_id__in=waiting_chats) \
+        .order_by('id')[:OUTBOX_BATCH_SIZE]
+    blocked_chats = set()
+    sent = 0
+    for message in messages:
+        if message.chat_id in blocked_chats:
+            continue
+        if message.next_attempt_at > now:
+            blocked_chats.add(message.chat_id)
+            continue
+        limiter.acquire(message.chat_id)
+        try:
+            bot.send_message(chat_id=message.chat_id, text=message.text)
+        except error.RetryAfter as exc:
+            # Flood control is not the message's fault, no attempt is spent
+            limiter.pause(exc.retry_after)
+            _retry_later(message, exc, exc.retry_after)
+            blocked_chats.add(message.chat_id)
+        except (error.BadRequest, error.Unauthorized, error.ChatMigrated) \
+                as exc:
+            # Retrying will not help, e.g. the user has blocked the bot
+            message.status = OutboxMessage.FAILED
+            message.error = repr(exc)[:250]
+            message.save(update_fields=['status', 'error'])
+        except error.NetworkError as exc:
+            message.attempts += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** message.attempts)
+            _retry_later(message, exc, delay)
+            blocked_chats.add(message.chat_id)
+        else:
+            message.status = OutboxMessage.SENT
+            message.sent_at = timezone.now()
+            message.save(update_fields=['status', 'sent_at'])
+            sent += 1
+    return sent
+
+
+class OutboxSender:
+    """Background thread sending the queued messages.
+
+    Messages queued in this process are sent right away, the ones queued
+    by other processes within OUTBOX_POLL_INTERVAL seconds. Run a single
+    sender per deployment.
+    """
+
+    def __init__(self, bot, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.bot = bot
+        self.poll_interval = poll_interval
+        self.limiter = RateLimiter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.run, name='outbox-sender', daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                _new_messages.clear()
+                close_old_connections()
+                try:
+                    deliver_due_messages(self.bot, self.limiter)
+                except Exception:
+                    logger.exception('Failed to deliver outbox messages')
+                _new_messages.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        self._stopped.set()
+        _new_messages.set()
+        if self._thread:
+            self._thread.join()
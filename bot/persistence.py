@@ -0,0 +1,141 @@
+import json
+import threading
+from collections import defaultdict
+
+from django.db import close_old_connections, transaction
+from telegram.ext import BasePersistence
+
+from .models import BotState
+
+PERSISTENCE_FLUSH_INTERVAL = 5
+
+
+class DjangoPersistence(BasePersistence):
+    """Bot and conversation state stored in the BotState table.
+
+    The state is kept in memory, updates only mark changed entries as
+    dirty and flush() writes them in one transaction. Handlers must keep
+    only JSON-serializable values in user_data, chat_data and bot_data.
+    """
+
+    def __init__(self):
+        super().__init__(
+            store_user_data=True,
+            store_chat_data=True,
+            store_bot_data=True,
+        )
+        self._user_data = None
+        self._chat_data = None
+        self._bot_data = None
+        self._conversations = None
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._user_data is not None:
+                return
+            user_data = defaultdict(dict)
+            chat_data = defaultdict(dict)
+            bot_data = {}
+            conversations = defaultdict(dict)
+            for state in BotState.objects.iterator():
+                if state.kind == BotState.USER_DATA:
+                    user_data[int(state.key)] = state.data
+                elif state.kind == BotState.CHAT_DATA:
+                    chat_data[int(state.key)] = state.data
+                elif state.kind == BotState.BOT_DATA:
+                    bot_data = state.data
+                elif state.kind == BotState.CONVERSATION:
+                    name, _, key = state.key.partition(':')
+                    conversations[name][tuple(json.loads(key))] = state.data
+            self._user_data = user_data
+            self._chat_data = chat_data
+            self._bot_data = bot_data
+            self._conversations = conversations
+
+    def _mark_dirty(self, kind, key, data):
+        self._dirty[(kind, str(key))] = data
+
+    def get_user_data(self):
+        self._load()
+        return self._user_data
+
+    def get_chat_data(self):
+        self._load()
+        return self._chat_data
+
+    def get_bot_data(self):
+        self._load()
+        return self._bot_data
+
+    def get_conversations(self, name):
+        self._load()
+        return dict(self._conversations[name])
+
+    def update_conversation(self, name, key, new_state):
+        self._load()
+        with self._lock:
+            conversations = self._conversations[name]
+            if conversations.get(key) == new_state:
+                return
+            if new_state is None:
+                conversations.pop(key, None)
+            else:
+                conversations[key] = new_state
+            self._mark_dirty(
+                BotState.CONVERSATION, f'{name}:{json.dumps(key)}', new_state)
+
+    def update_user_data(self, user_id, data):
+        self._load()
+        with self._lock:
+            if self._user_data.get(user_id, {}) == data:
+                return
+            self._user_data[user_id] = data
+            self._mark_dirty(BotState.USER_DATA, user_id, data)
+
+    def update_chat_data(self, chat_id, data):
+        self._load()
+        with self._lock:
+            if self._chat_data.get(chat_id, {}) == data:
+                return
+            self._chat_data[chat_id] = data
+            self._mark_dirty(BotState.CHAT_DATA, chat_id, data)
+
+    def update_bot_data(self, data):
+        self._load()
+        with self._lock:
+            if self._bot_data == data:
+                return
+            self._bot_data = data
+            self._mark_dirty(BotState.BOT_DATA, '', data)
+
+    def flush(self):
+        """Write the changed entries to the database"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        keys_by_kind = defaultdict(list)
+        for kind, key in dirty:
+            keys_by_kind[kind].append(key)
+        try:
+            with transaction.atomic():
+                for kind, keys in keys_by_kind.items():
+                    BotState.objects.filter(kind=kind, key__in=keys).delete()
+                BotState.objects.bulk_create(
+                    BotState(kind=kind, key=key, data=data)
+                    for (kind, key), data in dirty.items()
+                    if data is not None
+                )
+        except Exception:
+            with self._lock:
+                for entry, data in dirty.items():
+                    self._dirty.setdefault(entry, data)
+            raise
+
+
+def flush_persistence(context):
+    """Job queue callback: write the dirty bot state"""
+    close_old_connections()
+    context.dispatcher.persistence.flush()
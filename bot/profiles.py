@@ -0,0 +1,110 @@
+import threading
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Presentation, Profile
+from .program import bump_program_version
+
+PROFILE_CACHE_TTL = 60
+
+_profiles = {}
+_lock = threading.Lock()
+
+
+def _get_cached_profile(telegram_id):
+    """Return the cached profile and the time it was read from the database"""
+    now = time.monotonic()
+    with _lock:
+        cached = _profiles.get(telegram_id)
+    if cached and now - cached[0] < PROFILE_CACHE_TTL:
+        return cached
+    profile = Profile.objects.filter(telegram_id=telegram_id).first()
+    if profile:
+        with _lock:
+            _profiles[telegram_id] = (now, profile)
+    return now, profile
+
+
+def get_profile(telegram_id):
+    """Return the cached profile of a Telegram user, None if there is none"""
+    _, profile = _get_cached_profile(str(telegram_id))
+    return profile
+
+
+def _claim_placeholder(telegram_id, username):
+    """Give the user the speaker profile imported with the program"""
+    placeholder_id = Profile.objects \
+        .filter(telegram_id__isnull=True, telegram_username=username.lower()) \
+        .values_list('id', flat=True) \
+        .first()
+    if placeholder_id is None:
+        return None
+    claimed = Profile.objects \
+        .filter(id=placeholder_id, telegram_id__isnull=True) \
+        .update(telegram_id=telegram_id, telegram_username=username)
+    if not claimed:
+        return None
+    # The program shows the speaker's contact
+    bump_program_version()
+    return Profile.objects.get(id=placeholder_id)
+
+
+def resolve_profile(tg_user):
+    """Return the profile of a Telegram user and whether it was created.
+
+    Profiles are cached by telegram_id for PROFILE_CACHE_TTL seconds and
+    written only when the user's Telegram username has changed or the
+    profile has no name. The name is not overwritten, the speakers keep
+    the names imported with the program.
+    A new user gets the speaker profile imported for their username.
+    """
+    telegram_id = str(tg_user.id)
+    checked_at, profile = _get_cached_profile(telegram_id)
+
+    created = False
+    if profile is None and tg_user.username:
+        profile = _claim_placeholder(telegram_id, tg_user.username)
+        created = profile is not None
+    if profile is None:
+        try:
+            with transaction.atomic():
+                profile = Profile.objects.create(
+                    telegram_id=telegram_id,
+                    name=tg_user.first_name,
+                    telegram_username=tg_user.username,
+                )
+            created = True
+        except IntegrityError:
+            profile = Profile.objects.get(telegram_id=telegram_id)
+    if not created and (not profile.name
+                        or profile.telegram_username != tg_user.username):
+        profile.name = profile.name or tg_user.first_name
+        profile.telegram_username = tg_user.username
+        profile.save(update_fields=['name', 'telegram_username'])
+
+    with _lock:
+        _profiles[telegram_id] = (checked_at, profile)
+    return profile, created
+
+
+def forget_profile(telegram_id):
+    with _lock:
+        _profiles.pop(str(telegram_id), None)
+
+
+def clear_profile_cache():
+    with _lock:
+        _profiles.clear()
+
+
+def refresh_speaker_flags(profile_ids):
+    """Recalculate Profile.is_speaker from the speakers' presentations"""
+    profiles = Profile.objects.filter(id__in=profile_ids)
+    profiles.update(
+        is_speaker=Exists(
+            Presentation.objects.filter(speaker=OuterRef('pk'))),
+    )
+    for telegram_id in profiles.values_list('telegram_id', flat=True):
+        forget_profile(telegram_id)
@@ -0,0 +1,326 @@
+import threading
+import time
+import zoneinfo
+from bisect import bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from datetime import time as dt_time
+from typing import Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Event, EventGroup, Meetup, Presentation, ProgramRevision
+
+PROGRAM_VERSION_CHECK_INTERVAL = 10
+DEFAULT_MEETUP_TITLE = 'Митап'
+
+
+@dataclass(frozen=True)
+class ProgramSpeaker:
+    id: int
+    name: str
+    telegram_id: Optional[str]
+    telegram_username: Optional[str]
+
+    def __str__(self) -> str:
+        return f'{self.name} @{self.telegram_username}'
+
+
+@dataclass(frozen=True)
+class ProgramPresentation:
+    id: int
+    title: str
+    description: str
+    event_id: int
+    speaker: ProgramSpeaker
+
+    def __str__(self) -> str:
+        return f'{self.title}'
+
+
+@dataclass(frozen=True)
+class ProgramEvent:
+    id: int
+    title: str
+    time_from: dt_time
+    time_to: dt_time
+    is_presentation: bool
+    group_id: int
+    day: date
+    presentations: Tuple[ProgramPresentation, ...]
+
+    def __str__(self) -> str:
+        return f'{self.time_from:%H:%M}-{self.time_to:%H:%M} {self.title}'
+
+
+@dataclass(frozen=True)
+class ProgramGroup:
+    id: int
+    title: str
+    day: date
+    events: Tuple[ProgramEvent, ...]
+
+    def __str__(self) -> str:
+        return f'{self.title}'
+
+
+def _event_bounds(event):
+    """Local start and end of the event, it may end after midnight"""
+    starts = datetime.combine(event.day, event.time_from)
+    ends = datetime.combine(event.day, event.time_to)
+    if ends < starts:
+        ends += timedelta(days=1)
+    return starts, ends
+
+
+class Program:
+    """Read-only EventGroup -> Event -> Presentation tree of a meetup"""
+
+    def __init__(self, version, groups, meetup_id=None, active_until=None,
+                 days=(), time_zone=None):
+        self.version = version
+        self.groups = tuple(groups)
+        self.meetup_id = meetup_id
+        self.active_until = active_until
+        self.days = tuple(days)
+        # Times of the events are wall clock times there
+        self.time_zone = time_zone or timezone.get_default_timezone()
+        self._groups = {group.id: group for group in self.groups}
+        # Sections of different days may share a title, the day tells
+        # them apart
+        self._several_days = len({group.day for group in self.groups}) > 1
+        self._group_captions = {
+            self.group_caption(group): group for group in self.groups
+        }
+        self._presentations = {
+            presentation.id: presentation
+            for group in self.groups
+            for event in group.events
+            for presentation in event.presentations
+        }
+        speaker_presentations = defaultdict(list)
+        for presentation in self._presentations.values():
+            speaker_presentations[presentation.speaker.id].append(
+                presentation.id)
+        self._speaker_presentations = {
+            speaker_id: tuple(sorted(presentation_ids))
+            for speaker_id, presentation_ids in speaker_presentations.items()
+        }
+        self._index_schedule()
+
+    def _index_schedule(self):
+        """Cut the meetup at every start and end of an event.
+
+        Between two cuts the same events are going on, so the events at
+        any moment are found by a binary search over the cuts.
+        """
+        events = sorted(
+            (event for group in self.groups for event in group.events),
+            key=lambda event: (event.day, event.time_from, event.id),
+        )
+        bounds = [_event_bounds(event) for event in events]
+        self._cuts = sorted(
+            {starts for starts, _ in bounds} | {ends for _, ends in bounds})
+        self._running = []
+        running, position = [], 0
+        for cut in self._cuts:
+            while position < len(events) and bounds[position][0] <= cut:
+                running.append((bounds[position][1], events[position]))
+                position += 1
+            running = [(ends, event) for ends, event in running if ends > cut]
+            self._running.append(tuple(event for _, event in running))
+        starting = defaultdict(list)
+        for (starts, _), event in zip(bounds, events):
+            starting[starts].append(event)
+        self._starts = sorted(starting)
+        self._starting = [tuple(starting[start]) for start in self._starts]
+
+    def local_time(self, moment):
+        """Wall clock time of the meetup at the moment, without the zone"""
+        return timezone.localtime(moment, self.time_zone).replace(tzinfo=None)
+
+    def starts_at(self, event):
+        return timezone.make_aware(
+            datetime.combine(event.day, event.time_from), self.time_zone)
+
+    def is_outdated(self, today):
+        """Whether the meetup is over and the next one may be active"""
+        return self.active_until is not None and today > self.active_until
+
+    def group(self, group_id):
+        return self._groups.get(group_id)
+
+    def group_caption(self, group):
+        """Button caption of the group, with the day on a several day meetup"""
+        if self._several_days:
+            return f'{group.title} {group.day:%d.%m}'
+        return group.title
+
+    def group_captions(self):
+        return list(self._group_captions)
+
+    def group_by_caption(self, caption):
+        return self._group_captions.get(caption)
+
+    def presentation(self, presentation_id):
+        return self._presentations.get(presentation_id)
+
+    def speaker_presentation_ids(self, speaker_id):
+        return self._speaker_presentations.get(speaker_id, ())
+
+    def events_at(self, moment):
+        """Events going on at the moment, in O(log n)"""
+        position = bisect_right(self._cuts, self.local_time(moment)) - 1
+        return self._running[position] if position >= 0 else ()
+
+    def next_events(self, moment):
+        """Events starting soonest after the moment, in O(log n)"""
+        position = bisect_right(self._starts, self.local_time(moment))
+        if position == len(self._starts):
+            return ()
+        return self._starting[position]
+
+
+def get_active_meetup(today=None):
+    """The first meetup not over yet, else the latest one not archived"""
+    today = today or timezone.localdate()
+    meetups = Meetup.objects.filter(archived_at__isnull=True)
+    return meetups.filter(ends_on__gte=today).order_by('starts_on', 'id') \
+        .first() or meetups.order_by('-ends_on', '-id').first()
+
+
+def default_meetup():
+    """Meetup of the groups created without one, a new one if none"""
+    meetup = get_active_meetup()
+    if meetup is None:
+        today = timezone.localdate()
+        meetup = Meetup.objects.create(
+            title=DEFAULT_MEETUP_TITLE, starts_on=today, ends_on=today)
+    return meetup
+
+
+def load_program(version):
+    """Read the program of the active meetup from the database"""
+    today = timezone.localdate()
+    meetup = get_active_meetup(today)
+    if meetup is None:
+        return Program(version, [])
+    event_presentations = defaultdict(list)
+    presentations = Presentation.objects \
+        .filter(event__event_group__meetup=meetup) \
+        .select_related('speaker') \
+        .order_by('id')
+    for presentation in presentations:
+        speaker = presentation.speaker
+        event_presentations[presentation.event_id].append(
+            ProgramPresentation(
+                id=presentation.id,
+                title=presentation.title,
+                description=presentation.description,
+                event_id=presentation.event_id,
+                speaker=ProgramSpeaker(
+                    id=speaker.id,
+                    name=speaker.name,
+                    telegram_id=speaker.telegram_id,
+                    telegram_username=speaker.telegram_username,
+                ),
+            )
+        )
+
+    groups = list(
+        EventGroup.objects.filter(meetup=meetup).order_by('day', 'id'))
+    group_days = {group.id: group.day for group in groups}
+    group_events = defaultdict(list)
+    events = Event.objects \
+        .filter(event_group__meetup=meetup) \
+        .order_by('time_from', 'id')
+    for event in events:
+        if event.event_group_id not in group_days:
+            # The group was added after they were read, the next version
+            # brings it
+            continue
+        group_events[event.event_group_id].append(
+            ProgramEvent(
+                id=event.id,
+                title=event.title,
+                time_from=event.time_from,
+                time_to=event.time_to,
+                is_presentation=event.is_presentation,
+                group_id=event.event_group_id,
+                day=group_days[event.event_group_id],
+                presentations=tuple(event_presentations[event.id]),
+            )
+        )
+
+    groups = [
+        ProgramGroup(
+            id=group.id,
+            title=group.title,
+            day=group.day,
+            events=tuple(group_events[group.id]),
+        )
+        for group in groups
+    ]
+    # A meetup that is over stays active until a new one is added, which
+    # bumps the version
+    active_until = meetup.ends_on if meetup.ends_on >= today else None
+    days = [
+        meetup.starts_on + timedelta(days=number)
+        for number in range((meetup.ends_on - meetup.starts_on).days + 1)
+    ]
+    return Program(version, groups, meetup.id, active_until, days,
+                   zoneinfo.ZoneInfo(meetup.time_zone))
+
+
+def get_program_version():
+    return ProgramRevision.objects \
+        .filter(pk=1) \
+        .values_list('version', flat=True) \
+        .first() or 0
+
+
+def bump_program_version():
+    """Mark every cached program snapshot as outdated"""
+    updated = ProgramRevision.objects \
+        .filter(pk=1) \
+        .update(version=F('version') + 1)
+    if not updated:
+        ProgramRevision.objects.get_or_create(pk=1, defaults={'version': 1})
+    transaction.on_commit(invalidate_program)
+
+
+_program = None
+_checked_at = 0
+_lock = threading.Lock()
+
+
+def invalidate_program():
+    """Drop the snapshot of this process"""
+    global _program
+    _program = None
+
+
+def get_program():
+    """Return the cached program, rebuild it when the version has changed.
+
+    The version is read from the database at most once per
+    PROGRAM_VERSION_CHECK_INTERVAL seconds.
+    """
+    global _program, _checked_at
+    program = _program
+    if program and time.monotonic() - _checked_at < PROGRAM_VERSION_CHECK_INTERVAL:
+        return program
+    with _lock:
+        program = _program
+        if program and time.monotonic() - _checked_at < PROGRAM_VERSION_CHECK_INTERVAL:
+            return program
+        version = get_program_version()
+        if not program or program.version != version \
+                or program.is_outdated(timezone.localdate()):
+            program = load_program(version)
+        _program = program
+        _checked_at = time.monotonic()
+    return program
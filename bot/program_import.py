@@ -0,0 +1,367 @@
+import csv
+import io
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from datetime import time as dt_time
+from typing import NamedTuple, Optional
+
+from django.db import transaction
+from django.db.models import F
+
+from .batching import batches
+from .models import Event, EventGroup, Meetup, Presentation, Profile
+from .profiles import clear_profile_cache, refresh_speaker_flags
+from .program import bump_program_version, default_meetup
+
+IMPORT_BATCH_SIZE = 1000
+# bulk_update builds a CASE per column, long ones are slow to run
+UPDATE_BATCH_SIZE = 100
+PROGRAM_FORMATS = ('csv', 'jsonl')
+TRUE_VALUES = {'1', 'true', 'yes', 'да', '+'}
+FALSE_VALUES = {'0', 'false', 'no', 'нет', '-'}
+
+
+class ProgramImportError(Exception):
+    pass
+
+
+class ProgramRow(NamedTuple):
+    line: int
+    group: str
+    day: Optional[date]
+    event: str
+    time_from: dt_time
+    time_to: dt_time
+    is_presentation: bool
+    presentation: str
+    description: str
+    speaker: str
+    speaker_username: Optional[str]
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    created: Counter = field(default_factory=Counter)
+    updated: Counter = field(default_factory=Counter)
+
+    def __str__(self) -> str:
+        def describe(counts):
+            return ', '.join(
+                f'{kind} {count}' for kind, count in sorted(counts.items())
+            ) or 'нет'
+
+        return (
+            f'Строк: {self.rows}. Создано: {describe(self.created)}. '
+            f'Изменено: {describe(self.updated)}.'
+        )
+
+
+def read_rows(file, program_format):
+    """Yield (line number, dict) from a binary or text file, one at a time"""
+    if program_format not in PROGRAM_FORMATS:
+        raise ProgramImportError(f'Неизвестный формат: {program_format}')
+    if not isinstance(file, io.TextIOBase):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig')
+    if program_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            raise ProgramImportError(f'Строка {number}: {error}') from error
+        if not isinstance(row, dict):
+            raise ProgramImportError(f'Строка {number}: ожидается объект')
+        yield number, row
+
+
+def _parse_time(number, value, column):
+    try:
+        return datetime.strptime(str(value).strip(), '%H:%M').time()
+    except ValueError:
+        raise ProgramImportError(
+            f'Строка {number}: {column} должно быть в формате ЧЧ:ММ, '
+            f'получено {value!r}') from None
+
+
+def _parse_day(number, value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ProgramImportError(
+            f'Строка {number}: day должно быть в формате ГГГГ-ММ-ДД, '
+            f'получено {value!r}') from None
+
+
+def parse_row(number, row):
+    def text(column):
+        value = row.get(column)
+        return '' if value is None else str(value).strip()
+
+    for column in ('group', 'event', 'time_from', 'time_to'):
+        if not text(column):
+            raise ProgramImportError(f'Строка {number}: не заполнено {column}')
+    presentation = text('presentation')
+    username = text('speaker_username').lstrip('@').lower() or None
+    if presentation and not username:
+        raise ProgramImportError(
+            f'Строка {number}: у доклада не указан speaker_username')
+
+    is_presentation = row.get('is_presentation')
+    if isinstance(is_presentation, bool):
+        pass
+    elif text('is_presentation').lower() in TRUE_VALUES:
+        is_presentation = True
+    elif text('is_presentation').lower() in FALSE_VALUES:
+        is_presentation = False
+    elif not text('is_presentation'):
+        is_presentation = bool(presentation)
+    else:
+        raise ProgramImportError(
+            f'Строка {number}: непонятное is_presentation '
+            f'{row["is_presentation"]!r}')
+
+    return ProgramRow(
+        line=number,
+        group=text('group'),
+        day=_parse_day(number, text('day')) if text('day') else None,
+        event=text('event'),
+        time_from=_parse_time(number, text('time_from'), 'time_from'),
+        time_to=_parse_time(number, text('time_to'), 'time_to'),
+        is_presentation=is_presentation,
+        presentation=presentation,
+        description=text('description'),
+        speaker=text('speaker') or username or '',
+        speaker_username=username,
+    )
+
+
+class ProgramImporter:
+    """Upsert program rows in batches against in-memory indexes.
+
+    Groups of the meetup are matched by title and day, events by group,
+    title and start time, speakers by Telegram username, presentations
+    by event and speaker. Rows without a day go to the first day of the
+    meetup. Nothing is deleted. Speakers who have not started the bot yet get a
+    profile without telegram_id, they claim it on /start.
+    """
+
+    def __init__(self, meetup, batch_size=IMPORT_BATCH_SIZE,
+                 on_change=None):
+        self.meetup = meetup
+        self.batch_size = batch_size
+        self.on_change = on_change or (lambda action, kind, label: None)
+        self.report = ImportReport()
+        self.speaker_ids = set()
+        groups = EventGroup.objects \
+            .filter(meetup=meetup) \
+            .order_by('-id') \
+            .values_list('title', 'day', 'id')
+        self.groups = {
+            (title, day): group_id for title, day, group_id in groups
+        }
+        events = Event.objects \
+            .filter(event_group__meetup=meetup) \
+            .order_by('-id') \
+            .values_list('id', 'event_group_id', 'title', 'time_from',
+                         'time_to', 'is_presentation')
+        self.events = {
+            (group_id, title, time_from): (event_id, time_to, is_presentation)
+            for event_id, group_id, title, time_from, time_to, is_presentation
+            in events
+        }
+        # Real users win over placeholders with the same username
+        self.speakers = {}
+        profiles = Profile.objects \
+            .filter(telegram_username__isnull=False) \
+            .order_by(F('telegram_id').desc(nulls_last=True), '-id') \
+            .values_list('telegram_username', 'id', 'name', 'telegram_id')
+        for username, profile_id, name, telegram_id in profiles:
+            self.speakers.setdefault(
+                username.lower(), (profile_id, name, telegram_id))
+        presentations = Presentation.objects \
+            .filter(event__event_group__meetup=meetup) \
+            .order_by('-id') \
+            .values_list('id', 'event_id', 'speaker_id', 'title',
+                         'description')
+        self.presentations = {
+            (event_id, speaker_id): (presentation_id, title, description)
+            for presentation_id, event_id, speaker_id, title, description
+            in presentations
+        }
+
+    def import_rows(self, rows):
+        parsed = (
+            self._with_day(parse_row(number, row)) for number, row in rows)
+        for batch in batches(parsed, self.batch_size):
+            self._flush(batch)
+        return self.report
+
+    def _with_day(self, row):
+        if row.day is None:
+            return row._replace(day=self.meetup.starts_on)
+        if not self.meetup.starts_on <= row.day <= self.meetup.ends_on:
+            raise ProgramImportError(
+                f'Строка {row.line}: день {row.day:%d.%m.%Y} вне дат митапа')
+        return row
+
+    def _changed(self, action, kind, label):
+        counts = self.report.created if action == '+' \
+            else self.report.updated
+        counts[kind] += 1
+        self.on_change(action, kind, label)
+
+    def _flush(self, rows):
+        self.report.rows += len(rows)
+        self._upsert_groups(rows)
+        self._upsert_speakers(rows)
+        self._upsert_events(rows)
+        self._upsert_presentations(rows)
+
+    def _upsert_groups(self, rows):
+        new_groups = []
+        for row in rows:
+            if (row.group, row.day) not in self.groups:
+                self.groups[(row.group, row.day)] = None
+                new_groups.append(EventGroup(
+                    title=row.group, meetup=self.meetup, day=row.day))
+                self._changed(
+                    '+', 'группа', f'{row.group} {row.day:%d.%m.%Y}')
+        for group in EventGroup.objects.bulk_create(new_groups):
+            self.groups[(group.title, group.day)] = group.id
+
+    def _upsert_speakers(self, rows):
+        new_speakers = {}
+        renamed = {}
+        for row in rows:
+            if not row.speaker_username:
+                continue
+            known = self.speakers.get(row.speaker_username)
+            if known is None:
+                if row.speaker_username not in new_speakers:
+                    new_speakers[row.speaker_username] = Profile(
+                        name=row.speaker,
+                        telegram_username=row.speaker_username)
+                    self._changed('+', 'спикер', f'@{row.speaker_username}')
+                continue
+            profile_id, name, telegram_id = known
+            # Names of the bot users are taken from Telegram
+            if telegram_id is None and name != row.speaker:
+                renamed[profile_id] = Profile(id=profile_id, name=row.speaker)
+                self.speakers[row.speaker_username] = \
+                    (profile_id, row.speaker, None)
+                self._changed('~', 'спикер', f'@{row.speaker_username}')
+        created = Profile.objects.bulk_create(new_speakers.values())
+        for profile in created:
+            self.speakers[profile.telegram_username] = \
+                (profile.id, profile.name, None)
+        Profile.objects.bulk_update(
+            renamed.values(), ['name'], batch_size=UPDATE_BATCH_SIZE)
+
+    def _upsert_events(self, rows):
+        new_events = {}
+        changed = {}
+        for row in rows:
+            group_id = self.groups[(row.group, row.day)]
+            key = (group_id, row.event, row.time_from)
+            known = self.events.get(key)
+            label = f'{row.group} / {row.time_from:%H:%M} {row.event}'
+            if known is None:
+                if key not in new_events:
+                    new_events[key] = Event(
+                        event_group_id=group_id, title=row.event,
+                        time_from=row.time_from, time_to=row.time_to,
+                        is_presentation=row.is_presentation)
+                    self._changed('+', 'событие', label)
+                continue
+            event_id, time_to, is_presentation = known
+            if (time_to, is_presentation) != (row.time_to,
+                                               row.is_presentation):
+                changed[event_id] = Event(
+                    id=event_id, time_to=row.time_to,
+                    is_presentation=row.is_presentation)
+                self.events[key] = (event_id, row.time_to, row.is_presentation)
+                self._changed('~', 'событие', label)
+        for event in Event.objects.bulk_create(new_events.values()):
+            key = (event.event_group_id, event.title, event.time_from)
+            self.events[key] = (event.id, event.time_to, event.is_presentation)
+        Event.objects.bulk_update(
+            changed.values(), ['time_to', 'is_presentation'],
+            batch_size=UPDATE_BATCH_SIZE)
+
+    def _upsert_presentations(self, rows):
+        new_presentations = {}
+        changed = {}
+        for row in rows:
+            if not row.presentation:
+                continue
+            event_id = self.events[
+                (self.groups[(row.group, row.day)], row.event,
+                 row.time_from)][0]
+            speaker_id = self.speakers[row.speaker_username][0]
+            self.speaker_ids.add(speaker_id)
+            key = (event_id, speaker_id)
+            known = self.presentations.get(key)
+            label = f'{row.presentation} (@{row.speaker_username})'
+            if known is None:
+                if key not in new_presentations:
+                    new_presentations[key] = Presentation(
+                        event_id=event_id, speaker_id=speaker_id,
+                        title=row.presentation, description=row.description)
+                    self._changed('+', 'доклад', label)
+                continue
+            presentation_id, title, description = known
+            if (title, description) != (row.presentation, row.description):
+                changed[presentation_id] = Presentation(
+                    id=presentation_id, title=row.presentation,
+                    description=row.description)
+                self.presentations[key] = \
+                    (presentation_id, row.presentation, row.description)
+                self._changed('~', 'доклад', label)
+        for presentation in Presentation.objects.bulk_create(
+                new_presentations.values()):
+            self.presentations[
+                (presentation.event_id, presentation.speaker_id)] = \
+                (presentation.id, presentation.title, presentation.description)
+        Presentation.objects.bulk_update(
+            changed.values(), ['title', 'description'],
+            batch_size=UPDATE_BATCH_SIZE)
+
+
+def import_program(file, program_format, meetup_id=None, dry_run=False,
+                   batch_size=IMPORT_BATCH_SIZE, on_change=None):
+    """Import a CSV or JSON Lines program file in one transaction.
+
+    The program goes to the active meetup unless another one is given.
+    With dry_run the changes are reported and rolled back.
+    """
+    with transaction.atomic():
+        if meetup_id is None:
+            meetup = default_meetup()
+        else:
+            meetup = Meetup.objects.filter(id=meetup_id).first()
+            if meetup is None:
+                raise ProgramImportError(f'Нет митапа с ИД {meetup_id}')
+        importer = ProgramImporter(meetup, batch_size, on_change)
+        report = importer.import_rows(read_rows(file, program_format))
+        if dry_run:
+            transaction.set_rollback(True)
+        else:
+            # bulk_create and bulk_update send no signals
+            refresh_speaker_flags(importer.speaker_ids)
+            bump_program_version()
+    if not dry_run:
+        clear_profile_cache()
+    return report
+
+
+def guess_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return 'jsonl' if extension in ('jsonl', 'ndjson', 'json') else 'csv'
@@ -0,0 +1,164 @@
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Profile
+from .outbox import enqueue_messages
+from .program import PROGRAM_VERSION_CHECK_INTERVAL, get_program
+
+logger = logging.getLogger(__name__)
+
+REMINDER_LEAD_MINUTES = 10
+REMINDER_SYNC_INTERVAL = PROGRAM_VERSION_CHECK_INTERVAL
+
+
+def presentation_starts(program):
+    """{event id: start} of the presentations of the meetup"""
+    return {
+        event.id: program.starts_at(event)
+        for group in program.groups
+        for event in group.events
+        if event.presentations
+    }
+
+
+def reminder_text(program, event_ids, lead):
+    minutes = int(lead.total_seconds() // 60)
+    blocks = [f'Через {minutes} мин. начнутся доклады:']
+    events = {
+        event.id: event
+        for group in program.groups
+        for event in group.events
+    }
+    for event_id in sorted(event_ids):
+        event = events.get(event_id)
+        if event is None:
+            continue
+        group = program.group(event.group_id)
+        lines = [f'{event} ({group})']
+        lines.extend(
+            f'{presentation.title} — {presentation.speaker}'
+            for presentation in event.presentations
+        )
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def send_reminders(program, event_ids, lead):
+    """Queue one notice about the events to every subscriber"""
+    chat_ids = Profile.objects \
+        .filter(wants_reminders=True, telegram_id__isnull=False) \
+        .values_list('telegram_id', flat=True)
+    enqueue_messages(chat_ids, reminder_text(program, event_ids, lead))
+
+
+class ReminderScheduler:
+    """Reminders about the presentations of the active meetup.
+
+    The reminders wait in a heap by time, a single job of the job queue
+    fires at the earliest one. When the program changes only the events
+    that moved are pushed again, their old heap entries are skipped when
+    they come up. Presentations starting at the same time are announced
+    in one message.
+    """
+
+    def __init__(self, job_queue, lead_minutes=REMINDER_LEAD_MINUTES):
+        self.job_queue = job_queue
+        self.lead = timedelta(minutes=lead_minutes)
+        self.program = None
+        self.version = None
+        # event id -> start of the reminders still to send
+        self.pending = {}
+        self.heap = []
+        self._job = None
+        self._job_at = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.job_queue.run_repeating(
+            self.sync_job, interval=REMINDER_SYNC_INTERVAL, first=0)
+        return self
+
+    def sync_job(self, context):
+        close_old_connections()
+        try:
+            self.sync(get_program())
+        except Exception:
+            logger.exception('Failed to sync the reminders')
+
+    def sync(self, program, now=None):
+        """Update the heap for the changes of the program"""
+        now = now or timezone.now()
+        with self._lock:
+            if program.version == self.version:
+                return
+            self.program = program
+            self.version = program.version
+            # Reminders already due but not sent yet are kept
+            pending = {
+                key: starts_at
+                for key, starts_at in presentation_starts(program).items()
+                if starts_at - self.lead > now
+                or self.pending.get(key) == starts_at
+            }
+            for key, starts_at in pending.items():
+                if self.pending.get(key) != starts_at:
+                    heapq.heappush(
+                        self.heap, (starts_at - self.lead, starts_at, key))
+            self.pending = pending
+            if len(self.heap) > 2 * len(self.pending) + 64:
+                # Too many entries have gone stale
+                self.heap = [
+                    (starts_at - self.lead, starts_at, key)
+                    for key, starts_at in self.pending.items()
+                ]
+                heapq.heapify(self.heap)
+            self._schedule_next()
+
+    def pop_due(self, now=None):
+        """Take the reminders due by now, {start: event ids}"""
+        now = now or timezone.now()
+        due = defaultdict(list)
+        with self._lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, starts_at, key = heapq.heappop(self.heap)
+                if self.pending.get(key) != starts_at:
+                    continue
+                del self.pending[key]
+                due[starts_at].append(key)
+        return due
+
+    def fire_job(self, context):
+        close_old_connections()
+        with self._lock:
+            self._job = self._job_at = None
+        try:
+            for event_ids in self.pop_due().values():
+                send_reminders(self.program, event_ids, self.lead)
+        except Exception:
+            logger.exception('Failed to send the reminders')
+        finally:
+            with self._lock:
+                self._schedule_next()
+
+    def _schedule_next(self):
+        while self.heap and \
+                self.pending.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        next_at = self.heap[0][0] if self.heap else None
+        if next_at == self._job_at:
+            return
+        if self._job:
+            self._job.schedule_removal()
+        self._job, self._job_at = None, next_at
+        if next_at:
+            # The scheduler skips a job more than a second late, a delay
+            # is never late
+            delay = (next_at - timezone.now()).total_seconds()
+            self._job = self.job_queue.run_once(
+                self.fire_job, when=max(delay, 0))
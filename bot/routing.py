@@ -0,0 +1,41 @@
+import re
+
+from telegram import Update
+from telegram.ext import Filters, Handler, MessageHandler
+
+
+class CaptionRouter(Handler):
+    """Route a message to a callback by its exact text with one dict lookup.
+
+    Replaces a run of MessageHandler(Filters.regex('^caption$'), callback)
+    entries of a conversation state. On a miss the next handlers of the
+    state are tried, e.g. a catch-all MessageHandler(Filters.text, ...).
+    """
+
+    def __init__(self, routes, run_async=False):
+        # The callback is chosen by check_update
+        super().__init__(None, run_async=run_async)
+        self.routes = dict(routes)
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or not update.effective_message:
+            return None
+        text = update.effective_message.text
+        if text is None:
+            return None
+        return self.routes.get(text)
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        if self.run_async:
+            return dispatcher.run_async(
+                check_result, update, context, update=update)
+        return check_result(update, context)
+
+    def as_regex_handlers(self):
+        """Equivalent MessageHandler per caption, for comparison"""
+        return [
+            MessageHandler(
+                Filters.regex(f'^{re.escape(caption)}$'), callback,
+                run_async=self.run_async)
+            for caption, callback in self.routes.items()
+        ]
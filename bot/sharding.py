@@ -0,0 +1,178 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from django.db import DatabaseError, close_old_connections
+from telegram import Bot, Update
+from telegram.error import NetworkError
+
+logger = logging.getLogger(__name__)
+
+SHARD_QUEUE_SIZE = 1000
+POLL_TIMEOUT = 10
+POLL_RETRY_DELAY = 3
+CANDIDATES_SYNC_INTERVAL = 10
+
+
+def shard_for(update, shards):
+    """Return the worker for an update, a user always goes to the same one"""
+    if update.effective_user:
+        key = update.effective_user.id
+    elif update.effective_chat:
+        key = update.effective_chat.id
+    else:
+        key = 0
+    return key % shards
+
+
+def serve_shard(updater, queue):
+    """Process the updates of a shard one by one until None is received"""
+    dispatcher = updater.dispatcher
+    while True:
+        data = queue.get()
+        if data is None:
+            return
+        dispatcher.process_update(Update.de_json(data, updater.bot))
+
+
+def run_worker(index, queue, tg_token, run_mailing):
+    """Entry point of a worker process"""
+    # The ingress stops the workers after the queued updates are processed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format=f'%(asctime)s - worker {index} - %(name)s - '
+               '%(levelname)s - %(message)s',
+        level=logging.INFO,
+    )
+    # The handlers live in the bot script at the project root
+    from bot_backend import create_updater
+
+    from .mailing import MAILING_POLL_INTERVAL, process_mailing_jobs
+    from .matchmaking import refresh_candidates
+    from .outbox import OutboxSender
+    from .reminders import ReminderScheduler
+
+    updater = create_updater(tg_token)
+    outbox_sender = None
+    if run_mailing:
+        updater.job_queue.run_repeating(
+            process_mailing_jobs, interval=MAILING_POLL_INTERVAL, first=1)
+        outbox_sender = OutboxSender(updater.bot).start()
+        ReminderScheduler(updater.job_queue).start()
+    updater.job_queue.run_repeating(
+        refresh_candidates, interval=CANDIDATES_SYNC_INTERVAL)
+    updater.job_queue.start()
+    try:
+        serve_shard(updater, queue)
+    finally:
+        updater.job_queue.stop()
+        if outbox_sender:
+            outbox_sender.stop()
+        updater.dispatcher.stop()
+        updater.dispatcher.persistence.flush()
+
+
+class ShardedBot:
+    """Receive updates by long polling and route them to worker processes.
+
+    Updates of a user always go to the same worker and are processed in
+    order. The workers keep the bot state in the database, so the number
+    of workers can be changed between restarts. With webhook_url the
+    updates are read from those the web processes stored instead.
+    """
+
+    def __init__(self, tg_token, workers, webhook_url=None):
+        self.tg_token = tg_token
+        self.workers = workers
+        self.webhook_url = webhook_url
+        self.bot = Bot(tg_token, base_url=os.getenv('TG_BASE_URL'))
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [
+            self.context.Queue(SHARD_QUEUE_SIZE) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.running = False
+
+    def start_worker(self, index):
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, self.queues[index], self.tg_token, index == 0),
+            name=f'bot-worker-{index}',
+        )
+        process.start()
+        self.processes[index] = process
+
+    def route(self, update):
+        index = shard_for(update, self.workers)
+        if not self.processes[index].is_alive():
+            logger.warning('Worker %s died, restarting', index)
+            self.start_worker(index)
+        self.queues[index].put(update.to_dict())
+
+    def stop(self, *args):
+        self.running = False
+
+    def poll_updates(self):
+        """Route the updates received by long polling until stopped"""
+        self.bot.delete_webhook()
+        offset = None
+        try:
+            while self.running:
+                try:
+                    updates = self.bot.get_updates(
+                        offset=offset, timeout=POLL_TIMEOUT)
+                except NetworkError:
+                    logger.exception('Failed to get updates')
+                    time.sleep(POLL_RETRY_DELAY)
+                    continue
+                for update in updates:
+                    self.route(update)
+                    offset = update.update_id + 1
+        finally:
+            if offset:
+                # Confirm the routed updates so they are not received again
+                self.bot.get_updates(offset=offset, timeout=0)
+
+    def read_stored_updates(self):
+        """Route the updates stored by the webhook until stopped"""
+        # Worker processes import this module before Django is set up
+        from .webhook import UpdateWaiter, delete_updates, fetch_updates
+
+        waiter = UpdateWaiter()
+        while self.running:
+            try:
+                rows = fetch_updates()
+                for _, data in rows:
+                    self.route(Update.de_json(data, self.bot))
+                delete_updates([row_id for row_id, _ in rows])
+            except DatabaseError:
+                logger.exception('Failed to read the stored updates')
+                close_old_connections()
+                time.sleep(POLL_RETRY_DELAY)
+                continue
+            if not rows:
+                waiter.wait()
+
+    def run(self):
+        if self.webhook_url:
+            from .webhook import set_webhook
+
+            # Fails on a missing secret before any worker is started
+            set_webhook(self.bot, self.webhook_url)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for index in range(self.workers):
+            self.start_worker(index)
+        self.running = True
+        try:
+            if self.webhook_url:
+                self.read_stored_updates()
+            else:
+                self.poll_updates()
+        finally:
+            for queue in self.queues:
+                queue.put(None)
+            for process in self.processes:
+                process.join()
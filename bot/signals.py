@@ -0,0 +1,86 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .matchmaking import update_candidate
+from .models import Event, EventGroup, Meetup, Presentation, Profile
+from .profiles import forget_profile, refresh_speaker_flags
+from .program import bump_program_version, default_meetup
+
+
+@receiver(post_save, sender=Meetup)
+@receiver(post_delete, sender=Meetup)
+@receiver(post_save, sender=EventGroup)
+@receiver(post_delete, sender=EventGroup)
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=Presentation)
+@receiver(post_delete, sender=Presentation)
+def program_changed(sender, **kwargs):
+    bump_program_version()
+
+
+@receiver(pre_save, sender=EventGroup)
+def assign_meetup(sender, instance, **kwargs):
+    if instance.meetup_id is None:
+        instance.meetup = default_meetup()
+    if instance.day is None:
+        instance.day = instance.meetup.starts_on
+
+
+@receiver(pre_save, sender=Presentation)
+def remember_previous_speaker(sender, instance, **kwargs):
+    instance._previous_speaker_id = None
+    if instance.pk:
+        instance._previous_speaker_id = Presentation.objects \
+            .filter(pk=instance.pk) \
+            .values_list('speaker_id', flat=True) \
+            .first()
+
+
+@receiver(post_save, sender=Presentation)
+@receiver(post_delete, sender=Presentation)
+def speaker_flag_changed(sender, instance, **kwargs):
+    profile_ids = {instance.speaker_id}
+    previous_speaker_id = getattr(instance, '_previous_speaker_id', None)
+    if previous_speaker_id:
+        profile_ids.add(previous_speaker_id)
+    refresh_speaker_flags(profile_ids)
+
+
+# Fields of a speaker the program shows
+SPEAKER_PROGRAM_FIELDS = ('name', 'telegram_id', 'telegram_username')
+
+
+def _speaker_contact(profile):
+    return tuple(getattr(profile, field) for field in SPEAKER_PROGRAM_FIELDS)
+
+
+@receiver(pre_save, sender=Profile)
+def remember_previous_contact(sender, instance, update_fields, **kwargs):
+    instance._previous_contact = None
+    if update_fields is not None \
+            and set(update_fields).isdisjoint(SPEAKER_PROGRAM_FIELDS):
+        return
+    if instance.pk and instance.is_speaker:
+        instance._previous_contact = Profile.objects \
+            .filter(pk=instance.pk) \
+            .values_list(*SPEAKER_PROGRAM_FIELDS) \
+            .first()
+
+
+@receiver(post_save, sender=Profile)
+def profile_changed(sender, instance, created, **kwargs):
+    forget_profile(instance.telegram_id)
+    previous_contact = getattr(instance, '_previous_contact', None)
+    if previous_contact and previous_contact != _speaker_contact(instance):
+        bump_program_version()
+
+
+@receiver(post_save, sender=Profile)
+def candidate_changed(sender, instance, **kwargs):
+    update_candidate(instance.id, instance.ready_meet)
+
+
+@receiver(post_delete, sender=Profile)
+def candidate_deleted(sender, instance, **kwargs):
+    update_candidate(instance.id, False)
@@ -1,3 +1,1965 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, time, timedelta
+from functools import partial
+from importlib import import_module
+from io import BytesIO, StringIO
+from queue import Queue
+from time import monotonic
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import (AsyncRequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from telegram import Update, User
+from telegram.error import (BadRequest, NetworkError, RetryAfter, TimedOut,
+                            Unauthorized)
+from telegram.ext import Dispatcher
+
+import bot_backend
+from bot import (answers, archive, broadcast, concurrency, dataset,
+                 duplicates, loadtest, mailing, matchmaking, metrics, outbox,
+                 profiles, program, program_import, reminders, views)
+from bot import admin as bot_admin
+from bot.broadcast import BroadcastReport, RateLimiter
+from bot.fake_telegram import FakeTelegramServer, message_update
+from bot.models import (ArchivedPresentation, ArchivedQuestion, Event,
+                        EventGroup, MailingDelivery, MailingJob, MailingList,
+                        Meetup, MetricsSnapshot, OutboxMessage, Presentation,
+                        Profile, Question, WebhookUpdate)
+from bot.persistence import DjangoPersistence
+from bot.routing import CaptionRouter
+from bot.sharding import ShardedBot, serve_shard, shard_for
+from bot.webhook import SECRET_TOKEN_HEADER
+
+
+class FakeMessage:
+    def __init__(self, text, chat_id, replies):
+        self.text = text
+        self.chat_id = chat_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.successful_payment = None
+        self._replies = replies
+
+    def reply_text(self, text, reply_markup=None, **kwargs):
+        self._replies.append((text, reply_markup))
+
+    reply_html = reply_text
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    def send_invoice(self, chat_id, *args, **kwargs):
+        self.sent.append((chat_id, 'invoice'))
+
+
+class HandlerTestCase(TestCase):
+    """Drive bot handlers with fake updates and count their queries"""
+
+    def setUp(self):
+        self.replies = []
+        self.bot = FakeBot()
+        self.context = SimpleNamespace(
+            bot=self.bot, user_data={}, chat_data={}, bot_data={})
+
+        self.speaker = Profile.objects.create(
+            name='Спикер', telegram_id='100', telegram_username='speaker')
+        self.listener = Profile.objects.create(
+            name='Слушатель', telegram_id='200', telegram_username='listener',
+            company='ООО', job='Разработчик', ready_meet=True)
+        self.other_speaker = Profile.objects.create(
+            name='Докладчик', telegram_id='300', telegram_username='other',
+            ready_meet=True)
+        group = EventGroup.objects.create(title='Поток 1')
+        EventGroup.objects.create(title='Поток 2')
+        self.event = Event.objects.create(
+            title='Доклады', time_from=time(10), time_to=time(11),
+            event_group=group, is_presentation=True)
+        Event.objects.create(
+            title='Обед', time_from=time(12), time_to=time(13),
+            event_group=group, is_presentation=False)
+        self.presentation = Presentation.objects.create(
+            title='Django', description='', event=self.event,
+            speaker=self.speaker)
+        Presentation.objects.create(
+            title='Telegram', description='', event=self.event,
+            speaker=self.other_speaker)
+        for number in range(5):
+            Question.objects.create(
+                presentation=self.presentation, listener=self.listener,
+                text=f'Вопрос {number}')
+            Question.objects.create(
+                presentation=self.presentation, listener=self.listener,
+                text=f'Отвеченный вопрос {number}', answer='Ответ',
+                is_active=False)
+
+        patcher = mock.patch.object(
+            program, 'PROGRAM_VERSION_CHECK_INTERVAL', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        program.invalidate_program()
+        program.get_program()
+        profiles.clear_profile_cache()
+        matchmaking.reset_matchmaking()
+        answers.clear_answers_cache()
+        duplicates.clear_question_indexes()
+
+    def update(self, text, user=None):
+        user = user or self.listener
+        tg_user = User(
+            id=int(user.telegram_id), first_name=user.name, is_bot=False,
+            username=user.telegram_username)
+        return SimpleNamespace(
+            effective_user=tg_user,
+            message=FakeMessage(text, tg_user.id, self.replies),
+        )
+
+    def run_handler(self, handler, text, budget, user=None):
+        with self.assertNumQueries(budget):
+            return handler(self.update(text, user), self.context)
+
+    def login(self, user=None):
+        user = user or self.listener
+        profiles.get_profile(user.telegram_id)
+
+    def test_start(self):
+        state = self.run_handler(bot_backend.start, '/start', 1)
+        self.assertEqual(state, bot_backend.MAIN_MENU_CHOICE)
+        self.assertEqual(
+            profiles.get_profile(self.listener.telegram_id).id,
+            self.listener.id,
+        )
+        self.run_handler(bot_backend.start, 'Главное меню', 0)
+
+    def test_start_new_user(self):
+        user = Profile(name='Новичок', telegram_id='400')
+        self.run_handler(bot_backend.start, '/start', 4, user=user)
+        text, _ = self.replies[-1]
+        self.assertEqual(text, 'Привет Новичок')
+        self.assertTrue(Profile.objects.filter(telegram_id='400').exists())
+
+    def test_start_renamed_user(self):
+        self.run_handler(bot_backend.start, '/start', 1)
+        self.listener.telegram_username = 'renamed'
+        self.run_handler(bot_backend.start, '/start', 1)
+        self.assertTrue(
+            Profile.objects.filter(telegram_username='renamed').exists())
+
+    def test_now_and_next(self):
+        self.login()
+        now = timezone.make_aware(
+            datetime.combine(timezone.localdate(), time(10, 30)))
+        with mock.patch.object(timezone, 'now', return_value=now):
+            state = self.run_handler(
+                bot_backend.show_now_and_next, 'Сейчас и далее', 0)
+        self.assertEqual(state, bot_backend.MAIN_MENU_CHOICE)
+        text, _ = self.replies[-1]
+        self.assertIn('Сейчас идёт:', text)
+        self.assertIn('Django — Спикер @speaker', text)
+        self.assertIn('12:00-13:00 Обед</b> (Поток 1)', text)
+
+        tomorrow = now + timedelta(days=1)
+        with mock.patch.object(timezone, 'now', return_value=tomorrow):
+            self.run_handler(
+                bot_backend.show_now_and_next, 'Сейчас и далее', 0)
+        self.assertEqual(self.replies[-1][0], 'Митап закончился')
+
+    def test_toggle_reminders(self):
+        self.login()
+        self.run_handler(bot_backend.toggle_reminders, 'Напоминания', 1)
+        self.assertIn('Напомню о докладах', self.replies[-1][0])
+        self.assertTrue(
+            Profile.objects.get(id=self.listener.id).wants_reminders)
+        self.run_handler(bot_backend.toggle_reminders, 'Напоминания', 2)
+        self.assertFalse(
+            Profile.objects.get(id=self.listener.id).wants_reminders)
+
+    def test_start_speaker(self):
+        self.run_handler(bot_backend.start, '/start', 1, user=self.speaker)
+        _, markup = self.replies[-1]
+        self.assertIs(markup, bot_backend.SPEAKER_MAIN_MENU_KEYBOARD)
+
+    def test_program_flow(self):
+        state = self.run_handler(
+            bot_backend.choose_event_group, 'Программа', 0)
+        self.assertEqual(state, bot_backend.EVENT_GROUP_CHOICE)
+        state = self.run_handler(bot_backend.choose_event, 'Поток 1', 0)
+        self.assertEqual(state, bot_backend.EVENT_CHOICE)
+        state = self.run_handler(bot_backend.show_event, '10:00 Доклады', 0)
+        self.assertEqual(state, bot_backend.EVENT_CHOICE)
+        text, _ = self.replies[-1]
+        self.assertIn('Django', text)
+        self.assertIn('Telegram', text)
+
+    def test_sections_of_two_days_with_the_same_title(self):
+        meetup = self.event.event_group.meetup
+        first_day = meetup.starts_on
+        second_day = first_day + timedelta(days=1)
+        meetup.ends_on = second_day
+        meetup.save()
+        group = EventGroup.objects.create(
+            title='Поток 1', meetup=meetup, day=second_day)
+        event = Event.objects.create(
+            title='Доклады', time_from=time(10), time_to=time(11),
+            event_group=group, is_presentation=True)
+        celery = Presentation.objects.create(
+            title='Celery', description='', event=event,
+            speaker=self.other_speaker)
+        program.invalidate_program()
+        program.get_program()
+        first_caption = f'Поток 1 {first_day:%d.%m}'
+        second_caption = f'Поток 1 {second_day:%d.%m}'
+
+        self.run_handler(bot_backend.choose_event_group, 'Программа', 0)
+        _, markup = self.replies[-1]
+        captions = [button.text for row in markup.keyboard for button in row]
+        self.assertIn(first_caption, captions)
+        self.assertIn(second_caption, captions)
+
+        self.run_handler(bot_backend.choose_event, first_caption, 0)
+        self.run_handler(bot_backend.show_event, '10:00 Доклады', 0)
+        text, _ = self.replies[-1]
+        self.assertIn('Django', text)
+        self.assertNotIn('Celery', text)
+
+        self.run_handler(bot_backend.choose_event_time, first_caption, 0)
+        self.assertNotIn(
+            celery.id, self.context.chat_data['event_times']['10:00-11:00'])
+        self.assertIn(
+            self.presentation.id,
+            self.context.chat_data['event_times']['10:00-11:00'])
+        self.run_handler(bot_backend.choose_event_time, second_caption, 0)
+        self.assertEqual(self.context.chat_data['event_times'],
+                         {'10:00-11:00': [celery.id]})
+
+    def test_only_shown_speaker_fields_change_the_program(self):
+        speaker = Profile.objects.get(id=self.speaker.id)
+        self.assertTrue(speaker.is_speaker)
+        version = program.get_program_version()
+        speaker.wants_reminders = not speaker.wants_reminders
+        speaker.save(update_fields=['wants_reminders'])
+        speaker.company = 'ООО'
+        speaker.save()
+        self.assertEqual(program.get_program_version(), version)
+        speaker.name = 'Новое имя'
+        speaker.save(update_fields=['name'])
+        self.assertGreater(program.get_program_version(), version)
+
+    def test_program_keyboards_are_shared(self):
+        self.run_handler(bot_backend.choose_event, 'Поток 1', 0)
+        self.run_handler(bot_backend.choose_event, 'Поток 1', 0)
+        (_, first), (_, second) = self.replies
+        self.assertIs(first, second)
+
+    def test_empty_group_returns_to_main_menu(self):
+        state = self.run_handler(bot_backend.choose_event, 'Поток 2', 1)
+        self.assertEqual(state, bot_backend.MAIN_MENU_CHOICE)
+
+    def test_ask_flow(self):
+        self.login()
+        state = self.run_handler(
+            bot_backend.choose_event_group_for_ask, 'Задать вопрос', 0)
+        self.assertEqual(state, bot_backend.CHOOSE_EVENT_TIME)
+        state = self.run_handler(bot_backend.choose_event_time, 'Поток 1', 0)
+        self.assertEqual(state, bot_backend.CHOOSE_EVENT_SPEAKERS)
+        state = self.run_handler(
+            bot_backend.choose_event_speakers, '10:00-11:00', 0)
+        self.assertEqual(state, bot_backend.QUESTION)
+        state = self.run_handler(bot_backend.ask_question, 'Спикер', 0)
+        self.assertEqual(state, bot_backend.SAVE_QUESTION)
+        state = self.run_handler(
+            bot_backend.save_question, 'Новый вопрос', 2)
+        self.assertEqual(state, bot_backend.CHOOSE_EVENT_SPEAKERS)
+        self.assertTrue(
+            Question.objects.filter(
+                text='Новый вопрос', presentation=self.presentation,
+                listener=self.listener,
+            ).exists()
+        )
+        json.dumps([self.context.user_data, self.context.chat_data])
+
+    def test_duplicate_question_joins_listener(self):
+        self.run_handler(bot_backend.choose_event_time, 'Поток 1', 0)
+        self.run_handler(bot_backend.choose_event_speakers, '10:00-11:00', 0)
+        self.run_handler(bot_backend.ask_question, 'Спикер', 0)
+        self.login()
+        self.run_handler(
+            bot_backend.save_question, 'Как масштабировать Django?', 2)
+        question = Question.objects.latest('id')
+        self.login(self.other_speaker)
+        self.run_handler(
+            bot_backend.save_question, 'как масштабировать django', 2,
+            user=self.other_speaker)
+        self.assertEqual(
+            self.replies[-1][0], 'Такой вопрос уже задали, ответ придёт и вам')
+        self.assertEqual(Question.objects.latest('id'), question)
+        self.assertEqual(
+            list(question.extra_listeners.all()), [self.other_speaker])
+
+        self.context.user_data['question'] = {
+            'id': question.id,
+            'text': question.text,
+            'listener_telegram_id': self.listener.telegram_id,
+            'presentation_id': self.presentation.id,
+        }
+        self.login(self.speaker)
+        self.run_handler(
+            bot_backend.answer_the_question, 'Ответ', 4, user=self.speaker)
+        self.assertEqual(
+            sorted(OutboxMessage.objects.values_list('chat_id', flat=True)),
+            [self.listener.telegram_id, self.other_speaker.telegram_id],
+        )
+        # The answered question no longer takes new listeners
+        self.run_handler(
+            bot_backend.save_question, 'Как масштабировать Django?', 1)
+        self.assertNotEqual(Question.objects.latest('id'), question)
+
+    def test_show_answered_questions(self):
+        self.login()
+        self.run_handler(bot_backend.choose_event_time, 'Поток 1', 0)
+        self.run_handler(bot_backend.choose_event_speakers, '10:00-11:00', 0)
+        self.run_handler(bot_backend.ask_question, 'Спикер', 0)
+        state = self.run_handler(
+            bot_backend.show_answered_questions, 'Показать вопросы', 2)
+        self.assertEqual(state, bot_backend.SAVE_QUESTION)
+        text, markup = self.replies[-1]
+        self.assertEqual(text.count('Ответ:'), 5)
+        self.assertIs(markup, bot_backend.ANSWERS_KEYBOARDS[(False, False)])
+        # The rendered pages are reused until the speaker answers again
+        self.run_handler(
+            bot_backend.show_answered_questions, 'Показать вопросы', 1)
+        self.assertEqual(self.replies[-1][0], text)
+
+    def test_answered_questions_are_paged(self):
+        Question.objects.filter(is_active=False).update(answer='Ответ' * 300)
+        self.login()
+        self.run_handler(bot_backend.choose_event_time, 'Поток 1', 0)
+        self.run_handler(bot_backend.choose_event_speakers, '10:00-11:00', 0)
+        self.run_handler(bot_backend.ask_question, 'Спикер', 0)
+        self.run_handler(
+            bot_backend.show_answered_questions, 'Показать вопросы', 2)
+        next_page = partial(bot_backend.show_answered_questions, step=1)
+        previous_page = partial(bot_backend.show_answered_questions, step=-1)
+        pages = [self.replies[-1]]
+        for _ in range(3):
+            self.run_handler(next_page, bot_backend.NEXT_ANSWERS_CAPTION, 0)
+            pages.append(self.replies[-1])
+        self.assertTrue(pages[0][0].endswith('Страница 1 из 3'))
+        self.assertTrue(pages[2][0].endswith('Страница 3 из 3'))
+        self.assertEqual(pages[3], pages[2])
+        self.assertEqual(
+            [markup for _, markup in pages[:3]],
+            [bot_backend.ANSWERS_KEYBOARDS[key]
+             for key in [(False, True), (True, True), (True, False)]],
+        )
+        self.assertEqual(
+            sum(text.count('Ответ:') for text, _ in pages[:3]), 5)
+        self.assertTrue(all(len(text) <= 4096 for text, _ in pages))
+        self.run_handler(previous_page, bot_backend.PREVIOUS_ANSWERS_CAPTION, 0)
+        self.assertEqual(self.replies[-1], pages[1])
+
+    def test_answer_refreshes_answered_questions(self):
+        self.login()
+        self.run_handler(bot_backend.choose_event_time, 'Поток 1', 0)
+        self.run_handler(bot_backend.choose_event_speakers, '10:00-11:00', 0)
+        self.run_handler(bot_backend.ask_question, 'Спикер', 0)
+        self.run_handler(
+            bot_backend.show_answered_questions, 'Показать вопросы', 2)
+        question = Question.objects.filter(is_active=True).first()
+        self.context.user_data['question'] = {
+            'id': question.id,
+            'text': question.text,
+            'listener_telegram_id': self.listener.telegram_id,
+        }
+        self.login(self.speaker)
+        self.run_handler(
+            bot_backend.answer_the_question, 'Новый ответ', 4,
+            user=self.speaker)
+        self.run_handler(
+            bot_backend.show_answered_questions, 'Показать вопросы', 2)
+        self.assertIn('Новый ответ', self.replies[-1][0])
+
+    def test_speaker_questions(self):
+        self.login(self.speaker)
+        state = self.run_handler(
+            bot_backend.new_question_from_the_speaker, 'Ответить на вопрос',
+            1, user=self.speaker)
+        self.assertEqual(state, bot_backend.ANSWER)
+        question_id = self.context.user_data['question']['id']
+        state = self.run_handler(
+            bot_backend.answer_the_question, 'Ответ', 4, user=self.speaker)
+        self.assertEqual(state, bot_backend.NEXT_QUESTION)
+        self.assertEqual(self.bot.sent, [])
+        self.assertEqual(
+            list(OutboxMessage.objects.values_list('chat_id', flat=True)),
+            [self.listener.telegram_id],
+        )
+        question = Question.objects.get(id=question_id)
+        self.assertFalse(question.is_active)
+        self.assertEqual(question.answer, 'Ответ')
+        state = self.run_handler(
+            bot_backend.new_question_from_the_speaker, 'Следующий вопрос',
+            1, user=self.speaker)
+        self.assertEqual(state, bot_backend.ANSWER)
+        text, _ = self.replies[-1]
+        self.assertEqual(text, 'Вопрос 1')
+
+    def test_answer_without_a_question(self):
+        self.login(self.speaker)
+        # The answer was sent again or the speaker had no questions
+        state = self.run_handler(
+            bot_backend.answer_the_question, 'Ответ без вопроса', 1,
+            user=self.speaker)
+        self.assertEqual(state, bot_backend.ANSWER)
+        self.assertFalse(
+            Question.objects.filter(answer='Ответ без вопроса').exists())
+        self.assertEqual(
+            self.replies[-1][0], Question.objects.filter(is_active=True)
+            .order_by('id').first().text)
+
+    def test_speaker_question_order(self):
+        self.login(self.speaker)
+        show_next = partial(
+            bot_backend.new_question_from_the_speaker, next=True)
+        self.run_handler(
+            bot_backend.new_question_from_the_speaker, 'Ответить на вопрос',
+            1, user=self.speaker)
+        Question.objects.create(
+            presentation=self.presentation, listener=self.listener,
+            text='Новый вопрос')
+        Question.objects.filter(text='Вопрос 1').update(is_active=False)
+        for _ in range(4):
+            self.run_handler(
+                show_next, 'Следующий вопрос', 1, user=self.speaker)
+        self.run_handler(show_next, 'Следующий вопрос', 2, user=self.speaker)
+        texts = [text for text, _ in self.replies]
+        self.assertEqual(texts, [
+            'Вопрос 0', 'Вопрос 2', 'Вопрос 3', 'Вопрос 4', 'Новый вопрос',
+            'Вопрос 0',
+        ])
+
+    def test_speaker_without_questions(self):
+        self.login(self.other_speaker)
+        self.run_handler(
+            bot_backend.new_question_from_the_speaker, 'Ответить на вопрос',
+            1, user=self.other_speaker)
+        text, _ = self.replies[-1]
+        self.assertEqual(text, 'Вопросов нет')
+
+    def test_donate(self):
+        state = self.run_handler(
+            bot_backend.ask_donate_amount, 'Задонатить', 0)
+        self.assertEqual(state, bot_backend.INPUT_DONATE)
+        state = self.run_handler(bot_backend.pay_donate, '100', 0)
+        self.assertEqual(state, bot_backend.CHECK_PAYMENT)
+        state = self.run_handler(
+            bot_backend.unsuccessful_payment, 'отмена', 0)
+        self.assertEqual(state, bot_backend.INPUT_DONATE)
+        state = self.run_handler(bot_backend.successful_payment, '', 1)
+        self.assertEqual(state, bot_backend.MAIN_MENU_CHOICE)
+
+    def test_precheckout(self):
+        query = mock.Mock(invoice_payload='Donate Meetup-BOT')
+        update = SimpleNamespace(pre_checkout_query=query)
+        with self.assertNumQueries(0):
+            bot_backend.precheckout_callback(update, self.context)
+        query.answer.assert_called_once_with(ok=True)
+
+    def test_help(self):
+        self.run_handler(bot_backend.help_command, '/help', 0)
+
+    def test_show_person(self):
+        self.login()
+        state = self.run_handler(bot_backend.start_meet, 'Познакомиться', 0)
+        self.assertEqual(state, bot_backend.MEET_CHOICE)
+        state = self.run_handler(
+            bot_backend.show_person, 'Подобрать знакомство', 2)
+        self.assertEqual(state, bot_backend.MEET_CHOICE)
+        text, _ = self.replies[-1]
+        self.assertIn('Докладчик', text)
+        self.run_handler(bot_backend.show_person, 'Подобрать знакомство', 1)
+        text, _ = self.replies[-1]
+        self.assertIn('Докладчик', text)
+
+    def test_show_person_deck(self):
+        self.login()
+        shown = {matchmaking.next_person(self.listener.id).id}
+        newcomers = [
+            Profile.objects.create(
+                name=f'Участник {number}', telegram_id=f'5{number}',
+                ready_meet=True)
+            for number in range(3)
+        ]
+        for _ in newcomers:
+            shown.add(matchmaking.next_person(self.listener.id).id)
+        self.assertEqual(
+            shown,
+            {self.other_speaker.id} | {person.id for person in newcomers},
+        )
+        Profile.objects.filter(id=self.other_speaker.id).update(
+            ready_meet=False)
+        for _ in range(8):
+            person = matchmaking.next_person(self.listener.id)
+            self.assertNotIn(person.id, [self.other_speaker.id, self.listener.id])
+
+    def test_show_person_nobody(self):
+        Profile.objects.exclude(id=self.listener.id).update(ready_meet=False)
+        self.login()
+        state = self.run_handler(
+            bot_backend.show_person, 'Подобрать знакомство', 2)
+        self.assertEqual(state, bot_backend.MAIN_MENU_CHOICE)
+        self.listener.refresh_from_db()
+        self.assertTrue(self.listener.waits_meet)
+
+    def test_survey(self):
+        self.login(self.speaker)
+        matchmaking.wait_for_people(self.listener.id)
+        state = self.run_handler(
+            bot_backend.start_survey, 'Заполнить анкету', 0,
+            user=self.speaker)
+        self.assertEqual(state, bot_backend.SURVEY_INPUT_NAME)
+        self.run_handler(
+            bot_backend.input_name, 'Иван Иванов', 0, user=self.speaker)
+        self.run_handler(
+            bot_backend.input_company, 'ООО', 0, user=self.speaker)
+        state = self.run_handler(
+            bot_backend.input_job, 'CTO', 0, user=self.speaker)
+        self.assertEqual(state, bot_backend.SURVEY_CONFIRM)
+        # The speaker's previous name is read to tell if the program changed
+        state = self.run_handler(
+            bot_backend.save_survey, 'Да, всё верно', 6, user=self.speaker)
+        self.assertEqual(state, bot_backend.ConversationHandler.END)
+        self.assertEqual(
+            list(OutboxMessage.objects.values_list('chat_id', 'text')),
+            [(self.listener.telegram_id, '🤝 Появились новые анкеты 🤝')],
+        )
+        self.listener.refresh_from_db()
+        self.assertFalse(self.listener.waits_meet)
+        self.speaker.refresh_from_db()
+        self.assertTrue(self.speaker.ready_meet)
+
+
+class QuestionIndexTestCase(TestCase):
+    def test_similar_questions_are_found(self):
+        index = duplicates.PresentationIndex([
+            (1, 'Какие планы на следующий релиз?'),
+            (2, 'Как масштабировать Django под нагрузкой?'),
+            (3, 'Как масштабировать Django под нагрузкой'),
+        ])
+        self.assertEqual(
+            index.find('как МАСШТАБИРОВАТЬ django под нагрузкой!!'), 2)
+        self.assertEqual(index.find('Какие планы на следующий релиз'), 1)
+        self.assertIsNone(index.find('Где посмотреть слайды?'))
+        self.assertIsNone(index.find('?!'))
+        index.remove(2)
+        self.assertEqual(
+            index.find('как масштабировать django под нагрузкой'), 3)
+        index.remove(3)
+        self.assertIsNone(
+            index.find('как масштабировать django под нагрузкой'))
+        self.assertNotIn('асш', index.postings)
+
+
+class SpeakerFlagTestCase(TestCase):
+    def test_flag_follows_presentations(self):
+        speaker = Profile.objects.create(name='Спикер', telegram_id='1')
+        other = Profile.objects.create(name='Другой', telegram_id='2')
+        group = EventGroup.objects.create(title='Поток')
+        event = Event.objects.create(
+            title='Доклады', time_from=time(10), time_to=time(11),
+            event_group=group, is_presentation=True)
+        presentation = Presentation.objects.create(
+            title='Django', description='', event=event, speaker=speaker)
+        speaker.refresh_from_db()
+        self.assertTrue(speaker.is_speaker)
+
+        presentation.speaker = other
+        presentation.save()
+        speaker.refresh_from_db()
+        other.refresh_from_db()
+        self.assertFalse(speaker.is_speaker)
+        self.assertTrue(other.is_speaker)
+
+        presentation.delete()
+        other.refresh_from_db()
+        self.assertFalse(other.is_speaker)
+
+
+class ExplainQueriesTestCase(TestCase):
+    def test_command_runs(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn('speaker: next question', out.getvalue())
+        self.assertIn('presentation_id', out.getvalue())
+
+
+class MergeDuplicateProfilesTestCase(SimpleTestCase):
+    def test_newer_answers_fill_the_kept_profile(self):
+        migration = import_module(
+            'bot.migrations.0016_merge_duplicate_profiles')
+        keep = SimpleNamespace(
+            name='Иван', telegram_username='ivan', company=None, job='',
+            ready_meet=False)
+        newer = SimpleNamespace(
+            name='Иван Петров', telegram_username=None, company='ООО',
+            job='Разработчик', ready_meet=True)
+        newest = SimpleNamespace(
+            name='', telegram_username=None, company=None, job='Тимлид',
+            ready_meet=False)
+        migration.merge_fields(keep, [newer, newest])
+        self.assertEqual(
+            (keep.name, keep.telegram_username, keep.company, keep.job,
+             keep.ready_meet),
+            ('Иван Петров', 'ivan', 'ООО', 'Тимлид', True))
+
+
+# The manifest is built by collectstatic on deploy
+@override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            get_user_model().objects.create_superuser('admin'))
+        group = EventGroup.objects.create(title='Поток 1')
+        self.event = Event.objects.create(
+            title='Доклады', time_from=time(10), time_to=time(11),
+            event_group=group, is_presentation=True)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            number = Profile.objects.count()
+            profile = Profile.objects.create(
+                name=f'Участник {number}', telegram_id=str(number),
+                telegram_username=f'user{number}')
+            presentation = Presentation.objects.create(
+                title=f'Доклад {number}', description='', event=self.event,
+                speaker=profile)
+            Question.objects.create(
+                presentation=presentation, listener=profile, text='Вопрос')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = [
+            '/admin/bot/profile/',
+            '/admin/bot/profile/?q=user1',
+            '/admin/bot/question/',
+            '/admin/bot/question/?q=user1',
+            '/admin/bot/presentation/',
+            '/admin/bot/event/',
+        ]
+        self.add_rows(2)
+        few = [self.count_queries(url) for url in urls]
+        self.add_rows(20)
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+
+    def test_question_search_by_listener(self):
+        self.add_rows(3)
+        response = self.client.get('/admin/bot/question/?q=user1')
+        self.assertEqual(
+            [question.listener.telegram_username
+             for question in response.context['cl'].result_list],
+            ['user1'],
+        )
+
+    def test_autocomplete(self):
+        self.add_rows(3)
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'bot', 'model_name': 'question',
+            'field_name': 'listener', 'term': 'Участник 2',
+        })
+        self.assertEqual(
+            [item['text'] for item in response.json()['results']],
+            ['Участник 2 @user2'],
+        )
+        question = Question.objects.first()
+        response = self.client.get(
+            f'/admin/bot/question/{question.id}/change/')
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_large_table_count_is_estimated(self):
+        self.add_rows(3)
+        # The table statistics of Postgres
+        with mock.patch.object(bot_admin, 'estimate_count',
+                               return_value=30000):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin/bot/question/')
+            self.assertEqual(response.context['cl'].result_count, 30000)
+            self.assertFalse(any(
+                'COUNT(' in query['sql']
+                for query in queries.captured_queries))
+            # Filtered lists are counted exactly
+            response = self.client.get(
+                '/admin/bot/question/?is_active__exact=0')
+            self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_count_after_deletes(self):
+        self.add_rows(3)
+        Question.objects.filter(
+            id__in=Question.objects.order_by('id').values('id')[:2]).delete()
+        with mock.patch.object(bot_admin, 'ESTIMATED_COUNT_MIN', 0):
+            response = self.client.get('/admin/bot/question/')
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class CaptionRouterTestCase(TestCase):
+    def test_exact_caption(self):
+        router = CaptionRouter({'Назад': bot_backend.start})
+        update = Update.de_json(message_update(1, 1, 'Назад'), None)
+        self.assertIs(router.check_update(update), bot_backend.start)
+        for text in ['Назад!', 'назад', '/start']:
+            update = Update.de_json(message_update(1, 1, text), None)
+            self.assertIsNone(router.check_update(update))
+
+    def test_benchmark_runs(self):
+        out = StringIO()
+        call_command('bench_routing', rounds=1, stdout=out)
+        self.assertIn('caption routers', out.getvalue())
+
+
+class PersistenceTestCase(TestCase):
+    def test_state_survives_restart(self):
+        persistence = DjangoPersistence()
+        self.assertEqual(persistence.get_conversations('main'), {})
+        persistence.update_user_data(1, {'question_cursor': 5})
+        persistence.update_chat_data(2, {'event_times': {'10:00-11:00': [1]}})
+        persistence.update_bot_data({'lonely_user': 1})
+        persistence.update_conversation('main', (2, 1), 3)
+        persistence.update_conversation('survey', (2, 1), 0)
+        with self.assertNumQueries(0):
+            persistence.update_user_data(1, {'question_cursor': 5})
+        persistence.flush()
+        persistence.update_conversation('survey', (2, 1), None)
+        persistence.flush()
+
+        restored = DjangoPersistence()
+        self.assertEqual(restored.get_user_data()[1], {'question_cursor': 5})
+        self.assertEqual(
+            restored.get_chat_data()[2],
+            {'event_times': {'10:00-11:00': [1]}},
+        )
+        self.assertEqual(restored.get_bot_data(), {'lonely_user': 1})
+        self.assertEqual(restored.get_conversations('main'), {(2, 1): 3})
+        self.assertEqual(restored.get_conversations('survey'), {})
+
+
+class FakeTelegramMixin:
+    """Run the bot handlers against a fake Bot API server"""
+
+    handler_threads = 1
+
+    def setUp(self):
+        profiles.clear_profile_cache()
+        matchmaking.reset_matchmaking()
+        answers.clear_answers_cache()
+        duplicates.clear_question_indexes()
+        self.server = FakeTelegramServer().start()
+        self.addCleanup(self.server.stop)
+        with mock.patch.dict('os.environ', TG_BASE_URL=self.server.base_url):
+            self.updater = bot_backend.create_updater(
+                '123:TEST', handler_threads=self.handler_threads)
+
+
+class FakeTelegramTestCase(FakeTelegramMixin, TestCase):
+    pass
+
+
+@override_settings(TG_WEBHOOK_SECRET='secret')
+class WebhookTestCase(FakeTelegramTestCase):
+    url = '/telegram/secret/'
+
+    def post(self, data, secret='secret', url=None):
+        return self.client.post(
+            url or self.url,
+            json.dumps(data),
+            content_type='application/json',
+            HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN=secret,
+        )
+
+    def test_update_is_stored_for_the_bot(self):
+        response = self.post(message_update(1, 200, '/start'))
+        self.assertEqual(response.status_code, 200)
+        # Telegram repeats an update it got no answer for
+        self.assertEqual(
+            self.post(message_update(1, 200, '/start')).status_code, 200)
+        self.assertEqual(WebhookUpdate.objects.count(), 1)
+
+        sharded = ShardedBot('123:TEST', 2, 'https://example.com')
+        routed = []
+        sharded.route = routed.append
+
+        def stop(delay):
+            sharded.running = False
+
+        sharded.running = True
+        with mock.patch('time.sleep', stop):
+            sharded.read_stored_updates()
+        self.assertEqual([update.update_id for update in routed], [1])
+        self.assertFalse(WebhookUpdate.objects.exists())
+
+        # Workers get the update as a dict, like route() sends it
+        self.updater.dispatcher.process_update(
+            Update.de_json(routed[0].to_dict(), self.updater.bot))
+        messages = self.server.calls_of('sendMessage')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(int(messages[0]['chat_id']), 200)
+
+    @override_settings(TG_WEBHOOK_SECRET='')
+    def test_webhook_requires_a_secret(self):
+        sharded = ShardedBot('123:TEST', 1, 'https://example.com')
+        with mock.patch.object(sharded, 'start_worker') as start_worker, \
+                self.assertRaises(ImproperlyConfigured):
+            sharded.run()
+        start_worker.assert_not_called()
+        self.assertFalse(self.server.calls_of('setWebhook'))
+
+    def test_wrong_secret_is_rejected(self):
+        self.assertEqual(self.post({}, secret='wrong').status_code, 403)
+        response = self.post({}, url='/telegram/wrong/')
+        self.assertEqual(response.status_code, 403)
+        response = self.post({}, url='/telegram/секрет/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.post({'message': {}}).status_code, 400)
+        self.assertFalse(WebhookUpdate.objects.exists())
+
+    def test_async_view(self):
+        request = AsyncRequestFactory().post(
+            self.url,
+            json.dumps(message_update(1, 200, '/start')),
+            content_type='application/json',
+            **{SECRET_TOKEN_HEADER: 'secret'},
+        )
+        response = async_to_sync(views.telegram_webhook_async)(
+            request, 'secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookUpdate.objects.get().update_id, 1)
+
+
+class ShardingTestCase(FakeTelegramTestCase):
+    def test_user_stays_on_shard(self):
+        updates = [
+            Update.de_json(message_update(number, user_id, '/start'), None)
+            for number, user_id in enumerate([7, 8, 7, 9, 7])
+        ]
+        shards = {shard_for(update, 3) for update in updates[::2]}
+        self.assertEqual(len(shards), 1)
+
+    def test_shard_keeps_conversation_order(self):
+        queue = Queue()
+        texts = ['/start', 'Познакомиться', 'Заполнить анкету', 'Иван']
+        for number, text in enumerate(texts, start=1):
+            queue.put(message_update(number, 200, text))
+        queue.put(None)
+        serve_shard(self.updater, queue)
+
+        replies = [params['text'] for params in self.server.calls_of(
+            'sendMessage')]
+        self.assertEqual(len(replies), 4)
+        self.assertIn('Как называется Ваша компания?', replies[-1])
+        persistence = self.updater.dispatcher.persistence
+        persistence.flush()
+        restored = DjangoPersistence()
+        self.assertEqual(
+            restored.get_user_data()[200]['survey_name'], 'Иван')
+        self.assertEqual(
+            restored.get_conversations('survey'),
+            {(200, 200): bot_backend.SURVEY_INPUT_COMPANY},
+        )
+
+    def test_sync_candidates(self):
+        first = Profile.objects.create(
+            name='Первый', telegram_id='1', ready_meet=True)
+        matchmaking.reset_matchmaking()
+        self.assertIsNone(matchmaking.next_person(first.id))
+        # Changes made by another process do not send signals here
+        second = Profile.objects.bulk_create([
+            Profile(name='Второй', telegram_id='2', ready_meet=True),
+        ])[0]
+        matchmaking.sync_candidates()
+        self.assertEqual(matchmaking.next_person(first.id).name, second.name)
+
+    def test_user_joining_the_pool_is_not_drawn(self):
+        other = Profile.objects.create(
+            name='Другой', telegram_id='2', ready_meet=True)
+        user = Profile.objects.create(name='Я', telegram_id='1')
+        matchmaking.reset_matchmaking()
+        self.assertEqual(matchmaking.next_person(user.id), other)
+        # The user filled in the survey in another process
+        Profile.objects.filter(id=user.id).update(ready_meet=True)
+        matchmaking.sync_candidates()
+        for _ in range(3):
+            self.assertEqual(matchmaking.next_person(user.id), other)
+
+
+class ConcurrentDispatcherTestCase(FakeTelegramMixin, TransactionTestCase):
+    """Handler threads use their own connections, so the data is committed"""
+
+    handler_threads = 4
+
+    def test_users_are_processed_in_order(self):
+        self.assertIsInstance(
+            self.updater.dispatcher, concurrency.ConcurrentDispatcher)
+        user_ids = range(1000, 1010)
+        steps = ['/start', 'Познакомиться', 'Заполнить анкету', 'Иван', 'ООО']
+        # Connections to the in-memory test database lock whole tables
+        db_lock = threading.Lock()
+        process_update = Dispatcher.process_update
+
+        def locked_process_update(dispatcher, update):
+            with db_lock:
+                process_update(dispatcher, update)
+
+        update_id = 0
+        with mock.patch.object(
+                Dispatcher, 'process_update', locked_process_update):
+            for text in steps:
+                for user_id in user_ids:
+                    update_id += 1
+                    self.updater.dispatcher.process_update(Update.de_json(
+                        message_update(update_id, user_id, text),
+                        self.updater.bot,
+                    ))
+            self.updater.dispatcher.stop()
+
+        replies = self.server.calls_of('sendMessage')
+        self.assertEqual(len(replies), len(steps) * len(user_ids))
+        conversations = self.updater.persistence.get_conversations('survey')
+        for user_id in user_ids:
+            texts = [
+                params['text'] for params in replies
+                if int(params['chat_id']) == user_id
+            ]
+            self.assertIn('Как называется Ваша должность?', texts[-1])
+            self.assertEqual(
+                conversations[(user_id, user_id)],
+                bot_backend.SURVEY_INPUT_JOB,
+            )
+
+    def test_dead_idle_connection_is_closed(self):
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'close') as close:
+            concurrency.prepare_connections(
+                last_used=monotonic() - concurrency.DB_IDLE_CHECK_INTERVAL - 1)
+            close.assert_called_once()
+            close.reset_mock()
+            concurrency.prepare_connections(last_used=monotonic())
+            close.assert_not_called()
+
+
+class MetricsTestCase(FakeTelegramTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+
+    @override_settings(DEBUG=True)
+    def test_handler_and_api_metrics(self):
+        self.updater.dispatcher.process_update(Update.de_json(
+            message_update(1, 200, '/start'), self.updater.bot))
+        MetricsSnapshot.objects.create(source='worker:1', data={
+            'counters': [
+                ['bot_handler_errors_total',
+                 {'handler': 'start', 'error': 'ValueError'}, 2],
+            ],
+            'histograms': [],
+        })
+
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn(
+            'bot_handler_seconds_bucket{handler="start",le="+Inf"} 1', text)
+        self.assertIn('bot_handler_db_queries_total{handler="start"} ', text)
+        self.assertIn('telegram_api_seconds_count{method="sendMessage"} 1', text)
+        self.assertIn(
+            'bot_handler_errors_total{error="ValueError",handler="start"} 2',
+            text,
+        )
+
+        # A request is recorded after its response is rendered
+        text = self.client.get('/metrics/').content.decode()
+        self.assertIn('http_request_seconds_count{view="metrics"} 1', text)
+        # Snapshots are published by a background thread, not requests
+        self.assertFalse(MetricsSnapshot.objects.filter(
+            source=metrics._source).exists())
+
+    def test_async_middleware(self):
+        async def view(request):
+            request.resolver_match = SimpleNamespace(view_name='async_view')
+            await sync_to_async(Profile.objects.count)()
+            return 'response'
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = AsyncRequestFactory().get('/')
+        self.assertEqual(async_to_sync(middleware)(request), 'response')
+        self.assertEqual(
+            metrics.registry.histograms[(
+                'http_request_seconds', (('view', 'async_view'),))]['count'],
+            1,
+        )
+        self.assertEqual(
+            metrics.registry.counters[(
+                'http_request_db_queries_total', (('view', 'async_view'),))],
+            1,
+        )
+
+    def test_handler_errors(self):
+        def broken(update, context):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            metrics.timed_handler(broken)(None, None)
+        self.assertEqual(
+            metrics.registry.counters[(
+                'bot_handler_errors_total',
+                (('error', 'ValueError'), ('handler', 'broken')),
+            )],
+            1,
+        )
+
+    @override_settings(METRICS_TOKEN='token')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        response = self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION='Bearer token')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_closed_without_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics/').status_code, 200)
+
+
+class FlakyBot(FakeBot):
+    """Raise the queued errors for a chat before sending to it"""
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+
+    def send_message(self, chat_id, text, **kwargs):
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        super().send_message(chat_id, text)
+
+
+@mock.patch.object(broadcast, 'BACKOFF_BASE', 0)
+class BroadcastTestCase(SimpleTestCase):
+    def setUp(self):
+        self.limiter = RateLimiter(chat_interval=0)
+        self.results = {}
+
+    def send(self, bot, chat_ids):
+        return broadcast.broadcast(
+            bot, chat_ids, 'Привет', limiter=self.limiter,
+            on_result=self.results.__setitem__)
+
+    def test_sends_to_every_chat(self):
+        bot = FakeBot()
+        report = self.send(bot, ['1', '2', '3'])
+        self.assertEqual((report.total, report.sent, report.retries),
+                         (3, 3, 0))
+        self.assertFalse(report.failures)
+        self.assertEqual(
+            sorted(bot.sent), [('1', 'Привет'), ('2', 'Привет'),
+                               ('3', 'Привет')])
+        self.assertEqual(self.results, {'1': None, '2': None, '3': None})
+
+    def test_retry_after_pauses_every_sender(self):
+        bot = FlakyBot({'1': [RetryAfter(0.3)]})
+        started_at = monotonic()
+        report = broadcast.broadcast(
+            bot, ['1', '2'], 'Привет', workers=1, limiter=self.limiter)
+        self.assertGreaterEqual(monotonic() - started_at, 0.3)
+        self.assertEqual((report.sent, report.retries), (2, 1))
+
+    def test_network_errors_are_retried(self):
+        bot = FlakyBot({'1': [NetworkError('Bad gateway'), TimedOut()]})
+        report = self.send(bot, ['1', '2'])
+        self.assertEqual((report.sent, report.retries), (2, 2))
+        self.assertIsNone(self.results['1'])
+
+    def test_gives_up_after_max_attempts(self):
+        bot = FlakyBot({
+            '1': [NetworkError('Bad gateway')] * broadcast.MAX_ATTEMPTS})
+        report = self.send(bot, ['1', '2'])
+        self.assertEqual(report.sent, 1)
+        self.assertEqual(report.failures, {'NetworkError': 1})
+        self.assertEqual(bot.sent, [('2', 'Привет')])
+        self.assertIsInstance(self.results['1'], NetworkError)
+
+    def test_blocked_and_bad_chats_are_not_retried(self):
+        bot = FlakyBot({
+            '1': [Unauthorized('Forbidden: bot was blocked by the user')],
+            '2': [BadRequest('Chat not found')],
+        })
+        report = self.send(bot, ['1', '2', '3'])
+        self.assertEqual((report.total, report.sent, report.retries),
+                         (3, 1, 0))
+        self.assertEqual(report.failures, {'Unauthorized': 1, 'BadRequest': 1})
+        self.assertEqual(bot.sent, [('3', 'Привет')])
+        self.assertIsInstance(self.results['1'], Unauthorized)
+        self.assertIsInstance(self.results['2'], BadRequest)
+        self.assertIn('ошибки: ', str(report))
+
+    def test_rate_limit(self):
+        limiter = RateLimiter(rate=20, chat_interval=0)
+        started_at = monotonic()
+        report = broadcast.broadcast(
+            FakeBot(), [str(number) for number in range(30)], 'Привет',
+            limiter=limiter)
+        # The first 20 messages use up the bucket, 10 more take half a second
+        self.assertGreaterEqual(monotonic() - started_at, 0.45)
+        self.assertEqual(report.sent, 30)
+
+    def test_chat_interval(self):
+        limiter = RateLimiter(chat_interval=0.2)
+        bot = FakeBot()
+        started_at = monotonic()
+        for _ in range(3):
+            broadcast.send_with_retry(bot, limiter, '1', 'Привет')
+        self.assertGreaterEqual(monotonic() - started_at, 0.4)
+        self.assertEqual(len(bot.sent), 3)
+
+    def test_report(self):
+        report = BroadcastReport(total=3, sent=2, elapsed=2)
+        self.assertEqual(report.rate, 1)
+        self.assertEqual(
+            str(report), 'Отправлено 2 из 3 за 2.0 с (1.0 сообщ./с)')
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.limiter = RateLimiter(chat_interval=0)
+
+    def deliver(self, bot):
+        return outbox.deliver_due_messages(bot, self.limiter)
+
+    def make_due(self):
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+
+    def test_chat_order_is_kept_on_retry(self):
+        outbox.enqueue_messages(['1', '2'], 'Первое')
+        outbox.enqueue_message('1', 'Второе')
+        bot = FlakyBot({'1': [NetworkError('Bad gateway')]})
+
+        self.assertEqual(self.deliver(bot), 1)
+        self.assertEqual(bot.sent, [('2', 'Первое')])
+        first = OutboxMessage.objects.filter(chat_id='1').earliest('id')
+        self.assertEqual(first.attempts, 1)
+        self.assertGreater(first.next_attempt_at, timezone.now())
+        self.assertEqual(self.deliver(bot), 0)
+
+        self.make_due()
+        self.assertEqual(self.deliver(bot), 2)
+        self.assertEqual(
+            bot.sent, [('2', 'Первое'), ('1', 'Первое'), ('1', 'Второе')])
+        self.assertFalse(
+            OutboxMessage.objects.exclude(status=OutboxMessage.SENT).exists())
+
+    def test_waiting_chats_do_not_block_due_messages(self):
+        later = timezone.now() + timedelta(seconds=300)
+        OutboxMessage.objects.bulk_create(
+            OutboxMessage(chat_id=str(number), text='Повтор',
+                          next_attempt_at=later, attempts=3)
+            for number in range(outbox.OUTBOX_BATCH_SIZE + 1)
+        )
+        outbox.enqueue_message('0', 'После повтора')
+        outbox.enqueue_message('1000', 'Новое')
+        bot = FakeBot()
+        self.assertEqual(self.deliver(bot), 1)
+        self.assertEqual(bot.sent, [('1000', 'Новое')])
+
+    def test_flood_control_spends_no_attempt(self):
+        outbox.enqueue_message('1', 'Текст')
+        bot = FlakyBot({'1': [RetryAfter(30)]})
+        self.deliver(bot)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.attempts, 0)
+        self.assertGreater(
+            message.next_attempt_at, timezone.now() + timedelta(seconds=20))
+
+    def test_permanent_errors_and_exhausted_attempts_fail(self):
+        outbox.enqueue_message('1', 'Первое')
+        outbox.enqueue_message('1', 'Второе')
+        outbox.enqueue_message('2', 'Текст')
+        bot = FlakyBot({
+            '1': [Unauthorized('Forbidden: bot was blocked by the user')],
+            '2': [TimedOut()] * outbox.MAX_ATTEMPTS,
+        })
+        for _ in range(outbox.MAX_ATTEMPTS):
+            self.deliver(bot)
+            self.make_due()
+        self.assertEqual(bot.sent, [('1', 'Второе')])
+        self.assertEqual(
+            list(OutboxMessage.objects.order_by('id')
+                 .values_list('status', flat=True)),
+            [OutboxMessage.FAILED, OutboxMessage.SENT, OutboxMessage.FAILED],
+        )
+
+
+class MailingTestCase(TestCase):
+    def setUp(self):
+        for number in range(1, 4):
+            Profile.objects.create(
+                name=f'Участник {number}', telegram_id=str(number))
+        # Imported speakers who have not started the bot get nothing
+        Profile.objects.create(name='Спикер', telegram_username='speaker')
+        self.mailing = MailingList.objects.create(
+            name='Новости', message='Привет')
+
+    def make_stale(self, job):
+        MailingJob.objects.filter(id=job.id).update(
+            heartbeat_at=timezone.now() - mailing.STALE_JOB_TIMEOUT
+            - timedelta(seconds=1))
+
+    def test_enqueue_mailing(self):
+        job = mailing.enqueue_mailing(self.mailing)
+        self.assertEqual(job.total, 3)
+        self.assertEqual(
+            sorted(job.deliveries.values_list('chat_id', flat=True)),
+            ['1', '2', '3'])
+
+    def test_claim_and_run(self):
+        job = mailing.enqueue_mailing(self.mailing)
+        claimed = mailing.claim_job()
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, MailingJob.RUNNING)
+        self.assertIsNone(mailing.claim_job())
+
+        bot = FakeBot()
+        report = mailing.run_job(bot, claimed)
+        self.assertEqual(report.sent, 3)
+        self.assertEqual(
+            sorted(bot.sent), [('1', 'Привет'), ('2', 'Привет'),
+                               ('3', 'Привет')])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.sent, job.failed),
+                         (MailingJob.DONE, 3, 0))
+
+    def test_stale_job_resumes_without_sending_twice(self):
+        job = mailing.enqueue_mailing(self.mailing)
+        first = mailing.claim_job()
+        # The worker sent a message and stopped while sending another
+        job.deliveries.filter(chat_id='1') \
+            .update(status=MailingDelivery.SENT)
+        job.deliveries.filter(chat_id='2') \
+            .update(status=MailingDelivery.SENDING)
+        self.assertIsNone(mailing.claim_job())
+
+        self.make_stale(job)
+        second = mailing.claim_job()
+        self.assertEqual(second.attempt, first.attempt + 1)
+        bot = FakeBot()
+        mailing.run_job(bot, second)
+        self.assertEqual(bot.sent, [('3', 'Привет')])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.sent, job.failed),
+                         (MailingJob.DONE, 2, 1))
+        self.assertEqual(
+            job.deliveries.get(chat_id='2').error, mailing.INTERRUPTED_ERROR)
+
+    def test_taken_over_worker_stops(self):
+        job = mailing.enqueue_mailing(self.mailing)
+        first = mailing.claim_job()
+        self.make_stale(job)
+        second = mailing.claim_job()
+        self.assertIsNone(mailing.claim_deliveries(first))
+        bot = FakeBot()
+        mailing.run_job(bot, first)
+        self.assertEqual(bot.sent, [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, MailingJob.RUNNING)
+        self.assertEqual(job.attempt, second.attempt)
+
+    def test_heartbeat_runs_while_sending_waits(self):
+        mailing.enqueue_mailing(self.mailing)
+        job = mailing.claim_job()
+        beaten = threading.Event()
+        with mock.patch.object(mailing, '_owned_jobs') as owned_jobs:
+            owned_jobs.return_value.update.side_effect = \
+                lambda **fields: beaten.set()
+            with mailing.Heartbeat(job, interval=0.01):
+                self.assertTrue(beaten.wait(timeout=5))
+
+
+class OutboxSenderTestCase(FakeTelegramMixin, TransactionTestCase):
+    def test_queued_message_is_sent(self):
+        sender = outbox.OutboxSender(self.updater.bot, poll_interval=5)
+        sender.start()
+        self.addCleanup(sender.stop)
+        outbox.enqueue_message(200, 'Получен ответ на вопрос')
+        deadline = monotonic() + 5
+        while not self.server.calls_of('sendMessage'):
+            self.assertLess(monotonic(), deadline)
+            threading.Event().wait(0.01)
+        self.assertEqual(
+            self.server.calls_of('sendMessage')[0]['text'],
+            'Получен ответ на вопрос',
+        )
+
+
+class LoadTestTestCase(FakeTelegramMixin, TransactionTestCase):
+    def test_users_walk_their_paths(self):
+        loadtest.seed_program(groups=1, slots=2, questions_per_speaker=3)
+        seeded_questions = Question.objects.count()
+        self.assertEqual(seeded_questions, 4 * 3)
+        program.invalidate_program()
+        current = program.get_program()
+        speakers = [
+            presentation.speaker
+            for group in current.groups
+            for event in group.events
+            for presentation in event.presentations
+        ]
+        paths = loadtest.build_paths(current, speakers)
+        self.assertEqual(
+            set(paths), {'program', 'ask', 'meet', 'donate', 'answer'})
+        users = loadtest.create_users(paths, 10, speakers, seed=1)
+        steps = sum(len(user.steps) for user in users)
+
+        self.updater.start_polling(poll_interval=0, timeout=1)
+        try:
+            test = loadtest.LoadTest(self.server, users, reply_timeout=5)
+            elapsed = test.run()
+        finally:
+            self.updater.stop()
+
+        self.assertEqual(sum(test.lost.values()), 0)
+        replies = sum(len(latencies) for latencies in test.latencies.values())
+        self.assertEqual(replies, steps)
+        self.assertIn('p99', test.report(elapsed))
+        self.assertEqual(
+            Question.objects.count(),
+            seeded_questions + sum(user.path == 'ask' for user in users),
+        )
+        self.assertEqual(
+            Question.objects.filter(is_active=False).count(),
+            sum(user.path == 'answer' for user in users),
+        )
+
+
+class DatasetTestCase(TestCase):
+    def generate(self, seed=0):
+        dataset.generate_dataset(
+            profiles=40, groups=2, events_per_group=4, presentations=6,
+            questions=120, seed=seed)
+
+    def test_generated_counts(self):
+        self.generate()
+        self.assertEqual(
+            Profile.objects.filter(
+                telegram_username__startswith='dataset_').count(), 40)
+        self.assertEqual(Event.objects.count(), 8)
+        self.assertEqual(Presentation.objects.count(), 6)
+        self.assertEqual(Question.objects.count(), 120)
+        self.assertEqual(Profile.objects.filter(is_speaker=True).count(), 3)
+        self.assertEqual(len(program.get_program().groups), 2)
+
+    def test_same_seed_same_data(self):
+        def snapshot():
+            return list(
+                Question.objects
+                .order_by('id')
+                .values_list('presentation__title', 'listener__name',
+                             'is_active')
+            )
+
+        self.generate(seed=7)
+        first = snapshot()
+        dataset.remove_dataset()
+        self.assertFalse(Question.objects.exists())
+        self.assertFalse(EventGroup.objects.exists())
+        self.generate(seed=7)
+        self.assertEqual(snapshot(), first)
+
+    def test_remove_keeps_real_data(self):
+        profile = Profile.objects.create(name='Иван', telegram_id='1')
+        self.generate()
+        call_command('generate_dataset', clear=True, stdout=StringIO())
+        self.assertEqual(list(Profile.objects.all()), [profile])
+
+    @override_settings(STATICFILES_STORAGE=(
+        'django.contrib.staticfiles.storage.StaticFilesStorage'))
+    def test_benchmark_saves_results(self):
+        self.generate()
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('bench_orm', repeat=2, samples=3, output=path,
+                         stdout=out)
+            call_command('bench_orm', repeat=2, samples=3, compare=path,
+                         stdout=out)
+            with open(path) as file:
+                report = json.load(file)
+        self.assertEqual(report['database']['counts']['Question'], 120)
+        self.assertEqual(
+            set(report['results']),
+            {'program: load', 'start: profile by telegram_id',
+             'speaker: walk 10 questions', 'ask: render answered questions',
+             'ask: cached answered questions',
+             'meet: first person, cold pool', 'meet: next person',
+             'admin: profiles', 'admin: profiles search', 'admin: questions',
+             'admin: answered questions', 'admin: questions search',
+             'admin: presentations'},
+        )
+        self.assertIn('vs previous', out.getvalue())
+
+
+PROGRAM_CSV = '''group,event,time_from,time_to,is_presentation,presentation,description,speaker,speaker_username
+Поток 1,Открытие,09:00,09:30,нет,,,,
+Поток 1,Доклады,10:00,11:00,да,Про ORM,Запросы,Иван Петров,@Ivan
+Поток 1,Доклады,10:00,11:00,да,Про кеши,,Анна,anna
+Поток 2,Доклады,10:00,11:00,да,Про очереди,,Иван Петров,ivan
+'''
+
+
+class ProgramImportTestCase(TestCase):
+    def import_csv(self, text, **kwargs):
+        return program_import.import_program(
+            BytesIO(text.encode()), 'csv', **kwargs)
+
+    def test_import_creates_program_and_speakers(self):
+        report = self.import_csv(PROGRAM_CSV)
+        self.assertEqual(report.rows, 4)
+        self.assertEqual(report.created, {
+            'группа': 2, 'событие': 3, 'спикер': 2, 'доклад': 3})
+        ivan = Profile.objects.get(telegram_username='ivan')
+        self.assertIsNone(ivan.telegram_id)
+        self.assertTrue(ivan.is_speaker)
+        self.assertEqual(
+            sorted(ivan.presentations.values_list('title', flat=True)),
+            ['Про ORM', 'Про очереди'])
+        self.assertFalse(
+            Event.objects.get(title='Открытие').is_presentation)
+        # The snapshot is dropped on commit, test cases never commit
+        program.invalidate_program()
+        self.assertEqual(len(program.get_program().groups), 2)
+
+    def test_second_import_updates_in_place(self):
+        self.import_csv(PROGRAM_CSV)
+        changed = PROGRAM_CSV \
+            .replace('10:00,11:00,да,Про кеши,', '10:00,11:30,да,Про кеши,') \
+            .replace('Про ORM,Запросы', 'Про ORM,Медленные запросы')
+        changes = []
+        report = self.import_csv(
+            changed, on_change=lambda *change: changes.append(change))
+        self.assertEqual(report.created, {})
+        self.assertEqual(report.updated, {'событие': 1, 'доклад': 1})
+        self.assertIn(('~', 'доклад', 'Про ORM (@ivan)'), changes)
+        self.assertEqual(Presentation.objects.count(), 3)
+        self.assertEqual(
+            Presentation.objects.get(title='Про ORM').description,
+            'Медленные запросы')
+
+    def test_dry_run_saves_nothing(self):
+        version = program.get_program_version()
+        report = self.import_csv(PROGRAM_CSV, dry_run=True)
+        self.assertEqual(report.created['доклад'], 3)
+        self.assertFalse(EventGroup.objects.exists())
+        self.assertFalse(Profile.objects.exists())
+        self.assertEqual(program.get_program_version(), version)
+
+    def test_existing_user_is_the_speaker(self):
+        user = Profile.objects.create(
+            name='Анна Иванова', telegram_id='5', telegram_username='Anna')
+        self.import_csv(PROGRAM_CSV)
+        user.refresh_from_db()
+        self.assertEqual(user.name, 'Анна Иванова')
+        self.assertTrue(user.is_speaker)
+        self.assertEqual(Profile.objects.filter(
+            telegram_username__iexact='anna').count(), 1)
+
+    def test_speaker_claims_profile_on_start(self):
+        self.import_csv(PROGRAM_CSV)
+        placeholder = Profile.objects.get(telegram_username='ivan')
+        profile, created = profiles.resolve_profile(
+            User(id=77, first_name='Иван', is_bot=False, username='Ivan'))
+        self.assertTrue(created)
+        self.assertEqual(profile.id, placeholder.id)
+        self.assertEqual(profile.telegram_id, '77')
+        self.assertEqual(profile.name, placeholder.name)
+        self.assertTrue(profile.is_speaker)
+
+        profiles.clear_profile_cache()
+        profile, created = profiles.resolve_profile(
+            User(id=77, first_name='Ваня', is_bot=False, username='Ivan'))
+        self.assertFalse(created)
+        profile.refresh_from_db()
+        self.assertEqual(profile.name, placeholder.name)
+
+    def test_bad_row_rolls_back(self):
+        with self.assertRaisesMessage(program_import.ProgramImportError,
+                                      'Строка 4'):
+            self.import_csv(PROGRAM_CSV.replace('10:00,11:00,да,Про кеши',
+                                                '10-00,11:00,да,Про кеши'))
+        self.assertFalse(EventGroup.objects.exists())
+
+    def test_days_of_the_meetup(self):
+        today = timezone.localdate()
+        meetup = Meetup.objects.create(
+            title='Два дня', starts_on=today, ends_on=today + timedelta(days=1))
+        text = PROGRAM_CSV.replace('group,', 'day,group,').replace(
+            '\nПоток', f'\n{today + timedelta(days=1)},Поток')
+        text += ',Поток 1,Закрытие,18:00,18:30,нет,,,,\n'
+        self.import_csv(text, meetup_id=meetup.id)
+        self.assertEqual(
+            sorted(EventGroup.objects.values_list('title', 'day')),
+            [('Поток 1', today), ('Поток 1', today + timedelta(days=1)),
+             ('Поток 2', today + timedelta(days=1))])
+        program.invalidate_program()
+        current = program.get_program()
+        self.assertEqual(
+            [[event.title for event in current.group_by_caption(
+                f'Поток 1 {day:%d.%m}').events]
+             for day in (today, today + timedelta(days=1))],
+            [['Закрытие'], ['Открытие', 'Доклады']])
+
+        with self.assertRaisesMessage(program_import.ProgramImportError,
+                                      'вне дат митапа'):
+            self.import_csv(text.replace(
+                str(today + timedelta(days=1)),
+                str(today + timedelta(days=2))), meetup_id=meetup.id)
+
+    def test_json_lines(self):
+        rows = [
+            {'group': 'Поток 1', 'event': 'Доклады', 'time_from': '10:00',
+             'time_to': '11:00', 'is_presentation': True,
+             'presentation': 'Про ORM', 'speaker': 'Иван',
+             'speaker_username': 'ivan'},
+            {'group': 'Поток 1', 'event': 'Обед', 'time_from': '13:00',
+             'time_to': '14:00'},
+        ]
+        text = '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows)
+        report = program_import.import_program(
+            BytesIO(text.encode()), 'jsonl')
+        self.assertEqual(report.created['событие'], 2)
+        self.assertEqual(report.created['доклад'], 1)
+
+    def test_few_queries_per_batch(self):
+        def rows(count):
+            lines = ['group,event,time_from,time_to,presentation,'
+                     'speaker,speaker_username']
+            lines += [
+                f'Поток {number % 7},Слот {number},10:00,11:00,'
+                f'Доклад {number},Спикер {number},speaker{number % 50}'
+                for number in range(count)
+            ]
+            return '\n'.join(lines)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.import_csv(rows(900), batch_size=1000)
+        # bulk_create splits the rows only by the parameter limit
+        self.assertLess(len(queries), 900 // 20)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.csv')
+            with open(path, 'w') as file:
+                file.write(PROGRAM_CSV)
+            out = StringIO()
+            call_command('import_program', path, dry_run=True, verbosity=2,
+                         stdout=out)
+            self.assertIn('+ доклад: Про кеши (@anna)', out.getvalue())
+            self.assertFalse(Presentation.objects.exists())
+            call_command('import_program', path, stdout=StringIO())
+        self.assertEqual(Presentation.objects.count(), 3)
+
+    @override_settings(STATICFILES_STORAGE=(
+        'django.contrib.staticfiles.storage.StaticFilesStorage'))
+    def test_admin_upload(self):
+        self.client.force_login(
+            get_user_model().objects.create_superuser('admin'))
+        response = self.client.get('/admin/bot/eventgroup/')
+        self.assertContains(response, '/admin/bot/eventgroup/import/')
+        upload = SimpleUploadedFile('program.csv', PROGRAM_CSV.encode())
+        response = self.client.post(
+            '/admin/bot/eventgroup/import/',
+            {'file': upload, 'dry_run': 'on'})
+        self.assertContains(response, '+ группа: Поток 2')
+        self.assertFalse(EventGroup.objects.exists())
+        upload = SimpleUploadedFile('program.csv', PROGRAM_CSV.encode())
+        self.client.post('/admin/bot/eventgroup/import/', {'file': upload})
+        self.assertEqual(EventGroup.objects.count(), 2)
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        program_import.import_program(BytesIO(PROGRAM_CSV.encode()), 'csv')
+        self.listener = Profile.objects.create(
+            name='Слушатель', telegram_id='9', telegram_username='listener')
+        for presentation in Presentation.objects.order_by('id'):
+            Question.objects.create(
+                presentation=presentation, listener=self.listener,
+                text=f'Вопрос, "{presentation.title}"?',
+                answer='Ответ\nдлинный', is_active=False)
+
+    def export(self, **options):
+        out = StringIO()
+        call_command('export_questions', stdout=out, **options)
+        return out.getvalue()
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['text'], 'Вопрос, "Про ORM"?')
+        self.assertEqual(rows[0]['answer'], 'Ответ\nдлинный')
+        self.assertEqual(rows[0]['speaker_username'], 'ivan')
+        self.assertEqual(rows[0]['event_group'], 'Поток 1')
+        self.assertEqual(rows[0]['time_from'], '10:00')
+
+    def test_filters(self):
+        group = EventGroup.objects.get(title='Поток 2')
+        rows = self.export(format='jsonl', event_group=group.id).splitlines()
+        self.assertEqual(
+            [json.loads(row)['presentation'] for row in rows],
+            ['Про очереди'])
+        presentation = Presentation.objects.get(title='Про кеши')
+        rows = self.export(format='jsonl', presentation=presentation.id)
+        self.assertEqual(json.loads(rows)['speaker'], 'Анна')
+
+    def test_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as few:
+            self.export(chunk_size=2)
+        presentation = Presentation.objects.first()
+        Question.objects.bulk_create(
+            Question(presentation=presentation, listener=self.listener,
+                     text=f'Вопрос {number}')
+            for number in range(50))
+        with CaptureQueriesContext(connection) as many:
+            output = self.export(chunk_size=2)
+        self.assertEqual(len(list(csv.DictReader(StringIO(output)))), 53)
+        self.assertEqual(len(many), len(few))
+
+    def test_output_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'questions.csv')
+            self.export(output=path)
+            with open(path, encoding='utf-8', newline='') as file:
+                self.assertEqual(len(list(csv.DictReader(file))), 3)
+
+    @override_settings(STATICFILES_STORAGE=(
+        'django.contrib.staticfiles.storage.StaticFilesStorage'))
+    def test_admin_streams(self):
+        self.client.force_login(
+            get_user_model().objects.create_superuser('admin'))
+        response = self.client.get('/admin/bot/question/')
+        self.assertContains(response, '/admin/bot/question/export/')
+        group = EventGroup.objects.get(title='Поток 1')
+        response = self.client.get(
+            '/admin/bot/question/export/', {'event_group': group.id})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(list(csv.DictReader(StringIO(body)))), 2)
+        response = self.client.get(
+            '/admin/bot/question/export/', {'presentation': 'x'})
+        self.assertEqual(response.status_code, 400)
+        with override_settings(ASGI=True):
+            response = self.client.get('/admin/bot/question/export/')
+        self.assertRedirects(response, '/admin/bot/question/')
+
+
+class MeetupTestCase(TestCase):
+    def setUp(self):
+        today = timezone.localdate()
+        self.past = Meetup.objects.create(
+            title='Весна', starts_on=today - timedelta(days=30),
+            ends_on=today - timedelta(days=29))
+        self.next = Meetup.objects.create(
+            title='Осень', starts_on=today + timedelta(days=3),
+            ends_on=today + timedelta(days=4))
+        self.speaker = Profile.objects.create(
+            name='Спикер', telegram_id='1', telegram_username='speaker')
+        self.listener = Profile.objects.create(
+            name='Слушатель', telegram_id='2', telegram_username='listener')
+        self.joined = Profile.objects.create(
+            name='Второй', telegram_id='3', telegram_username='joined')
+        self.old_question = self.add_question(self.past, 'Старый вопрос')
+        self.old_question.extra_listeners.add(self.joined)
+        self.new_question = self.add_question(self.next, 'Новый вопрос')
+        program.invalidate_program()
+        answers.clear_answers_cache()
+
+    def add_question(self, meetup, text):
+        group = EventGroup.objects.create(title='Поток 1', meetup=meetup)
+        event = Event.objects.create(
+            title='Доклады', time_from=time(10), time_to=time(11),
+            event_group=group, is_presentation=True)
+        presentation = Presentation.objects.create(
+            title=f'Доклад: {meetup.title}', description='', event=event,
+            speaker=self.speaker)
+        return Question.objects.create(
+            presentation=presentation, listener=self.listener, text=text)
+
+    def test_program_of_the_active_meetup(self):
+        current = program.get_program()
+        self.assertEqual(current.meetup_id, self.next.id)
+        self.assertEqual(
+            [presentation.title
+             for event in current.group_by_caption('Поток 1').events
+             for presentation in event.presentations],
+            ['Доклад: Осень'])
+        self.assertEqual(program.get_active_meetup(), self.next)
+        self.assertEqual(
+            program.get_active_meetup(self.next.ends_on + timedelta(days=1)),
+            self.next)
+        self.assertEqual(
+            program.get_active_meetup(self.past.ends_on), self.past)
+
+    def test_program_moves_on_when_meetup_is_over(self):
+        self.next.delete()
+        current = program.get_program()
+        self.assertEqual(current.meetup_id, self.past.id)
+        self.assertFalse(current.is_outdated(timezone.localdate()))
+        upcoming = program.load_program(program.get_program_version())
+        self.assertEqual(upcoming.meetup_id, self.past.id)
+
+        meetup = Meetup.objects.create(
+            title='Зима', starts_on=timezone.localdate(),
+            ends_on=timezone.localdate())
+        current = program.load_program(program.get_program_version())
+        self.assertEqual(current.meetup_id, meetup.id)
+        self.assertTrue(
+            current.is_outdated(timezone.localdate() + timedelta(days=1)))
+
+    def test_groups_default_to_the_active_meetup(self):
+        group = EventGroup.objects.create(title='Поток 2')
+        self.assertEqual(group.meetup, self.next)
+        self.assertEqual(group.day, self.next.starts_on)
+        group.day = self.next.ends_on + timedelta(days=1)
+        with self.assertRaises(ValidationError):
+            group.full_clean()
+
+    def test_speaker_sees_questions_of_the_active_meetup(self):
+        question = bot_backend.get_questions_from_the_speaker(self.speaker.id)
+        self.assertEqual(question, self.new_question)
+        self.assertEqual(
+            bot_backend.get_questions_from_the_speaker(
+                self.speaker.id, question.id),
+            self.new_question)
+        Question.objects.filter(id=self.old_question.id).update(
+            is_active=False, answer='Старый ответ')
+        self.assertEqual(answers.get_answered_pages(self.speaker.id), ())
+
+    def test_archive(self):
+        version = program.get_program_version()
+        self.assertEqual(
+            archive.archive_meetup(self.past, batch_size=1), (1, 1))
+        self.assertEqual(archive.archive_meetup(self.past), (0, 0))
+        self.assertFalse(EventGroup.objects.filter(meetup=self.past).exists())
+        self.assertEqual(
+            list(Question.objects.all()), [self.new_question])
+        self.assertEqual(
+            Question.extra_listeners.through.objects.count(), 0)
+        archived = ArchivedQuestion.objects.select_related('presentation') \
+            .get()
+        self.assertEqual(archived.original_id, self.old_question.id)
+        self.assertEqual(archived.extra_listeners_count, 1)
+        self.assertEqual(archived.presentation.group_title, 'Поток 1')
+        self.assertEqual(archived.presentation.day, self.past.starts_on)
+        self.assertEqual(archived.presentation.speaker, self.speaker)
+        self.assertGreater(program.get_program_version(), version)
+        self.speaker.refresh_from_db()
+        self.assertTrue(self.speaker.is_speaker)
+
+        out = StringIO()
+        call_command('export_questions', meetup=self.past.id, format='jsonl',
+                     stdout=out)
+        row = json.loads(out.getvalue())
+        self.assertEqual(row['id'], self.old_question.id)
+        self.assertEqual(row['presentation'], 'Доклад: Весна')
+        self.assertEqual(row['day'], self.past.starts_on.isoformat())
+        self.assertEqual(row['speaker_username'], 'speaker')
+
+    def test_command_archives_finished_meetups(self):
+        out = StringIO()
+        call_command('archive_meetups', stdout=out)
+        self.assertIn('Весна', out.getvalue())
+        self.assertNotIn('Осень', out.getvalue())
+        self.past.refresh_from_db()
+        self.assertIsNotNone(self.past.archived_at)
+        self.assertEqual(ArchivedPresentation.objects.count(), 1)
+
+    @override_settings(STATICFILES_STORAGE=(
+        'django.contrib.staticfiles.storage.StaticFilesStorage'))
+    def test_admin_action(self):
+        self.client.force_login(
+            get_user_model().objects.create_superuser('admin'))
+        self.client.post('/admin/bot/meetup/', {
+            'action': 'archive', '_selected_action': [self.next.id]})
+        self.assertEqual(ArchivedQuestion.objects.get().text, 'Новый вопрос')
+        for url in ('/admin/bot/archivedquestion/',
+                    '/admin/bot/archivedpresentation/',
+                    '/admin/bot/eventgroup/'):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class FakeJob:
+    def __init__(self, when):
+        self.when = when
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when):
+        job = FakeJob(when)
+        self.jobs.append(job)
+        return job
+
+
+class ReminderTestCase(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.meetup = Meetup.objects.create(
+            title='Митап', starts_on=self.today, ends_on=self.today)
+        speaker = Profile.objects.create(
+            name='Спикер', telegram_id='1', telegram_username='speaker')
+        self.subscriber = Profile.objects.create(
+            name='Слушатель', telegram_id='2', wants_reminders=True)
+        Profile.objects.create(name='Второй', telegram_id='3')
+        first = EventGroup.objects.create(title='Поток 1', meetup=self.meetup)
+        second = EventGroup.objects.create(title='Поток 2', meetup=self.meetup)
+        self.long_talks = Event.objects.create(
+            title='Доклады', time_from=time(10), time_to=time(11),
+            event_group=first, is_presentation=True)
+        self.short_talks = Event.objects.create(
+            title='Блиц', time_from=time(10), time_to=time(10, 30),
+            event_group=second, is_presentation=True)
+        self.lunch = Event.objects.create(
+            title='Обед', time_from=time(12), time_to=time(13),
+            event_group=first, is_presentation=False)
+        for event, title in ((self.long_talks, 'Django'),
+                             (self.short_talks, 'Telegram')):
+            Presentation.objects.create(
+                title=title, description='', event=event, speaker=speaker)
+        program.invalidate_program()
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(
+            datetime.combine(self.today, time(hour, minute)))
+
+    def ids(self, events):
+        return sorted(event.id for event in events)
+
+    def test_schedule_index(self):
+        current = program.get_program()
+        both = self.ids([self.long_talks, self.short_talks])
+        self.assertEqual(current.events_at(self.at(9, 59)), ())
+        self.assertEqual(self.ids(current.events_at(self.at(10))), both)
+        self.assertEqual(
+            self.ids(current.events_at(self.at(10, 30))),
+            [self.long_talks.id])
+        self.assertEqual(current.events_at(self.at(11, 30)), ())
+        self.assertEqual(self.ids(current.next_events(self.at(9))), both)
+        self.assertEqual(
+            self.ids(current.next_events(self.at(10))), [self.lunch.id])
+        self.assertEqual(current.next_events(self.at(12)), ())
+
+    def test_days_and_time_zone(self):
+        tomorrow = self.today + timedelta(days=1)
+        Meetup.objects.filter(id=self.meetup.id).update(
+            ends_on=tomorrow, time_zone='Asia/Yekaterinburg')
+        EventGroup.objects.filter(id=self.short_talks.event_group_id) \
+            .update(day=tomorrow)
+        program.bump_program_version()
+        program.invalidate_program()
+        current = program.get_program()
+        # 10:00 in Yekaterinburg is 05:00 UTC
+        self.assertEqual(
+            self.ids(current.events_at(self.at(5, 15))),
+            [self.long_talks.id])
+        self.assertEqual(current.events_at(self.at(10, 15)), ())
+        self.assertEqual(
+            self.ids(current.next_events(self.at(8))),
+            [self.short_talks.id])
+
+        scheduler = reminders.ReminderScheduler(FakeJobQueue())
+        scheduler.sync(current, now=self.at(0))
+        self.assertEqual(scheduler.pending, {
+            self.long_talks.id: self.at(5),
+            self.short_talks.id: self.at(5) + timedelta(days=1),
+        })
+        self.assertEqual(
+            scheduler.pop_due(self.at(4, 50)),
+            {self.at(5): [self.long_talks.id]})
+        self.assertEqual(scheduler.pop_due(self.at(23)), {})
+
+    def test_moved_event_is_rescheduled(self):
+        job_queue = FakeJobQueue()
+        scheduler = reminders.ReminderScheduler(job_queue, lead_minutes=10)
+        scheduler.sync(program.get_program(), now=self.at(9))
+        self.assertEqual(len(scheduler.pending), 2)
+        self.assertEqual(len(job_queue.jobs), 1)
+
+        self.long_talks.time_from = time(11)
+        self.long_talks.time_to = time(12)
+        self.long_talks.save()
+        program.invalidate_program()
+        scheduler.sync(program.get_program(), now=self.at(9))
+        # The moved event is pushed again, its old entry was at the head
+        # and is dropped, the job still fires at 9:50
+        self.assertEqual(len(scheduler.heap), 2)
+        self.assertEqual(len(job_queue.jobs), 1)
+
+        self.assertEqual(scheduler.pop_due(self.at(9, 49)), {})
+        self.assertEqual(
+            scheduler.pop_due(self.at(9, 50)),
+            {self.at(10): [self.short_talks.id]})
+        self.assertEqual(
+            scheduler.pop_due(self.at(11)),
+            {self.at(11): [self.long_talks.id]})
+        self.assertEqual(scheduler.heap, [])
+
+    def test_one_notice_per_start(self):
+        scheduler = reminders.ReminderScheduler(FakeJobQueue())
+        scheduler.sync(program.get_program(), now=self.at(9))
+        with mock.patch.object(timezone, 'now', return_value=self.at(9, 55)):
+            scheduler.fire_job(None)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.chat_id, self.subscriber.telegram_id)
+        self.assertIn('Через 10 мин. начнутся доклады', message.text)
+        self.assertIn('Django — Спикер @speaker', message.text)
+        self.assertIn('Telegram — Спикер @speaker', message.text)
+        self.assertEqual(scheduler.pending, {})
+
+        # Reminders already due are not lost on a program change
+        scheduler = reminders.ReminderScheduler(FakeJobQueue())
+        scheduler.sync(program.get_program(), now=self.at(9))
+        Event.objects.filter(id=self.lunch.id).update(title='Перерыв')
+        program.bump_program_version()
+        program.invalidate_program()
+        scheduler.sync(program.get_program(), now=self.at(9, 55))
+        self.assertEqual(len(scheduler.pop_due(self.at(9, 55))), 1)
@@ -1,3 +1,58 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         HttpResponseForbidden, HttpResponseNotAllowed)
+from django.views.decorators.csrf import csrf_exempt
+
+from .metrics import collect_metrics, is_authorized, render_metrics
+from .webhook import SECRET_TOKEN_HEADER, is_valid_secret, store_update
+
+
+def parse_update(request, secret):
+    """Validate a webhook request, return (update data, error response)"""
+    if request.method != 'POST':
+        return None, HttpResponseNotAllowed(['POST'])
+    if not is_valid_secret(secret, request.headers.get(SECRET_TOKEN_HEADER)):
+        return None, HttpResponseForbidden()
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None, HttpResponseBadRequest()
+    if not isinstance(data, dict) or not isinstance(
+            data.get('update_id'), int):
+        return None, HttpResponseBadRequest()
+    return data, None
+
+
+@csrf_exempt
+def telegram_webhook(request, secret):
+    """Save an update from Telegram for the bot process"""
+    data, error_response = parse_update(request, secret)
+    if error_response:
+        return error_response
+    store_update(data)
+    return HttpResponse()
+
+
+async def telegram_webhook_async(request, secret):
+    """Async version of telegram_webhook for the ASGI server"""
+    data, error_response = parse_update(request, secret)
+    if error_response:
+        return error_response
+    await sync_to_async(store_update)(data)
+    return HttpResponse()
+
+
+# csrf_exempt returns a sync wrapper in Django 4.0, mark the view directly
+telegram_webhook_async.csrf_exempt = True
+
+
+def metrics(request):
+    """Metrics of the bot and web processes in Prometheus format"""
+    if not is_authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(*collect_metrics()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,99 @@
+import hmac
+import select
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from .models import WebhookUpdate
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+WEBHOOK_BATCH_SIZE = 100
+# Pause between reads of the stored updates on databases without NOTIFY
+WEBHOOK_POLL_INTERVAL = 0.2
+# Reads in case a notification is lost, Postgres wakes the reader sooner
+WEBHOOK_WAIT_TIMEOUT = 5
+UPDATES_CHANNEL = 'webhook_updates'
+
+
+def webhook_path(secret):
+    return f'telegram/{secret}/'
+
+
+def set_webhook(bot, webhook_url):
+    """Ask Telegram to deliver updates to the web process"""
+    secret = settings.TG_WEBHOOK_SECRET
+    if not secret:
+        # The web process would reject every update
+        raise ImproperlyConfigured(
+            'TG_WEBHOOK_SECRET is required with TG_WEBHOOK_URL')
+    bot.set_webhook(
+        url=f'{webhook_url.rstrip("/")}/{webhook_path(secret)}',
+        api_kwargs={'secret_token': secret},
+    )
+
+
+def is_valid_secret(path_secret, header_secret):
+    """Check the secret in the URL and the one sent by Telegram in a header"""
+    secret = settings.TG_WEBHOOK_SECRET.encode()
+    if not secret:
+        return False
+    return hmac.compare_digest(path_secret.encode(), secret) \
+        and hmac.compare_digest((header_secret or '').encode(), secret)
+
+
+def store_update(data):
+    """Save an update for the bot process, Telegram's retries are dropped.
+
+    The web process does not run the handlers: with several web workers
+    the updates of a user would land in different processes.
+    """
+    WebhookUpdate.objects.bulk_create(
+        [WebhookUpdate(update_id=data['update_id'], data=data)],
+        ignore_conflicts=True,
+    )
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'NOTIFY {UPDATES_CHANNEL}')
+
+
+def fetch_updates(limit=WEBHOOK_BATCH_SIZE):
+    """The stored updates in the order Telegram numbered them"""
+    return list(
+        WebhookUpdate.objects
+        .order_by('update_id')
+        .values_list('id', 'data')[:limit]
+    )
+
+
+def delete_updates(ids):
+    WebhookUpdate.objects.filter(id__in=ids).delete()
+
+
+class UpdateWaiter:
+    """Wait for the web processes to store updates.
+
+    On Postgres the reader listens to the channel store_update notifies,
+    so an update is read as soon as it is stored. Other databases are
+    polled, which delays every update by up to WEBHOOK_POLL_INTERVAL.
+    """
+
+    def __init__(self):
+        self._listening = None
+
+    def wait(self):
+        if connection.vendor != 'postgresql':
+            time.sleep(WEBHOOK_POLL_INTERVAL)
+            return
+        connection.ensure_connection()
+        pg_connection = connection.connection
+        if pg_connection is not self._listening:
+            # A new connection, updates stored before LISTEN are read next
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {UPDATES_CHANNEL}')
+            self._listening = pg_connection
+            return
+        if select.select([pg_connection], [], [], WEBHOOK_WAIT_TIMEOUT)[0]:
+            pg_connection.poll()
+            pg_connection.notifies.clear()
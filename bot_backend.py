@@ -1,18 +1,40 @@
+import logging
 import os
 import textwrap
 
 import django
 from functools import partial
-from telegram import (KeyboardButton, LabeledPrice, ReplyKeyboardMarkup,
-                      Update)
+from queue import Queue
+from telegram import LabeledPrice, Update
 from telegram.ext import (CallbackContext, CommandHandler, ConversationHandler,
-                          Filters, MessageHandler, Updater,
+                          ExtBot, Filters, JobQueue, MessageHandler, Updater,
                           PreCheckoutQueryHandler)
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meetup.settings')
 django.setup()
 
-from bot.models import Event, EventGroup, Profile, Question, Presentation
+from django.utils import timezone
+
+from bot.answers import (NO_ANSWERS_TEXT, get_answered_pages,
+                         get_cached_answered_pages, invalidate_answers,
+                         page_text)
+from bot.concurrency import ConcurrentDispatcher
+from bot.duplicates import (find_duplicate, forget_question, join_question,
+                            remember_question)
+from bot.keyboards import build_keyboard, program_keyboard
+from bot.mailing import MAILING_POLL_INTERVAL, process_mailing_jobs
+from bot.matchmaking import next_person, pop_waiting_people, wait_for_people
+from bot.metrics import (METRICS_PUBLISH_INTERVAL, InstrumentedRequest,
+                         instrument_dispatcher, publish_metrics_job)
+from bot.models import Profile, Question
+from bot.outbox import OutboxSender, enqueue_messages
+from bot.persistence import (PERSISTENCE_FLUSH_INTERVAL, DjangoPersistence,
+                             flush_persistence)
+from bot.profiles import get_profile, resolve_profile
+from bot.program import get_program
+from bot.reminders import REMINDER_LEAD_MINUTES, ReminderScheduler
+from bot.routing import CaptionRouter
+from bot.sharding import ShardedBot
 
 SURVEY_INPUT_NAME, \
 SURVEY_INPUT_COMPANY, \
@@ -34,26 +56,56 @@ MEET_CHOICE = range(12)
 
 MAIN_MENU_BUTTON_CAPTION = 'Главное меню'
 BACK_BUTTON_CAPTION = 'Назад'
+PREVIOUS_ANSWERS_CAPTION = '⬅️ Предыдущие ответы'
+NEXT_ANSWERS_CAPTION = 'Следующие ответы ➡️'
+
+MAIN_MENU_CAPTIONS = ['Программа', 'Сейчас и далее', 'Задать вопрос',
+                      'Задонатить', 'Познакомиться', 'Напоминания']
+MAIN_MENU_KEYBOARD = build_keyboard(
+    MAIN_MENU_CAPTIONS, 2, one_time_keyboard=True)
+SPEAKER_MAIN_MENU_KEYBOARD = build_keyboard(
+    MAIN_MENU_CAPTIONS, 2, footer=['Ответить на вопрос'],
+    one_time_keyboard=True)
+ASK_QUESTION_KEYBOARD = build_keyboard(
+    [MAIN_MENU_BUTTON_CAPTION, 'Показать вопросы'], 1,
+    one_time_keyboard=True)
+# By whether there are previous and next pages
+ANSWERS_KEYBOARDS = {
+    (has_previous, has_next): build_keyboard(
+        [caption
+         for caption, shown in ((PREVIOUS_ANSWERS_CAPTION, has_previous),
+                                (NEXT_ANSWERS_CAPTION, has_next))
+         if shown],
+        2, footer=[MAIN_MENU_BUTTON_CAPTION], one_time_keyboard=True)
+    for has_previous in (False, True)
+    for has_next in (False, True)
+}
+QUESTION_SENT_KEYBOARD = build_keyboard(
+    ['Задать новый вопрос', MAIN_MENU_BUTTON_CAPTION], 2,
+    one_time_keyboard=True)
+SPEAKER_QUESTION_KEYBOARD = build_keyboard(
+    ['Следующий вопрос', MAIN_MENU_BUTTON_CAPTION], 2,
+    one_time_keyboard=True)
+DONATE_KEYBOARD = build_keyboard(
+    [BACK_BUTTON_CAPTION], 1, one_time_keyboard=True)
+MEET_KEYBOARD = build_keyboard(
+    ['Заполнить анкету', 'Подобрать знакомство'], 2,
+    footer=[MAIN_MENU_BUTTON_CAPTION])
+SURVEY_CONFIRM_KEYBOARD = build_keyboard(
+    ['Да, всё верно', 'Нет, давай заново'], 2, one_time_keyboard=True)
+
+
+def get_user_profile(update: Update):
+    """Return the profile of the user who sent the update"""
+    return get_profile(update.effective_user.id)
 
 
 def start(update: Update, context: CallbackContext) -> int:
     """Send a message when the command /start is issued."""
-    tg_user = update.effective_user
-    user_profile, created = Profile.objects.update_or_create(
-        telegram_id=tg_user['id'],
-        defaults={
-            'name': tg_user['first_name'],
-            'telegram_username': tg_user['username'],
-        })
-    context.user_data['profile'] = user_profile
-    keyboard = [
-        [KeyboardButton('Программа'), KeyboardButton('Задать вопрос')],
-        [KeyboardButton('Задонатить'), KeyboardButton('Познакомиться')],
-    ]
-    if user_profile.presentations.exists():
-        keyboard.append([KeyboardButton('Ответить на вопрос')])
-    markup = ReplyKeyboardMarkup(
-        keyboard=keyboard, resize_keyboard=True, one_time_keyboard=True)
+    user_profile, created = resolve_profile(update.effective_user)
+    markup = MAIN_MENU_KEYBOARD
+    if user_profile.is_speaker:
+        markup = SPEAKER_MAIN_MENU_KEYBOARD
 
     text = 'Вы находитесь в главном меню'
     if created:
@@ -66,43 +118,35 @@ def start(update: Update, context: CallbackContext) -> int:
 
 def choose_event_group(update: Update, context: CallbackContext) -> int:
     """Ask the user to select an event group"""
-    groups = EventGroup.objects.all()
-    buttons = [[KeyboardButton(group.title) for group in groups], [
-        KeyboardButton(MAIN_MENU_BUTTON_CAPTION)]]
-    markup = ReplyKeyboardMarkup(
-        keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+    program = get_program()
+    markup = program_keyboard(
+        program,
+        captions=program.group_captions(),
+        num_cols=None,
+        footer=[MAIN_MENU_BUTTON_CAPTION],
+    )
     update.message.reply_text('Какая секция?', reply_markup=markup)
 
     return EVENT_GROUP_CHOICE
 
 
-def split_keyboard(captions, num_cols):
-    """Create structure of keyboard with several columns"""
-    buttons, row = [], []
-    for caption in captions:
-        row.append(KeyboardButton(caption))
-        if len(row) == num_cols:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    return buttons
+def event_caption(event):
+    return f'{event.time_from:%H:%M} {event.title}'
 
 
 def choose_event(update: Update, context: CallbackContext) -> int:
     """Ask the user to select an event"""
-    events = Event.objects \
-        .filter(event_group__title=update.message.text) \
-        .order_by('time_from')
-    if not events:
+    program = get_program()
+    group = program.group_by_caption(update.message.text)
+    if not group or not group.events:
         return start(update, context)
-    buttons = split_keyboard(
-        captions=[f'{event.time_from:%H:%M} {event.title}' for event in events],
-        num_cols=2,
+    context.chat_data['event_group_id'] = group.id
+    markup = program_keyboard(
+        program,
+        captions=[event_caption(event) for event in group.events],
+        footer=[BACK_BUTTON_CAPTION],
+        one_time_keyboard=False,
     )
-    buttons.append([KeyboardButton(BACK_BUTTON_CAPTION)])
-    markup = ReplyKeyboardMarkup(
-        keyboard=buttons, resize_keyboard=True)
     update.message.reply_text('Какое мероприятие?', reply_markup=markup)
 
     return EVENT_CHOICE
@@ -110,15 +154,24 @@ def choose_event(update: Update, context: CallbackContext) -> int:
 
 def show_event(update: Update, context: CallbackContext) -> int:
     """Show event description"""
-    title_position = 6
-    event_title = update.message.text[title_position:]
-    presentations = Presentation.objects \
-        .filter(event__title=event_title)
+    group = get_program().group(context.chat_data.get('event_group_id'))
+    if not group:
+        return start(update, context)
+    events = [
+        event for event in group.events
+        if event_caption(event) == update.message.text
+    ]
+    presentations = [
+        presentation
+        for event in events
+        for presentation in event.presentations
+    ]
     if not presentations:
         return start(update, context)
 
+    event = next(event for event in events if event.presentations)
     text_blocks = [
-        f'<b><i>{presentations[0].event}</i></b>\n',
+        f'<b><i>{event.day:%d.%m} {event}</i></b>\n',
     ]
     for presentation in presentations:
         text_blocks.append(
@@ -129,6 +182,66 @@ def show_event(update: Update, context: CallbackContext) -> int:
     return EVENT_CHOICE
 
 
+def describe_events(program, events, today):
+    blocks = []
+    for event in events:
+        when = '' if event.day == today else f'{event.day:%d.%m} '
+        lines = [f'<b>{when}{event}</b> ({program.group(event.group_id)})']
+        lines.extend(
+            f'{presentation.title} — {presentation.speaker}'
+            for presentation in event.presentations
+        )
+        blocks.append('\n'.join(lines))
+    return blocks
+
+
+def show_now_and_next(update: Update, context: CallbackContext) -> int:
+    """Show the events going on now and the ones starting next"""
+    program = get_program()
+    now = timezone.now()
+    today = program.local_time(now).date()
+    if not program.days:
+        text = 'Программа пока не опубликована'
+    elif today < program.days[0]:
+        text = f'Митап начнётся {program.days[0]:%d.%m.%Y}'
+    elif today > program.days[-1]:
+        text = 'Митап закончился'
+    else:
+        text_blocks = []
+        current = describe_events(program, program.events_at(now), today)
+        if current:
+            text_blocks.append('<i>Сейчас идёт:</i>')
+            text_blocks.extend(current)
+        upcoming = describe_events(program, program.next_events(now), today)
+        if upcoming:
+            text_blocks.append('<i>Далее:</i>')
+            text_blocks.extend(upcoming)
+        text = '\n\n'.join(text_blocks) or 'Событий больше не будет'
+
+    markup = MAIN_MENU_KEYBOARD
+    if get_user_profile(update).is_speaker:
+        markup = SPEAKER_MAIN_MENU_KEYBOARD
+    update.message.reply_html(text, reply_markup=markup)
+
+    return MAIN_MENU_CHOICE
+
+
+def toggle_reminders(update: Update, context: CallbackContext) -> int:
+    """Turn the reminders about the presentations on or off"""
+    profile = get_user_profile(update)
+    profile.wants_reminders = not profile.wants_reminders
+    profile.save(update_fields=['wants_reminders'])
+    text = 'Напоминания о докладах выключены'
+    if profile.wants_reminders:
+        text = f'Напомню о докладах за {REMINDER_LEAD_MINUTES} мин. до начала'
+    markup = MAIN_MENU_KEYBOARD
+    if profile.is_speaker:
+        markup = SPEAKER_MAIN_MENU_KEYBOARD
+    update.message.reply_text(text, reply_markup=markup)
+
+    return MAIN_MENU_CHOICE
+
+
 def choose_event_group_for_ask(update, context):
     """Ask the user to select an event group"""
     choose_event_group(update, context)
@@ -138,19 +251,27 @@ def choose_event_group_for_ask(update, context):
 
 def choose_event_time(update, context):
     """Ask the user to select the time interval of events"""
-    events = Event.objects.filter(
-        event_group__title=update.message.text, is_presentation=True)
+    program = get_program()
+    group = program.group_by_caption(update.message.text)
+    events = [
+        event
+        for event in (group.events if group else ())
+        if event.is_presentation
+    ]
     if not events:
         return start(update, context)
     event_times = {}
     for event in events:
         time_interval = f'{event.time_from:%H:%M}-{event.time_to:%H:%M}'
-        event_times[time_interval] = event.presentations.all()
+        event_times.setdefault(time_interval, []).extend(
+            presentation.id for presentation in event.presentations
+        )
     context.chat_data['event_times'] = event_times
-    buttons = split_keyboard(list(sorted(event_times.keys())), 2)
-    buttons.append([KeyboardButton(BACK_BUTTON_CAPTION)])
-    markup = ReplyKeyboardMarkup(
-        keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+    markup = program_keyboard(
+        program,
+        captions=sorted(event_times.keys()),
+        footer=[BACK_BUTTON_CAPTION],
+    )
     update.message.reply_text('Выберите время', reply_markup=markup)
 
     return CHOOSE_EVENT_SPEAKERS
@@ -158,18 +279,19 @@ def choose_event_time(update, context):
 
 def choose_event_speakers(update, context):
     """Ask the user to select the speaker"""
-    event_presentations = context.chat_data['event_times'][update.message.text]
+    program = get_program()
+    presentation_ids = context.chat_data['event_times'][update.message.text]
     speaker_and_presentation = {}
-    for presentation in event_presentations:
-        speaker_and_presentation[presentation.speaker.name] = presentation
+    for presentation_id in presentation_ids:
+        presentation = program.presentation(presentation_id)
+        if presentation:
+            speaker_and_presentation[presentation.speaker.name] = presentation.id
     context.user_data['speaker_and_presentation'] = speaker_and_presentation
-    buttons = split_keyboard(
-        captions=list(speaker_and_presentation.keys()),
-        num_cols=2
+    markup = program_keyboard(
+        program,
+        captions=speaker_and_presentation.keys(),
+        footer=[BACK_BUTTON_CAPTION],
     )
-    buttons.append([KeyboardButton(BACK_BUTTON_CAPTION)])
-    markup = ReplyKeyboardMarkup(
-        keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
     update.message.reply_text('Выберите спикера', reply_markup=markup)
 
     return QUESTION
@@ -178,69 +300,71 @@ def choose_event_speakers(update, context):
 def ask_question(update, context):
     """Ask the user to enter a question"""
     text = 'Задайте свой вопрос спикеру'
-    keyboard = [[KeyboardButton(MAIN_MENU_BUTTON_CAPTION)], [KeyboardButton('Показать вопросы')]]
-    markup = ReplyKeyboardMarkup(
-        keyboard=keyboard, resize_keyboard=True, one_time_keyboard=True)
-    if update.message.text not in list(context.user_data['speaker_and_presentation'].keys()):
-        buttons = split_keyboard(
-            captions=list(context.user_data['speaker_and_presentation'].keys()),
-            num_cols=2
+    speaker_and_presentation = context.user_data['speaker_and_presentation']
+    if update.message.text not in speaker_and_presentation:
+        markup = program_keyboard(
+            get_program(),
+            captions=speaker_and_presentation.keys(),
+            footer=[BACK_BUTTON_CAPTION],
         )
-        buttons.append([KeyboardButton(BACK_BUTTON_CAPTION)])
-        markup = ReplyKeyboardMarkup(
-            keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
         update.message.reply_text('Выберите спикера', reply_markup=markup)
         return QUESTION
 
     context.user_data['asked_speaker'] = update.message.text
-    update.message.reply_text(text, reply_markup=markup)
+    update.message.reply_text(text, reply_markup=ASK_QUESTION_KEYBOARD)
+
+    return SAVE_QUESTION
+
+
+def show_answered_questions(update, context, step=0):
+    """Show a page of the answered questions to the chosen speaker"""
+    asked_speaker = context.user_data['asked_speaker']
+    presentation = get_program().presentation(
+        context.user_data['speaker_and_presentation'][asked_speaker])
+    if not presentation:
+        return start(update, context)
+    speaker_id = presentation.speaker.id
+    if step:
+        pages = get_cached_answered_pages(speaker_id)
+        number = context.user_data.get('answers_page', 0) + step
+    else:
+        pages = get_answered_pages(speaker_id)
+        number = 0
+    if not pages:
+        update.message.reply_text(
+            NO_ANSWERS_TEXT, reply_markup=ASK_QUESTION_KEYBOARD)
+        return SAVE_QUESTION
+    number = max(0, min(number, len(pages) - 1))
+    context.user_data['answers_page'] = number
+    markup = ANSWERS_KEYBOARDS[(number > 0, number < len(pages) - 1)]
+    update.message.reply_text(page_text(pages, number), reply_markup=markup)
 
     return SAVE_QUESTION
 
 
 def save_question(update, context):
     """Confirm the successful submission of the question"""
-    if update.message.text == 'Показать вопросы':
-        speaker = context.user_data['asked_speaker']
-        answered_questions = Question.objects.filter(presentation__speaker__name=speaker,
-                                                     is_active=False)
-        text = 'Еще нет вопросов с ответами'
-        if answered_questions.exists():
-            text = 'Если вы не нашли ответ на ваш вопрос, то задайте свой \n'
-            for question in answered_questions:
-                text += textwrap.dedent(
-                    f'''
-                    
-                    Вопрос {question.id}: 
-                    {question.text}
-                    
-                    Ответ: 
-                    {question.answer}
-                    '''
-                    )
-        update.message.reply_text(text)
-
-        return ask_question(update, context)
-
     text = 'Ваш вопрос направлен спикеру'
     asked_speaker = context.user_data['asked_speaker']
-    speaker_event = context.user_data['speaker_and_presentation'][asked_speaker]
-    Question.objects.create(
-        presentation=speaker_event,
-        text=update.message.text,
-        listener=context.user_data['profile'],
-    )
-    buttons = [
-        KeyboardButton('Задать новый вопрос'),
-        KeyboardButton(MAIN_MENU_BUTTON_CAPTION),
-    ]
-    reply_markup = ReplyKeyboardMarkup(
-        keyboard=[buttons],
-        resize_keyboard=True,
-        one_time_keyboard=True)
+    presentation_id = context.user_data['speaker_and_presentation'][asked_speaker]
+    if not get_program().presentation(presentation_id):
+        return start(update, context)
+    listener = get_user_profile(update)
+    duplicate_id = find_duplicate(presentation_id, update.message.text)
+    if duplicate_id and join_question(duplicate_id, listener.id):
+        text = 'Такой вопрос уже задали, ответ придёт и вам'
+    else:
+        if duplicate_id:
+            forget_question(presentation_id, duplicate_id)
+        question = Question.objects.create(
+            presentation_id=presentation_id,
+            text=update.message.text,
+            listener=listener,
+        )
+        remember_question(presentation_id, question.id, question.text)
     update.message.reply_text(
         text,
-        reply_markup=reply_markup
+        reply_markup=QUESTION_SENT_KEYBOARD
     )
 
     return CHOOSE_EVENT_SPEAKERS
@@ -252,73 +376,72 @@ def new_question_from_the_speaker(
         next=False
 ) -> int:
     """Show the question to the speaker and ask him to enter the answer"""
-    speaker_id = update.message.chat.id
-    buttons = [
-        KeyboardButton('Следующий вопрос'),
-        KeyboardButton(MAIN_MENU_BUTTON_CAPTION),
-    ]
-    reply_markup = ReplyKeyboardMarkup(
-        keyboard=[buttons],
-        resize_keyboard=True,
-        one_time_keyboard=True)
+    speaker = get_user_profile(update)
     if not next:
-        result_request, question = get_questions_from_the_speaker(speaker_id)
-        context.user_data['question_number'] = 0
-        if not question:
-            message_text = 'Вопросов нет'
-        else:
-            context.user_data['question'] = question
-            message_text = question.text
+        context.user_data['question_cursor'] = 0
+    question = get_questions_from_the_speaker(
+        speaker.id, context.user_data.get('question_cursor', 0))
+    if not question:
+        message_text = 'Вопросов нет'
     else:
-        question_number = context.user_data['question_number'] + 1
-        result_request, question = get_questions_from_the_speaker(
-            speaker_id, question_number)
-        if result_request:
-            context.user_data['question_number'] += 1
-        else:
-            context.user_data['question_number'] = 0
-        if not question:
-            message_text = 'Вопросов нет'
-        else:
-            context.user_data['question'] = question
-            message_text = question.text
+        context.user_data['question_cursor'] = question.id
+        context.user_data['question'] = {
+            'id': question.id,
+            'text': question.text,
+            'listener_telegram_id': question.listener.telegram_id,
+            'presentation_id': question.presentation_id,
+        }
+        message_text = question.text
     update.message.reply_text(
         message_text,
-        reply_markup=reply_markup
+        reply_markup=SPEAKER_QUESTION_KEYBOARD
     )
 
     return ANSWER
 
 
-def get_questions_from_the_speaker(speaker_id: str, question_number=0):
-    """Get a speaker question"""
-    speaker = Profile.objects.get(telegram_id=speaker_id)
-    try:
-        question = Question.objects.filter(
-            is_active=True, presentation__speaker=speaker)[question_number]
-        return True, question
-    except IndexError:
-        questions = Question.objects.filter(
-            is_active=True, presentation__speaker=speaker)
-        if questions:
-            return False, questions[0]
-        return False, False
+def get_questions_from_the_speaker(speaker_id, after_question_id=0):
+    """Get the speaker's next active question after the given one.
+
+    Questions are walked by ascending id, after the last one the walk
+    starts over. Only presentations of the active meetup are asked.
+    """
+    presentation_ids = get_program().speaker_presentation_ids(speaker_id)
+    if not presentation_ids:
+        return None
+    questions = Question.objects \
+        .filter(is_active=True, presentation_id__in=presentation_ids) \
+        .select_related('listener') \
+        .order_by('id')
+    question = questions.filter(id__gt=after_question_id).first()
+    if not question and after_question_id:
+        question = questions.first()
+    return question
 
 
 def answer_the_question(update: Update, context: CallbackContext) -> int:
     """Send, save the answer and confirm for speaker"""
-    question = context.user_data['question']
+    question = context.user_data.pop('question', None)
+    if question is None:
+        # There was no question to answer or it has been answered
+        return new_question_from_the_speaker(update, context, next=True)
     answer = update.message.text
-    listener_id = question.listener.telegram_id
-
-    question.answer = answer
-    question.is_active = False
-    question.save()
+    listener_id = question['listener_telegram_id']
+
+    Question.objects \
+        .filter(id=question['id']) \
+        .update(answer=answer, is_active=False)
+    invalidate_answers(get_user_profile(update).id)
+    if 'presentation_id' in question:
+        forget_question(question['presentation_id'], question['id'])
+    extra_listener_ids = Profile.objects \
+        .filter(joined_questions=question['id']) \
+        .values_list('telegram_id', flat=True)
     text = textwrap.dedent(
         f'''
         
         Получен ответ на вопрос:
-        {question.text}
+        {question['text']}
         
         Ответ:
         {answer}
@@ -326,7 +449,7 @@ def answer_the_question(update: Update, context: CallbackContext) -> int:
         '''
      )
 
-    context.bot.send_message(chat_id=listener_id, text=text)
+    enqueue_messages([listener_id, *extra_listener_ids], text)
     update.message.reply_text(
         "Ответ отправлен. Нажмите на кнопку 'Следующий вопрос'")
 
@@ -340,13 +463,8 @@ def help_command(update: Update, context: CallbackContext) -> None:
 
 def ask_donate_amount(update: Update, context: CallbackContext) -> int:
     """Ask the user to enter the donation amount"""
-    buttons = [KeyboardButton(BACK_BUTTON_CAPTION)]
     text = '💰💰💰 Укажите сумму доната в рублях (от 10 руб) 💰💰💰'
-    markup = ReplyKeyboardMarkup(
-        keyboard=[buttons],
-        resize_keyboard=True,
-        one_time_keyboard=True)
-    update.message.reply_text(text, reply_markup=markup)
+    update.message.reply_text(text, reply_markup=DONATE_KEYBOARD)
 
     return INPUT_DONATE
 
@@ -392,52 +510,29 @@ def unsuccessful_payment(update: Update, context: CallbackContext) -> int:
 
 def start_meet(update: Update, context: CallbackContext) -> int:
     """Ask the user to select action."""
-    buttons = [
-        [
-            KeyboardButton('Заполнить анкету'),
-            KeyboardButton('Подобрать знакомство'),
-        ],
-        [KeyboardButton(MAIN_MENU_BUTTON_CAPTION)],
-    ]
-    markup = ReplyKeyboardMarkup(
-        keyboard=buttons,
-        resize_keyboard=True,
-    )
     update.message.reply_text(
         'Знакомьтесь с интересными людьми',
-        reply_markup=markup,
+        reply_markup=MEET_KEYBOARD,
     )
 
     return MEET_CHOICE
 
 
 def show_person(update: Update, context: CallbackContext) -> int:
-    """Show random person, exclude shown people."""
-    profile = context.user_data['profile']
+    """Show random person, exclude recently shown people."""
+    profile = get_user_profile(update)
     if not profile.ready_meet:
         update.message.reply_text(
             'Для знакомства заполните свою анкету'
         )
         return start_meet(update, context)
-    showed_persons = context.user_data.get('showed_persons', [])
-    person = Profile.objects \
-        .exclude(id=profile.id) \
-        .exclude(id__in=showed_persons) \
-        .filter(ready_meet=True) \
-        .order_by('?') \
-        .first()
-    if not person and not showed_persons:
+    person = next_person(profile.id)
+    if not person:
         update.message.reply_text(
             'Пока знакомиться не с кем.\nКак кто-то появится, я Вам сообщу.'
         )
-        context.bot_data['lonely_user'] = update.effective_user.id
+        wait_for_people(profile.id)
         return start(update, context)
-    if not person:
-        context.user_data['showed_persons'] = []
-        return show_person(update, context)
-
-    showed_persons.append(person.id)
-    context.user_data['showed_persons'] = showed_persons
 
     text_blocks = [
         f'<b>{person.name}</b>\n',
@@ -479,58 +574,44 @@ def input_job(update: Update, context: CallbackContext) -> int:
     """Ask the user to confirm the entered data."""
     job = update.message.text
     context.user_data['survey_job'] = job
-    buttons = [
-        KeyboardButton('Да, всё верно'),
-        KeyboardButton('Нет, давай заново'),
-    ]
-    markup = ReplyKeyboardMarkup(
-        keyboard=[buttons],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
     text_blocks = [
         'Вот мы и закончили!',
         'Ваша анкета будет выглядеть так:\n\n',
         f'<b>{context.user_data["survey_name"]}</b>\n',
         f'Компания: <i>{context.user_data["survey_company"]}</i>',
         f'Должность: <i>{job}</i>',
-        f'@{context.user_data["profile"].telegram_username}\n',
+        f'@{get_user_profile(update).telegram_username}\n',
     ]
-    update.message.reply_html('\n'.join(text_blocks), reply_markup=markup)
+    update.message.reply_html(
+        '\n'.join(text_blocks), reply_markup=SURVEY_CONFIRM_KEYBOARD)
 
     return SURVEY_CONFIRM
 
 
 def save_survey(update: Update, context: CallbackContext) -> int:
     """Save the entered data to the user profile."""
-    profile = context.user_data['profile']
+    profile = get_user_profile(update)
     profile.name = context.user_data['survey_name']
     profile.company = context.user_data['survey_company']
     profile.job = context.user_data['survey_job']
     profile.ready_meet = True
-    profile.save()
+    profile.save(update_fields=['name', 'company', 'job', 'ready_meet'])
 
-    lonely_user = context.bot_data.get('lonely_user', None)
-    if lonely_user and lonely_user != update.effective_user.id:
-        context.bot_data['lonely_user'] = None
-        context.bot.send_message(lonely_user, '🤝 Появились новые анкеты 🤝')
+    waiting_people = pop_waiting_people(profile.id)
+    if waiting_people:
+        enqueue_messages(waiting_people, '🤝 Появились новые анкеты 🤝')
 
     start_meet(update, context)
     return ConversationHandler.END
 
 
-def main() -> None:
-    """Start the bot."""
-    tg_token = os.getenv('TG_TOKEN')
-
-    updater = Updater(tg_token)
-    dispatcher = updater.dispatcher
-
+def setup_dispatcher(dispatcher) -> None:
+    """Register the bot handlers."""
     precheckout_handler = PreCheckoutQueryHandler(precheckout_callback)
 
     survey_conv_handler = ConversationHandler(
         entry_points=[
-            MessageHandler(Filters.regex('^Заполнить анкету$'), start_survey),
+            CaptionRouter({'Заполнить анкету': start_survey}),
         ],
         states={
             SURVEY_INPUT_NAME: [
@@ -543,101 +624,101 @@ def main() -> None:
                 MessageHandler(Filters.text | ~Filters.command, input_job),
             ],
             SURVEY_CONFIRM: [
-                MessageHandler(Filters.regex('^Да, всё верно$'),
-                               save_survey),
-                MessageHandler(Filters.regex('^Нет, давай заново$'),
-                               start_survey),
+                CaptionRouter({
+                    'Да, всё верно': save_survey,
+                    'Нет, давай заново': start_survey,
+                }),
             ],
         },
         fallbacks=[
-            MessageHandler(Filters.regex('^Заполнить анкету$'), start_survey),
+            CaptionRouter({'Заполнить анкету': start_survey}),
         ],
         map_to_parent={
             ConversationHandler.END: MEET_CHOICE,
-        }
+        },
+        name='survey',
+        persistent=True,
     )
 
+    next_question = partial(new_question_from_the_speaker, next=True)
+    previous_answers = partial(show_answered_questions, step=-1)
+    next_answers = partial(show_answered_questions, step=1)
     conv_handler = ConversationHandler(
         entry_points=[
             CommandHandler('start', start),
         ],
         states={
             MAIN_MENU_CHOICE: [
-                MessageHandler(Filters.regex('^Программа$'),
-                               choose_event_group),
-                MessageHandler(Filters.regex('^Задать вопрос$'),
-                               choose_event_group_for_ask),
-                MessageHandler(Filters.regex('^Ответить на вопрос$'),
-                               new_question_from_the_speaker),
-                MessageHandler(Filters.regex('^Задонатить$'),
-                               ask_donate_amount),
-                MessageHandler(Filters.regex('^Познакомиться$'),
-                               start_meet),
+                CaptionRouter({
+                    'Программа': choose_event_group,
+                    'Сейчас и далее': show_now_and_next,
+                    'Задать вопрос': choose_event_group_for_ask,
+                    'Ответить на вопрос': new_question_from_the_speaker,
+                    'Задонатить': ask_donate_amount,
+                    'Познакомиться': start_meet,
+                    'Напоминания': toggle_reminders,
+                }),
             ],
             MEET_CHOICE: [
                 survey_conv_handler,
-                MessageHandler(Filters.regex('^Подобрать знакомство$'),
-                               show_person),
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON_CAPTION}$'),
-                               start),
+                CaptionRouter({
+                    'Подобрать знакомство': show_person,
+                    MAIN_MENU_BUTTON_CAPTION: start,
+                }),
             ],
             EVENT_GROUP_CHOICE: [
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON_CAPTION}$'),
-                               start),
-                MessageHandler(Filters.text,
-                               choose_event),
+                CaptionRouter({MAIN_MENU_BUTTON_CAPTION: start}),
+                MessageHandler(Filters.text, choose_event),
             ],
             EVENT_CHOICE: [
-                MessageHandler(Filters.regex(f'^{BACK_BUTTON_CAPTION}$'),
-                               choose_event_group),
-                MessageHandler(Filters.text,
-                               show_event),
+                CaptionRouter({BACK_BUTTON_CAPTION: choose_event_group}),
+                MessageHandler(Filters.text, show_event),
             ],
             CHOOSE_EVENT_TIME: [
-                MessageHandler(Filters.regex(f'^{BACK_BUTTON_CAPTION}$'),
-                               choose_event_group_for_ask),
-                MessageHandler(Filters.text,
-                               choose_event_time),
+                CaptionRouter({
+                    BACK_BUTTON_CAPTION: choose_event_group_for_ask,
+                }),
+                MessageHandler(Filters.text, choose_event_time),
             ],
             CHOOSE_EVENT_SPEAKERS: [
-                MessageHandler(Filters.regex(f'^{BACK_BUTTON_CAPTION}$'),
-                               choose_event_group_for_ask),
-                MessageHandler(Filters.regex(
-                    '^Задать новый вопрос$'), ask_question),
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON_CAPTION}$'),
-                               start),
-                MessageHandler(Filters.text,
-                               choose_event_speakers),
+                CaptionRouter({
+                    BACK_BUTTON_CAPTION: choose_event_group_for_ask,
+                    'Задать новый вопрос': ask_question,
+                    MAIN_MENU_BUTTON_CAPTION: start,
+                }),
+                MessageHandler(Filters.text, choose_event_speakers),
             ],
             QUESTION: [
-                MessageHandler(Filters.regex(f'^{BACK_BUTTON_CAPTION}$'),
-                               choose_event_group_for_ask),
+                CaptionRouter({
+                    BACK_BUTTON_CAPTION: choose_event_group_for_ask,
+                }),
                 MessageHandler(Filters.text, ask_question),
             ],
             SAVE_QUESTION: [
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON_CAPTION}$'),
-                               start),
+                CaptionRouter({
+                    MAIN_MENU_BUTTON_CAPTION: start,
+                    'Показать вопросы': show_answered_questions,
+                    PREVIOUS_ANSWERS_CAPTION: previous_answers,
+                    NEXT_ANSWERS_CAPTION: next_answers,
+                }),
                 MessageHandler(Filters.text, save_question),
             ],
             ANSWER: [
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON_CAPTION}$'),
-                               start),
-                MessageHandler(Filters.regex('^Следующий вопрос$'),
-                               partial(
-                                   new_question_from_the_speaker, next=True),
-                               ),
-                MessageHandler(Filters.text, answer_the_question)
+                CaptionRouter({
+                    MAIN_MENU_BUTTON_CAPTION: start,
+                    'Следующий вопрос': next_question,
+                }),
+                MessageHandler(Filters.text, answer_the_question),
             ],
             NEXT_QUESTION: [
-                MessageHandler(Filters.regex('^Следующий вопрос$'), partial(
-                    new_question_from_the_speaker, next=True)),
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON_CAPTION}$'),
-                               start),
+                CaptionRouter({
+                    'Следующий вопрос': next_question,
+                    MAIN_MENU_BUTTON_CAPTION: start,
+                }),
             ],
             INPUT_DONATE: [
+                CaptionRouter({BACK_BUTTON_CAPTION: start}),
                 MessageHandler(Filters.regex('^[1-9][0-9]+$'), pay_donate),
-                MessageHandler(Filters.regex(f'^{BACK_BUTTON_CAPTION}$'),
-                               start),
                 MessageHandler(Filters.text | ~Filters.command,
                                ask_donate_amount),
             ],
@@ -652,15 +733,81 @@ def main() -> None:
         ],
         per_user=True,
         per_chat=True,
-        allow_reentry=True
+        allow_reentry=True,
+        name='main',
+        persistent=True,
     )
 
     dispatcher.add_handler(precheckout_handler)
     dispatcher.add_handler(conv_handler)
     dispatcher.add_handler(CommandHandler('help', help_command))
 
+
+def create_bot(tg_token, con_pool_size=8) -> ExtBot:
+    """Create a bot recording the latency of the Bot API calls."""
+    return ExtBot(
+        tg_token,
+        os.getenv('TG_BASE_URL'),
+        request=InstrumentedRequest(con_pool_size=con_pool_size),
+    )
+
+
+def create_updater(tg_token, handler_threads=None) -> Updater:
+    """Create an updater with the bot handlers and persistent state.
+
+    With more than one handler thread the updates of different users are
+    processed concurrently.
+    """
+    if handler_threads is None:
+        handler_threads = int(os.getenv('BOT_HANDLER_THREADS', 1))
+    persistence = DjangoPersistence()
+    bot = create_bot(tg_token, con_pool_size=max(handler_threads, 4) + 8)
+    if handler_threads > 1:
+        job_queue = JobQueue()
+        dispatcher = ConcurrentDispatcher(
+            bot,
+            Queue(),
+            job_queue=job_queue,
+            persistence=persistence,
+            handler_threads=handler_threads,
+        )
+        job_queue.set_dispatcher(dispatcher)
+        updater = Updater(dispatcher=dispatcher, workers=None)
+    else:
+        updater = Updater(bot=bot, persistence=persistence)
+    setup_dispatcher(updater.dispatcher)
+    instrument_dispatcher(updater.dispatcher)
+    updater.job_queue.run_repeating(
+        flush_persistence, interval=PERSISTENCE_FLUSH_INTERVAL)
+    updater.job_queue.run_repeating(
+        publish_metrics_job, interval=METRICS_PUBLISH_INTERVAL)
+    return updater
+
+
+def main() -> None:
+    """Start the bot."""
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+    )
+    tg_token = os.getenv('TG_TOKEN')
+    webhook_url = os.getenv('TG_WEBHOOK_URL')
+    workers = int(os.getenv('BOT_WORKERS', 1))
+
+    if workers > 1 or webhook_url:
+        # The webhook stores the updates, the bot reads them in order
+        ShardedBot(tg_token, workers, webhook_url).run()
+        return
+
+    updater = create_updater(tg_token)
+    updater.job_queue.run_repeating(
+        process_mailing_jobs, interval=MAILING_POLL_INTERVAL, first=1)
+    outbox_sender = OutboxSender(updater.bot).start()
+    ReminderScheduler(updater.job_queue).start()
+
     updater.start_polling()
     updater.idle()
+    outbox_sender.stop()
 
 
 if __name__ == '__main__':
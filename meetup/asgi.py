@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meetup.settings')
+os.environ.setdefault('DJANGO_ASGI', 'true')
 
 application = get_asgi_application()
+
+# Imported once Django is set up
+from bot.metrics import start_metrics_publisher  # noqa: E402
+
+start_metrics_publisher()
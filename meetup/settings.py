@@ -32,6 +32,13 @@ SECRET_KEY = secret_key
 DEBUG = env.bool('DEBUG', True)
 ALLOWED_HOSTS = allowed_hosts
 
+# Secret part of the webhook URL, webhook mode is off while it is empty
+TG_WEBHOOK_SECRET = env.str('TG_WEBHOOK_SECRET', '')
+# Set by asgi.py to serve the async version of the webhook
+ASGI = env.bool('DJANGO_ASGI', False)
+# Bearer token required by /metrics/, the endpoint is open while it is empty
+METRICS_TOKEN = env.str('METRICS_TOKEN', '')
+
 
 # Application definition
 
@@ -46,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bot.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,7 +88,14 @@ WSGI_APPLICATION = 'meetup.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {"default": env.dj_db_url("DATABASE_URL", default="sqlite:///db.sqlite3")}
+DATABASES = {
+    "default": env.dj_db_url(
+        "DATABASE_URL",
+        default="sqlite:///db.sqlite3",
+        # Keep connections open between requests and bot updates
+        conn_max_age=env.int("DB_CONN_MAX_AGE", 60),
+    ),
+}
 
 
 # Password validation
@@ -107,7 +122,8 @@ AUTH_PASSWORD_VALIDATORS = [
 
 LANGUAGE_CODE = 'en-us'
 
-TIME_ZONE = 'UTC'
+# Also the default time zone of the meetups, their talks are in local time
+TIME_ZONE = env.str('TIME_ZONE', 'UTC')
 
 USE_I18N = True
 
@@ -13,9 +13,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 
+from bot import views
+from bot.webhook import webhook_path
+
+telegram_webhook = views.telegram_webhook
+if settings.ASGI:
+    telegram_webhook = views.telegram_webhook_async
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', views.metrics, name='metrics'),
+    path(webhook_path('<str:secret>'), telegram_webhook,
+         name='telegram_webhook'),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meetup.settings')
 
 application = get_wsgi_application()
+
+# Imported once Django is set up
+from bot.metrics import start_metrics_publisher  # noqa: E402
+
+start_metrics_publisher()